@@ -7,6 +7,12 @@ speech_data_dir = 'cache/acquire/noah'
 
 # serial port
 mcu_serial_port = '/dev/tty.usbmodem141342103'
+mcu_baudrate = 115200
+# baud rate negotiated for continuous inference with binary reports, None to keep text reports
+mcu_fast_baudrate = 921600
+# ports of the boards in the device farm, None to discover all boards with mcu_farm_usb_vid
+mcu_farm_ports = None
+mcu_farm_usb_vid = 0x0483 # ST-LINK
 
 # audio and MFCC settings
 sample_len_seconds = 2.0
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import edison.audio.audioutils as au
+
+from config import *
+
+def main(argv):
+  if len(argv) > 1 and argv[1] in ['-h', '--help']:
+    print('Usage:')
+    print('  pack [<data_dir> [<out_dir>]]')
+    print('    Pack all wav files of data_dir (default %s) into out_dir (default <data_dir>_packed)' % (speech_data_dir))
+    print('    Pass out_dir as data_path to load_own_speech_commands to load from the packed corpus')
+    exit()
+
+  data_dir = argv[1] if len(argv) > 1 else speech_data_dir
+  out_dir = argv[2] if len(argv) > 2 else data_dir.rstrip('/')+'_packed'
+  if au.pack_corpus(data_dir, out_dir) < 0:
+    exit(1)
@@ -1 +1 @@
-__all__=['audioutils', 'bit_depth_analyze']
\ No newline at end of file
+__all__=['audioutils', 'augment', 'bit_depth_analyze']
\ No newline at end of file
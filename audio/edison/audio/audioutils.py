@@ -7,24 +7,190 @@
 scDataPath = '/tmp/speech_commands_v0.02'
 scDownloadURL = 'http://download.tensorflow.org/data/speech_commands_v0.02.tar.gz'
 
+def read_wavs(fnames, n_threads=None, verbose=True):
+  """
+    Read wav files concurrently with a thread pool, float32 data is converted to int16
+
+    returns list of (fs, data) in the order of fnames
+  """
+  import os
+  from concurrent.futures import ThreadPoolExecutor
+  from scipy.io import wavfile
+  from tqdm import tqdm
+
+  def read(fname):
+    fs, data = wavfile.read(fname)
+    if data.dtype == 'float32':
+      data = ( (2**15-1)*data).astype('int16')
+    return fs, data
+
+  # file reading is I/O bound and releases the GIL
+  if n_threads is None:
+    n_threads = min(32, 4*os.cpu_count())
+  with ThreadPoolExecutor(max_workers=n_threads) as ex:
+    return list(tqdm(ex.map(read, fnames), total=len(fnames), disable=not verbose))
+
+def clips_to_array(clips, sample_len, frame_length=None):
+  """
+    Pad or cut clips into one preallocated int16 array of shape [N, sample_len].
+
+      clips         list of 1D sample arrays
+      sample_len    length of each output row, longer clips are cut
+      frame_length  None to pad short clips at the end with their last sample, else each
+                    short clip is zero padded and placed at every multiple of frame_length
+                    that fits, giving one row per position
+
+    returns x, src, cut_cnt where src[i] is the index into clips of row i. Empty clips are skipped.
+  """
+  import numpy as np
+
+  lens = np.array([len(c) for c in clips], dtype='int64')
+  if frame_length is None:
+    n_rows = np.where(lens > 0, 1, 0)
+  else:
+    n_rows = np.where(lens >= sample_len, 1, 1 + np.maximum(sample_len-lens, 0)//frame_length)
+    n_rows[lens == 0] = 0
+
+  x = np.zeros((int(n_rows.sum()), sample_len), dtype='int16')
+  src = np.repeat(np.arange(len(clips)), n_rows)
+  row = 0
+  for i, c in enumerate(clips):
+    n = len(c)
+    if n == 0:
+      continue
+    if n >= sample_len:
+      x[row] = c[:sample_len]
+    elif frame_length is None:
+      x[row, :n] = c
+      x[row, n:] = c[-1]
+    else:
+      # shift samples around
+      for prepad in range(0, n_rows[i]*frame_length, frame_length):
+        x[row + prepad//frame_length, prepad:prepad+n] = c
+    row += n_rows[i]
+  return x, src, int(np.count_nonzero(lens >= sample_len))
+
+def pack_corpus(data_path, out_path, test_val_size=0.2, n_threads=None):
+  """
+    Pack all wav files below data_path into one corpus directory for fast loading
+
+      out_path/samples.npy  all samples as one contiguous int16 blob
+      out_path/index.npz    per clip offset, length, label, speaker, split and file name
+
+    Files are named <label>/<file>.wav. Speaker is taken from Speech Commands style names
+    <speaker>_nohash_<n>.wav or from the directory above the label. Splits are taken from
+    testing_list.txt and validation_list.txt if present, else from a hash of the file name,
+    so the assignment of a file never changes when new files are added.
+  """
+  from os import path
+  import hashlib
+  import pathlib
+  import numpy as np
+  from pathlib import Path
+
+  if not path.exists(data_path):
+    print('Folder not found:', data_path)
+    return -1
+
+  data_path = str(Path(data_path))
+  fnames = sorted(str(x.relative_to(data_path)) for x in Path(data_path).rglob("*.wav"))
+  print('Packing files count:', len(fnames))
+  wavs = read_wavs([data_path+'/'+f for f in fnames], n_threads=n_threads)
+
+  fs = set(fs_in for fs_in, _ in wavs)
+  if len(fs) > 1:
+    print('Samplerate mismatch! Found',fs)
+    return -1
+
+  lengths = np.array([len(data) for _, data in wavs], dtype='int64')
+  offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype('int64')
+
+  # labels and speakers as index into name lists
+  label_names, labels = np.unique([f.split('/')[-2] for f in fnames], return_inverse=True)
+  def speaker(f):
+    parts = (data_path+'/'+f).split('/')
+    return parts[-1].split('_nohash_')[0] if '_nohash_' in parts[-1] else parts[-3]
+  speaker_names, speakers = np.unique([speaker(f) for f in fnames], return_inverse=True)
+
+  # split: 0 train, 1 test, 2 validation
+  split = np.zeros(len(fnames), dtype='int8')
+  if path.exists(data_path+'/testing_list.txt'):
+    with open(data_path+'/testing_list.txt') as fd:
+      test_set = set(x.strip() for x in fd.readlines())
+    with open(data_path+'/validation_list.txt') as fd:
+      val_set = set(x.strip() for x in fd.readlines())
+    split[[f in test_set for f in fnames]] = 1
+    split[[f in val_set for f in fnames]] = 2
+  else:
+    for i, f in enumerate(fnames):
+      h = int(hashlib.sha1(f.encode()).hexdigest()[:8], 16) / 2**32
+      if h < test_val_size/2:
+        split[i] = 1
+      elif h < test_val_size:
+        split[i] = 2
+
+  pathlib.Path(out_path).mkdir(parents=True, exist_ok=True)
+  samples = np.lib.format.open_memmap(out_path+'/samples.npy', mode='w+', dtype='int16', shape=(int(lengths.sum()),))
+  for (_, data), offset, length in zip(wavs, offsets, lengths):
+    samples[offset:offset+length] = data
+  samples.flush()
+  np.savez(out_path+'/index.npz', offsets=offsets, lengths=lengths, labels=labels.astype('int32'),
+    label_names=label_names, speakers=speakers.astype('int32'), speaker_names=speaker_names,
+    split=split, fnames=np.array(fnames), fs=np.array(fs.pop() if len(fs) else 0))
+
+  print('Packed %d clips, %d samples into %s (train %d test %d validation %d)' % (len(fnames),
+    lengths.sum(), out_path, np.count_nonzero(split==0), np.count_nonzero(split==1), np.count_nonzero(split==2)))
+  return 0
+
+def load_packed_corpus(corpus_path, mmap_mode='r'):
+  """
+    Load a corpus written by pack_corpus. Samples are memory mapped, clip i is
+    corpus['samples'][corpus['offsets'][i]:corpus['offsets'][i]+corpus['lengths'][i]],
+    see packed_clips.
+
+    returns dict with samples, offsets, lengths, labels, label_names, speakers, speaker_names,
+    split (0 train, 1 test, 2 validation), fnames and fs
+  """
+  import numpy as np
+
+  with np.load(corpus_path+'/index.npz') as npz:
+    corpus = {k: npz[k] for k in npz.files}
+  corpus['fs'] = int(corpus['fs'])
+  corpus['samples'] = np.load(corpus_path+'/samples.npy', mmap_mode=mmap_mode)
+  return corpus
+
+def packed_clips(corpus, idx=None):
+  """
+    List of clips of a packed corpus as views into the memory map, all if idx is None
+  """
+  if idx is None:
+    idx = range(len(corpus['offsets']))
+  samples, offsets, lengths = corpus['samples'], corpus['offsets'], corpus['lengths']
+  return [samples[offsets[i]:offsets[i]+lengths[i]] for i in idx]
+
 def load_own_speech_commands(data_path, keywords=None, coldwords=None, fs=16000, sample_len=2*16000, frame_length=1024, playsome=False, test_val_size=0.2, noise=0.10):
   """
-    Load data from the own recorded set
+    Load data from the own recorded set. data_path can also be a corpus packed with pack_corpus,
+    its clips keep the train/test/validation split stored by pack_corpus.
 
     X_train, y_train, X_test, y_test, X_val, y_val, keywords = load_speech_commands(keywords=None, sample_len=2*16000, playsome=False, test_val_size=0.2)
   """
   from os import path
-  from tqdm import tqdm
   import numpy as np
   from pathlib import Path
-  from scipy.io import wavfile
 
   # if directory does not exist
   if not path.exists(data_path):
     print('Folder not found:', data_path)
     return -1
 
-  all_data = [str(x) for x in list(Path(data_path).rglob("*.wav"))]
+  # packed corpus or directory tree of wav files
+  corpus = None
+  if path.exists(data_path+'/index.npz'):
+    corpus = load_packed_corpus(data_path)
+    all_data = list(corpus['fnames'])
+  else:
+    all_data = [str(x) for x in list(Path(data_path).rglob("*.wav"))]
 
   data_to_use = []
 
@@ -43,76 +209,52 @@ def load_own_speech_commands(data_path, keywords=None, coldwords=None, fs=16000,
   print('Using keywords: ', keywords)
 
   print('Loading files count:', len(all_data))
-  x_list = []
-  y_list = []
-  cut_cnt = 0
-  already_appended = False
-  for i in tqdm(range(len(data_to_use))): 
-    fs_in, data = wavfile.read(data_to_use[i])
+  if corpus is not None:
+    fname_idx = {f: i for i, f in enumerate(all_data)}
+    wavs = [(corpus['fs'], data) for data in packed_clips(corpus, [fname_idx[f] for f in data_to_use])]
+  else:
+    wavs = read_wavs(data_to_use)
+  for fname, (fs_in, data) in zip(data_to_use, wavs):
     if fs_in != fs:
       print('Samplerate mismatch! In',fs_in,'expected',fs)
       exit()
-    if data.dtype == 'float32':
-      data = ( (2**15-1)*data).astype('int16')
-    x = data.copy()
-    if len(x) == 0:
-      print('PAAANIIIIcc')
-      continue
-    # Cut/pad sample
-    already_appended = False
-    if x.shape[0] < sample_len:
-      # x = np.pad(x, (0, sample_len-x.shape[0]), mode='edge')
-      # print(x.shape)
-      # shift samples around
-      pad_variants = 1 +(sample_len-x.shape[0])//frame_length
-      # fig = plt.figure()
-      # ax = fig.add_subplot(111)
-      for pad_variant_cnt in range(pad_variants):
-        prepad = pad_variant_cnt*frame_length
-        postpad = sample_len-x.shape[0]-prepad
-        chunk = np.pad(x.copy(), (prepad, postpad), mode='constant', constant_values=(0,0))
-        # ax.plot(chunk)
-        assert chunk.shape[0] == sample_len
-        # add to sample list
-        already_appended = True
-        x_list.append(chunk)
-        if data_to_use[i].split('/')[-2] in keywords:
-          y_list.append(keywords.index(data_to_use[i].split('/')[-2]))
-        else:
-          y_list.append(keywords.index('_cold'))
-      # plt.show()
-    else:
-      cut_cnt += 1
-      x = x[:sample_len]
-
-    # add to sample list
-    if not already_appended:
-      assert x.shape[0] == sample_len
-      x_list.append(x)
-      if data_to_use[i].split('/')[-2] in keywords:
-        y_list.append(keywords.index(data_to_use[i].split('/')[-2]))
-      else:
-        y_list.append(keywords.index('_cold'))
+    if len(data) == 0:
+      print('PAAANIIIIcc', fname)
+
+  # cut or pad into one array, short samples are shifted around in steps of frame_length
+  x, src, cut_cnt = clips_to_array([data for _, data in wavs], sample_len, frame_length=frame_length)
+  labels = np.array([keywords.index(f.split('/')[-2]) if f.split('/')[-2] in keywords else keywords.index('_cold')
+    for f in data_to_use], dtype='int64')
+  y = labels[src]
+  if corpus is not None:
+    # split of each row from the corpus, all shifted copies of a clip are in the same set
+    split = corpus['split'][[fname_idx[f] for f in data_to_use]][src]
 
   print('Had to cut',cut_cnt,'samples')
 
-  # add noise to samples
+  # add noise to samples, seeded so the same clips are generated on every load and their
+  # features can be reused from the MFCC store
   noise_ampl = 0.01
   if noise > 0:
     keywords.append('_noise')
-    for n in range(int(noise*len(x_list))):
-      rnd = np.random.normal(0,1,size=sample_len)
-      x_list.append( np.array((2**15-1)*noise_ampl*rnd/rnd.max(), dtype='int16') )
-      assert x_list[-1].shape[0] == sample_len
-      y_list.append(keywords.index('_noise'))
-
-  x = np.asarray(x_list)
-  y = np.asarray(y_list)
+    n_noise = int(noise*len(x))
+    rnd = np.random.RandomState(42).normal(0,1,size=(n_noise,sample_len))
+    x_noise = np.array((2**15-1)*noise_ampl*rnd/rnd.max(axis=1, keepdims=True), dtype='int16')
+    x = np.concatenate((x, x_noise))
+    y = np.concatenate((y, np.full(n_noise, keywords.index('_noise'))))
+    if corpus is not None:
+      # noise is not in the corpus, split it in the proportions of train_test_split below
+      r = np.random.RandomState(42).rand(n_noise)
+      split = np.concatenate((split, np.where(r < test_val_size, 1, np.where(r < test_val_size+0.25*(1-test_val_size), 2, 0))))
 
   print('Splitting into train/test/validation sets')
-  from sklearn.model_selection import train_test_split
-  X_train, X_test, y_train, y_test = train_test_split(x, y, test_size=test_val_size, random_state=42)
-  X_train, X_val, y_train, y_val  = train_test_split(X_train, y_train, test_size=0.25, random_state=42)
+  if corpus is not None:
+    X_train, X_test, X_val = x[split == 0], x[split == 1], x[split == 2]
+    y_train, y_test, y_val = y[split == 0], y[split == 1], y[split == 2]
+  else:
+    from sklearn.model_selection import train_test_split
+    X_train, X_test, y_train, y_test = train_test_split(x, y, test_size=test_val_size, random_state=42)
+    X_train, X_val, y_train, y_val  = train_test_split(X_train, y_train, test_size=0.25, random_state=42)
 
   print("total files=%d trainsize=%d testsize=%d validationsize=%d fs=%.0f" % 
     (len(data_to_use), len(X_train), len(X_test), len(X_val), fs))
@@ -187,13 +329,14 @@ def load_speech_commands(keywords = ['cat','marvin','left','zero'],
     validation_data = [scDataPath+'/'+x.strip() for x in fd.readlines()]
 
   print('use only samples that are in keywords')
-  all_data = [x for x in all_data if x.split('/')[-2] in keywords]
-  test_data = [x for x in test_data if x.split('/')[-2] in keywords]
-  validation_data = [x for x in validation_data if x.split('/')[-2] in keywords]
+  keyword_set = set(keywords)
+  all_data = [x for x in all_data if x.split('/')[-2] in keyword_set]
+  test_data = [x for x in test_data if x.split('/')[-2] in keyword_set]
+  validation_data = [x for x in validation_data if x.split('/')[-2] in keyword_set]
 
   print('scrap data files that are not in test/validation data')
-  train_data = [x for x in all_data if x not in test_data]
-  train_data = [x for x in train_data if x not in validation_data]
+  test_val_set = set(test_data) | set(validation_data)
+  train_data = [x for x in all_data if x not in test_val_set]
 
   fs, _ = wavfile.read(train_data[0])
 
@@ -204,32 +347,18 @@ def load_speech_commands(keywords = ['cat','marvin','left','zero'],
   print("Loading data: trainsize=%d  testsize=%d  validationsize=%d fs=%.0f" % 
     (len(train_data), len(test_data), len(validation_data), fs))
 
-  cut_cnt = 0
+  keyword_idx = {k: i for i, k in enumerate(keywords)}
   def extract(fnames, sample_len):
-    x_list = []
-    y_list = []
-    for i in tqdm(range(len(fnames))): 
-      fs, data = wavfile.read(fnames[i])
-      x = data.copy()
-
-      # Cut/pad sample
-      if x.shape[0] < sample_len:
-        x = np.pad(x, (0, sample_len-x.shape[0]), mode='edge')
-      else:
-        cut_cnt += 1
-        x = x[:sample_len]
-
-      # add to sample list
-      x_list.append(x)
-      y_list.append(keywords.index(fnames[i].split('/')[-2]))
-      
-    return np.asarray(x_list), np.asarray(y_list)
-
+    # read concurrently, pad with last sample or cut into one array
+    x, src, cut_cnt = clips_to_array([data for _, data in read_wavs(fnames)], sample_len)
+    y = np.array([keyword_idx[f.split('/')[-2]] for f in fnames], dtype='int64')[src]
+    return x, y, cut_cnt
 
   # Will store data here
-  x_train, y_train = extract(train_data, sample_len)
-  x_test, y_test = extract(test_data, sample_len)
-  x_validation, y_validation = extract(validation_data, sample_len)
+  x_train, y_train, cut_cnt_train = extract(train_data, sample_len)
+  x_test, y_test, cut_cnt_test = extract(test_data, sample_len)
+  x_validation, y_validation, cut_cnt_val = extract(validation_data, sample_len)
+  cut_cnt = cut_cnt_train + cut_cnt_test + cut_cnt_val
 
   # Load noise from wav files
   if noise is not None:
@@ -241,11 +370,9 @@ def load_speech_commands(keywords = ['cat','marvin','left','zero'],
       # list of files used as noise
       noise_data = [str(x) for x in list(Path(scDataPath+'/'+noise_folder).rglob("*.wav"))]
 
-      for fname in noise_data:
+      for fname, (fs, data) in zip(noise_data, read_wavs(noise_data)):
         print('working on file',fname)
-        # load data
-        fs, data = wavfile.read(fname)
-        x = data.copy()
+        x = data
         # print('  file shape',data.shape)
         # split noise samples in junks of sample_len
         n_smp = x.shape[0] // sample_len
@@ -283,23 +410,13 @@ def load_speech_commands(keywords = ['cat','marvin','left','zero'],
       # list of files used as noise
       cold_data = [str(x) for x in list(Path(scDataPath+'/'+cold_folder).rglob("*.wav"))]
 
-      for fname in cold_data:
-        # load data
-        fs, data = wavfile.read(fname)
-        x = data.copy()
-
-        # Cut/pad sample
-        if x.shape[0] < sample_len:
-          x = np.pad(x, (0, sample_len-x.shape[0]), mode='edge')
-        else:
-          cut_cnt += 1
-          x = x[:sample_len]
-        # add to sample list
-        x_list.append(x)
-        y_list.append(keywords.index('_cold'))
+      cold_x, _, cold_cut = clips_to_array([data for _, data in read_wavs(cold_data)], sample_len)
+      cut_cnt += cold_cut
+      x_list.append(cold_x)
+      y_list.append(np.full(len(cold_x), keywords.index('_cold')))
 
-    x_list = np.asarray(x_list)
-    y_list = np.asarray(y_list)
+    x_list = np.concatenate(x_list)
+    y_list = np.concatenate(y_list)
 
     # split into train/test
     from sklearn.model_selection import train_test_split
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+  Online data augmentation of raw int16 clips. Every batch gets new random time shift,
+  speed, gain and background noise, so the data set does not have to hold shifted or
+  noisy copies of the clips.
+
+    aug = Augmenter(noise=load_noise(au.scDataPath+'/_background_noise_'))
+    x_batch = aug(x_batch)
+"""
+
+import numpy as np
+
+def load_noise(noise_dir, fs=16000):
+  """
+    Background noise clips of all wav files below noise_dir, e.g. the _background_noise_
+    folder of speech commands. Returns list of int16 arrays or None if there are none
+  """
+  from os import path
+  from pathlib import Path
+  import edison.audio.audioutils as au
+
+  if not path.exists(noise_dir):
+    print('Folder not found:', noise_dir)
+    return None
+  fnames = sorted(str(x) for x in Path(noise_dir).rglob("*.wav"))
+  clips = [data for fs_in, data in au.read_wavs(fnames, verbose=False) if fs_in == fs and data.ndim == 1]
+  if len(clips) != len(fnames):
+    print('Skipped %d noise files with wrong samplerate or channels' % (len(fnames)-len(clips)))
+  return clips if len(clips) else None
+
+class Augmenter:
+  """
+    Random augmentation of a batch of clips, each step is applied with its probability.
+
+      noise       list of background noise clips to mix in, None for white noise
+      snr_db      range of signal to noise ratio in dB of the noise mixing
+      shift       maximum time shift in samples, a clip is only shifted into its leading
+                  and trailing zeros so the onset and the end are not cut
+      gain_db     range of gain in dB
+      speed       range of speed factor, resampled by linear interpolation
+      p_*         probability of each step
+  """
+  def __init__(self, noise=None, snr_db=(5.0, 20.0), shift=4000, gain_db=(-6.0, 6.0), speed=(0.9, 1.1),
+      p_noise=0.8, p_shift=1.0, p_gain=1.0, p_speed=0.5):
+    self.noise = None if noise is None else [np.asarray(n, dtype='float32') for n in noise]
+    self.snr_db = snr_db
+    self.shift = shift
+    self.gain_db = gain_db
+    self.speed = speed
+    self.p_noise = p_noise
+    self.p_shift = p_shift
+    self.p_gain = p_gain
+    self.p_speed = p_speed
+
+  def __call__(self, x, rng=None):
+    """
+      Augment batch x [n, samples], returns a new int16 array of the same shape
+    """
+    if rng is None:
+      rng = np.random.default_rng()
+    x = np.array(x, dtype='float32', ndmin=2)
+    n, n_samples = x.shape
+
+    for i in np.flatnonzero(rng.random(n) < self.p_speed):
+      x[i] = self._resample(x[i], rng.uniform(*self.speed))
+
+    for i in np.flatnonzero(rng.random(n) < self.p_shift):
+      nz = np.flatnonzero(x[i])
+      if len(nz) == 0:
+        continue
+      lo, hi = max(-self.shift, -nz[0]), min(self.shift, n_samples-1-nz[-1])
+      x[i] = self._shift(x[i], int(rng.integers(lo, hi+1)))
+
+    sel = rng.random(n) < self.p_gain
+    x[sel] *= 10.0**(rng.uniform(*self.gain_db, size=(np.count_nonzero(sel), 1))/20.0)
+
+    sel = np.flatnonzero(rng.random(n) < self.p_noise)
+    if len(sel):
+      noise = self._noise(len(sel), n_samples, rng)
+      # scale noise to snr relative to the clip power, silent clips get the noise at unit gain
+      p_sig = np.mean(x[sel]**2, axis=1, keepdims=True)
+      p_noise = np.mean(noise**2, axis=1, keepdims=True) + 1e-9
+      snr = 10.0**(rng.uniform(*self.snr_db, size=(len(sel), 1))/10.0)
+      scale = np.where(p_sig > 0, np.sqrt(p_sig/(p_noise*snr)), 1.0)
+      x[sel] += scale*noise
+
+    return np.clip(np.rint(x), -2**15, 2**15-1).astype('int16')
+
+  def _resample(self, clip, speed):
+    # play speed times faster, keep the length
+    t = np.arange(len(clip))*speed
+    return np.interp(t, np.arange(len(clip)), clip, right=0.0)
+
+  def _shift(self, clip, shift):
+    out = np.zeros_like(clip)
+    if shift >= 0:
+      out[shift:] = clip[:len(clip)-shift]
+    else:
+      out[:shift] = clip[-shift:]
+    return out
+
+  def _noise(self, n, n_samples, rng):
+    if self.noise is None:
+      return rng.normal(0, 1, size=(n, n_samples)).astype('float32')
+    out = np.zeros((n, n_samples), dtype='float32')
+    for i in range(n):
+      src = self.noise[rng.integers(len(self.noise))]
+      if len(src) <= n_samples:
+        out[i, :len(src)] = src
+      else:
+        start = rng.integers(len(src)-n_samples)
+        out[i] = src[start:start+n_samples]
+    return out
@@ -35,9 +35,9 @@ mic_data = []
 # abort when
 abort_after = 200
 
-mfcc_fun = mfu.mfcc_mcu
-# mfcc_fun = mfu.mfcc
-# mfcc_fun = mfu.mfcc_tf
+mfcc_fun = mfu.mfcc_mcu_batch
+# import edison.mfcc.mfcc_q15 as mfq
+# mfcc_fun = mfq.mfcc_q15_batch
 
 ######################################################################
 # Host 
@@ -45,10 +45,8 @@ mfcc_fun = mfu.mfcc_mcu
 def kwsHostThd(xdata, ydata, mic_data):
   global abort_after
 
-  net_input = np.array([], dtype='int16')
-  init = 1
+  streaming_mfcc = mfu.StreamingMfcc(mfcc_fun=mfcc_fun, n_frames=input_shape[0], num_mfcc=input_shape[1])
   frame_ctr = 0
-  mfcc = np.array([])
   last_pred = 0
 
   import sounddevice as sd
@@ -61,39 +59,32 @@ def kwsHostThd(xdata, ydata, mic_data):
       frame_ctr += 1
       mic_data.append(frame)
 
-      nSamples = 1024
-      o_mfcc = mfcc_fun(frame, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
-      data_mfcc = np.array([x['mfcc'][:num_mfcc] for x in o_mfcc])
-
-      if init == 1:
-        net_input = np.append(net_input.ravel(), data_mfcc)
-        if (frame_ctr >= n_frames):
-          print('Live!')
-          init = 0
-
-      else:
-        net_input = np.array(net_input.reshape([1]+input_shape), dtype='float32')
-        host_pred = model.predict(net_input)[0]
-        net_input = np.append(data_mfcc, net_input.ravel()[:-num_mfcc])
-
-        if (host_pred.max() > threshold):
-          spotted_kwd = keywords[np.argmax(host_pred)]
-          if spotted_kwd[0] != '_':
-            print('Spotted', spotted_kwd)
-        np.set_printoptions(suppress=True, precision=2)
-        print(host_pred)
-        last_pred = host_pred
-        
-        host_mfcc = net_input.reshape(n_frames,num_mfcc)
-
-        # plotting
-        xdata.append(xdata[-1] + frame_length/fs)
-        ydata.append( np.array(host_pred).reshape(1,output_size) )
-
-        abort_after -= 1
-        if abort_after == 0:
-          return
+      # only the new frame is calculated, window holds the last n_frames
+      streaming_mfcc.push(frame)
+
+      if not streaming_mfcc.ready:
+        continue
+      if frame_ctr == n_frames:
+        print('Live!')
+
+      net_input = streaming_mfcc.window.reshape([1]+input_shape)
+      host_pred = model.predict(net_input)[0]
+
+      if (host_pred.max() > threshold):
+        spotted_kwd = keywords[np.argmax(host_pred)]
+        if spotted_kwd[0] != '_':
+          print('Spotted', spotted_kwd)
+      np.set_printoptions(suppress=True, precision=2)
+      print(host_pred)
+      last_pred = host_pred
+
+      # plotting
+      xdata.append(xdata[-1] + frame_length/fs)
+      ydata.append( np.array(host_pred).reshape(1,output_size) )
+
+      abort_after -= 1
+      if abort_after == 0:
+        return
 
 
 ######################################################################
@@ -109,6 +100,11 @@ def kwsMCUThd(xdata, ydata):
 
   import edison.mcu.mcu_util as mcu
 
+  # faster link and binary reports, the text reports can not keep up with the frame rate
+  if mcu_fast_baudrate is not None:
+    if mcu.configureLink(mcu_fast_baudrate, binary_reports=True) < 0:
+      print('Link configuration failed, using text reports')
+
   if mcu.sendCommand('kws_mic_continuous') < 0:
     print('MCU error')
     exit()
@@ -116,24 +112,34 @@ def kwsMCUThd(xdata, ydata):
   net_outs, ampls, likelys, spotteds = [],[],[],[]
   while True:
 
-    net_out, ampl, likely, spotted = mcu.getSingleLiveInference()
-    
-    net_outs.append(net_out)
-    ampls.append(ampl)
-    likelys.append(likely)
-    spotteds.append(spotted)
-    
-    print(net_out)
-    if spotted is not None:
-      print(spotted)
-
-    # plotting
-    xdata.append(xdata[-1] + frame_length/fs)
-    ydata.append( np.array(net_out).reshape(1,output_size) )
+    pred = mcu.getSingleLiveInference()
+    if pred is None:
+      # stop the MCU and return what arrived so far
+      print('No prediction from MCU')
+      abort_after = 1
+    else:
+      net_out, ampl, likely, spotted = pred
+      
+      net_outs.append(net_out)
+      ampls.append(ampl)
+      likelys.append(likely)
+      spotteds.append(spotted)
+      
+      print(net_out)
+      if spotted is not None:
+        print(spotted)
+
+      # plotting
+      xdata.append(xdata[-1] + frame_length/fs)
+      ydata.append( np.array(net_out).reshape(1,output_size) )
 
     abort_after -= 1
     if abort_after == 0:
       mcu.write(b'0')
+      if mcu.defaultLink().binary_reports:
+        # let the last report arrive and go back to default settings
+        sleep(0.1)
+        mcu.configureLink(mcu_baudrate, binary_reports=False)
       return np.array(net_outs), np.array(ampls), np.array(likelys), np.array(spotteds)
 
 def netOutFilt(net_outs, alpha):
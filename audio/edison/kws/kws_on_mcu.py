@@ -5,6 +5,7 @@
 # @Last Modified time: 2020-05-28 15:32:51
 
 import sys
+import asyncio
 
 
 import numpy as np
@@ -17,15 +18,21 @@ import scipy.io.wavfile as wavfile
 import keras
 import tensorflow as tf
 import edison.mfcc.mfcc_utils as mfu
+import edison.mfcc.mfcc_q15 as mfq
+import edison.mcu.mcu_async as mca
 
 # Settings
 from config import *
 
 model_file = cache_dir+'../../firmware/src/ai/cube/kws/kws_model.h5'
-keywords = np.load(cache_dir+'kws_keras/keywords.npy')
+data_dir = cache_dir+'kws_keras/'
+keywords = np.load(data_dir+'keywords.npy')
 
 from_file = 0
 
+# test samples per batched transaction in evalset mode
+eval_batch_size = 32
+
 # define net type running on target (cube/nnom)
 net_type = 'cube'
 
@@ -215,6 +222,30 @@ def mfccAndInfereOnMCU(data, progress=False):
   
   return mcu_mfccs, mcu_pred
 
+async def mfccAndInfereOnMCUAsync(link, data):
+  """
+    Same as mfccAndInfereOnMCU on an AsyncMcuLink. All transfers are queued at once and run
+    on the link thread in the same lockstep as mfccAndInfereOnMCU, the caller can compute on
+    the host while awaiting.
+    Returns mfccs, pred or None, None if a transfer failed
+  """
+  if data.dtype == 'float32':
+    data = ( (2**15-1)*data).astype('int16')
+
+  link.reset()
+  link.send_command('mfcc_kws_frame')
+  for frame in range(n_frames):
+    link.send_data(data[frame*frame_step:frame*frame_step+frame_length], 0)
+    link.wait_for_mcu_ready()
+
+  # MCU now runs inference, wait for complete
+  link.wait_for_mcu_ready()
+
+  # MCU returns net input and output
+  mfccs_fut = link.receive_data()
+  (mcu_mfccs, _), (mcu_pred, _) = await asyncio.gather(mfccs_fut, link.receive_data())
+  return mcu_mfccs, mcu_pred
+
 def micAndAllOnMCU():
   """
     Records a sample from mic and processes it
@@ -242,34 +273,115 @@ def micAndAllOnMCU():
 
 def singleInference(repeat = 1):
   """
-    Run a single inference on MCU
+    Run a single inference on MCU, repeat times on different random data. All inputs are
+    sent in one batched transaction
   """
+  import edison.mcu.mcu_util as mcu
 
   # generate some random data
   np.random.seed(20)
 
-  host_preds = []
-  mcu_preds = []
-  for i in range(repeat):
-    if net_type == 'cube':
-      net_input = np.array(np.random.rand(input_size).reshape([1]+input_shape), dtype='float32')
-    elif net_type == 'nnom':
-      # net_input = np.array(np.random.randint(-128,128,input_size).reshape([1]+input_shape), dtype='int8')
-      net_input = np.array(np.zeros(input_size).reshape([1]+input_shape), dtype='int8')
+  if net_type == 'cube':
+    net_inputs = np.array(np.random.rand(repeat*input_size).reshape([repeat]+input_shape), dtype='float32')
+  elif net_type == 'nnom':
+    # net_inputs = np.array(np.random.randint(-128,128,repeat*input_size).reshape([repeat]+input_shape), dtype='int8')
+    net_inputs = np.array(np.zeros(repeat*input_size).reshape([repeat]+input_shape), dtype='int8')
 
-    # predict on CPU
-    host_preds.append(model.predict(net_input)[0])
+  # predict on CPU
+  host_preds = model.predict(net_inputs)
+
+  # predict on MCU
+  mcu_preds = mcu.batchInference(net_inputs, progress=True)
+  if mcu_preds is None:
+    exit()
+
+  # report
+  for i in range(repeat):
+    report(host_preds[i], mcu_preds[i])
 
-    # predict on MCU
-    mcu_preds.append(infereOnMCU(net_input, progress=True))
-    
-    # report
-    report(host_preds[-1], mcu_preds[-1])
-    
-  mcu_preds = np.array(mcu_preds)
-  host_preds = np.array(host_preds)
   compare(host_preds, mcu_preds, 'predictions')
 
+def evalSet(args, farm=False):
+  """
+    Stream the cached test set through the MCU in batches and compare with the host model.
+    Reports host vs MCU confusion matrix, per class accuracy, agreement rate and latency.
+      args  [n] number of test samples, default all
+      farm  spread the batches over all boards of the device farm, see mcu_farm.py
+  """
+  import edison.mcu.mcu_farm as mcu_farm
+  import edison.mcu.telemetry as telemetry
+  import edison.train.mmap_data as mmd
+  from sklearn.metrics import confusion_matrix
+
+  _, x_test, _, _, y_test, _, _ = mmd.load_cached(data_dir, mmap_mode='r')
+  n = min(int(args[0]), len(x_test)) if len(args) else len(x_test)
+  x_test, y_test = x_test[:n], y_test[:n]
+  print('Evaluating %d test samples' % (n))
+
+  def netInput(x):
+    x = np.asarray(x, dtype='float32').reshape([-1]+input_shape)
+    if net_type == 'nnom':
+      x = np.clip(x * nnom_net_input_scale, nnom_net_input_clip_min, nnom_net_input_clip_max).astype('int8')
+    return x
+
+  # predict on CPU
+  host_preds = model.predict(mmd.kerasSequence(x_test, y_test, batch_size=eval_batch_size, shuffle=False,
+    transform=lambda x: x.reshape([-1]+input_shape)))
+
+  # predict on MCU, one batched transaction per eval_batch_size samples. Telemetry is
+  # fetched after each batch, so every inference has a latency record
+  with mcu_farm.McuFarm(None if farm else [mcu_serial_port]) as boards:
+    tels = []
+    for board in boards.boards:
+      board.link.getTelemetry() # discard records from before the evaluation
+      tels.append(telemetry.TelemetryCollector(board.link))
+    tel_of_port = {board.port: tel for board, tel in zip(boards.boards, tels)}
+
+    def job(link, start):
+      pred = link.batchInference(netInput(x_test[start:start+eval_batch_size]), progress=False)
+      tel_of_port[link.port].poll()
+      return pred
+    mcu_preds = boards.map(job, [(start,) for start in range(0, n, eval_batch_size)])
+    if len(boards) > 1:
+      boards.report()
+  if any(pred is None for pred in mcu_preds):
+    exit()
+  mcu_preds = np.concatenate(mcu_preds)
+  latencies = np.concatenate([tel.series('inference')[1] for tel in tels])
+
+  np.savez(cache_dir+'/evalset.npz', host_preds=host_preds, mcu_preds=mcu_preds, y_test=y_test,
+    latencies=latencies)
+  for i, tel in enumerate(tels):
+    tel.save(cache_dir+'/evalset_telemetry%s.npz' % ('' if len(tels) == 1 else '_%d' % (i)))
+
+  # report
+  y_true = y_test.argmax(axis=1)
+  y_host = host_preds.argmax(axis=1)
+  y_mcu = mcu_preds.argmax(axis=1)
+  labels = np.arange(len(keywords))
+
+  print('Confusion matrix host (rows) vs MCU (columns):')
+  print(confusion_matrix(y_host, y_mcu, labels=labels))
+  print('Confusion matrix true (rows) vs MCU (columns):')
+  print(confusion_matrix(y_true, y_mcu, labels=labels))
+
+  print('%-12s %6s %8s %8s %8s' % ('keyword', 'count', 'host', 'mcu', 'agree'))
+  for i, kw in enumerate(keywords):
+    sel = y_true == i
+    cnt = np.sum(sel)
+    if cnt == 0:
+      continue
+    print('%-12s %6d %7.2f%% %7.2f%% %7.2f%%' % (kw, cnt, 100.0*np.mean(y_host[sel] == i),
+      100.0*np.mean(y_mcu[sel] == i), 100.0*np.mean(y_host[sel] == y_mcu[sel])))
+  print('%-12s %6d %7.2f%% %7.2f%% %7.2f%%' % ('total', n, 100.0*np.mean(y_host == y_true),
+    100.0*np.mean(y_mcu == y_true), 100.0*np.mean(y_host == y_mcu)))
+
+  print('Host/MCU agreement: %d/%d (%.2f%%)' % (np.sum(y_host == y_mcu), n, 100.0*np.mean(y_host == y_mcu)))
+  if len(latencies):
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print('MCU inference time over %d inferences: p50 %.2fms p90 %.2fms p99 %.2fms max %.2fms' % (
+      len(latencies), p50, p90, p99, np.max(latencies)))
+
 def fileInference(args):
   """
     Read file and comput MFCC, launch inference on host and MCU
@@ -340,15 +452,32 @@ def frameInference(args):
     #   data = data[:sample_len]
 
     # Calculate MFCC and compute on host
-    o_mfcc = mfu.mfcc_mcu(data, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
-      num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
-    data_mfcc = np.array([x['mfcc'][:num_mfcc] for x in o_mfcc])
-    net_input = np.array(data_mfcc.reshape([1]+input_shape), dtype='float32') * net_input_scale
-    net_input = np.clip(net_input, net_input_clip_min, net_input_clip_max)
-    host_preds.append(model.predict(net_input)[0,:])
-
-    # Calculate MFCC and compute on MCU
-    mcu_mfccs, mcu_pred = mfccAndInfereOnMCU(data, progress=True)
+    def hostInference():
+      o_mfcc = mfu.mfcc_mcu(data, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
+        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
+      data_mfcc = np.array([x['mfcc'][:num_mfcc] for x in o_mfcc])
+      net_input = np.array(data_mfcc.reshape([1]+input_shape), dtype='float32') * net_input_scale
+      net_input = np.clip(net_input, net_input_clip_min, net_input_clip_max)
+      return net_input, model.predict(net_input)[0,:]
+
+    # Calculate MFCC and compute on MCU while the host computes its reference. The MCU task
+    # queues all its transfers before its first await, they run on the link thread while the
+    # host computes on this thread. predict must not move to another thread, the graph and
+    # session of keras on TF1 are thread local
+    async def hostAndMcu():
+      link = mca.defaultAsyncLink()
+      mcu_task = asyncio.ensure_future(mfccAndInfereOnMCUAsync(link, data))
+      await asyncio.sleep(0)
+      net_input, host_pred = hostInference()
+      mcu_mfccs, mcu_pred = await mcu_task
+      await link.close()
+      return net_input, host_pred, mcu_mfccs, mcu_pred
+
+    net_input, host_pred, mcu_mfccs, mcu_pred = asyncio.run(hostAndMcu())
+    if mcu_pred is None:
+      print('MCU transfer failed')
+      exit()
+    host_preds.append(host_pred)
     mcu_preds.append(mcu_pred)
     mcu_mfccss.append(mcu_mfccs)
 
@@ -396,6 +525,13 @@ def frameInference(args):
 
   compare(host_preds, mcu_preds, 'predictions')
   compare(host_mfcc, mcu_mfcc, 'MFCC=net input')
+  if not from_file:
+    # fixed point emulation of the MCU, should match exactly
+    emu_mfcc = mfq.mfcc_q15_batch(data, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
+      num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, num_mfcc=num_mfcc)[0]
+    emu_mfcc = mfq.mfcc_to_net_input(emu_mfcc, net_type)
+    compare(emu_mfcc, mcu_mfcc, 'MFCC fixed point emulation')
+    print('emulation mismatches: %d/%d' % (np.count_nonzero(emu_mfcc != mcu_mfcc), mcu_mfcc.size))
   print('MCU Audio processing took %.2fms (%.2fms per frame)' % (n_frames*mcuMfccTime, mcuMfccTime))
   print('MCU inference took %.2fms' % (mcuInferenceTime))
   plt.show()
@@ -531,11 +667,8 @@ def hostMicContinuous():
 
   threshold = 0.8
 
-  mic_data = np.array([], dtype='int16')
-  net_input = np.array([], dtype='int16')
-  init = 1
+  streaming_mfcc = mfu.StreamingMfcc(n_frames=input_shape[0], num_mfcc=input_shape[1])
   frame_ctr = 0
-  mfcc = np.array([])
   last_pred = 0
 
   with sd.Stream() as stream:
@@ -546,32 +679,27 @@ def hostMicContinuous():
       frame = ((2**16/2-1)*frame[:,0]).astype('int16')
       frame_ctr += 1
 
-      nSamples = frame_length
-      o_mfcc = mfu.mfcc_mcu(frame, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
-      data_mfcc = np.array([x['mfcc'][:num_mfcc] for x in o_mfcc])
+      # only the new frame is calculated, window holds the last n_frames
+      streaming_mfcc.push(frame)
 
       ax1.clear()
       ax1.plot(frame)
       plt.draw()
 
-      if init == 1:
-        net_input = np.append(net_input.ravel(), data_mfcc)
-        if (frame_ctr >= n_frames):
-          print('Live!')
-          init = 0
-
-      else:
-        net_input = np.array(net_input.reshape([1]+input_shape), dtype='float32')
-        host_pred = model.predict(net_input)[0]
-        net_input = np.append(data_mfcc, net_input.ravel()[:-num_mfcc])
-        # progress = int(100*host_pred)*'+' + (100-int(100*host_pred))*'-'
-        # print('\rprediction: %.3f %s' %(host_pred, progress) , end=" ")
-        # print('')
-        if (host_pred.max() > threshold):
-          spotted_kwd = keywords[np.argmax(host_pred)]
-          print('Spotted', spotted_kwd)
-        last_pred = host_pred
+      if not streaming_mfcc.ready:
+        continue
+      if frame_ctr == n_frames:
+        print('Live!')
+
+      net_input = streaming_mfcc.window.reshape([1]+input_shape)
+      host_pred = model.predict(net_input)[0]
+      # progress = int(100*host_pred)*'+' + (100-int(100*host_pred))*'-'
+      # print('\rprediction: %.3f %s' %(host_pred, progress) , end=" ")
+      # print('')
+      if (host_pred.max() > threshold):
+        spotted_kwd = keywords[np.argmax(host_pred)]
+        print('Spotted', spotted_kwd)
+      last_pred = host_pred
 
 
 def hostMicSingle():
@@ -583,11 +711,8 @@ def hostMicSingle():
   sd.default.samplerate = fs
   sd.default.channels = 1
 
-  mic_data = np.array([], dtype='int16')
-  net_input = np.array([], dtype='int16')
-  init = 1
+  streaming_mfcc = mfu.StreamingMfcc(n_frames=input_shape[0], num_mfcc=input_shape[1])
   frame_ctr = 0
-  mfcc = np.array([])
   last_pred = 0
 
   print('keywords:',keywords)
@@ -601,34 +726,28 @@ def hostMicSingle():
       frame = ((2**16/2-1)*frame[:,0]).astype('int16')
       frame_ctr += 1
 
-      nSamples = 1024
-      o_mfcc = mfu.mfcc_mcu(frame, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
-      data_mfcc = np.array([x['mfcc'][:num_mfcc] for x in o_mfcc])
-
-      if init == 1:
-        net_input = np.append(net_input.ravel(), data_mfcc)
-        if (frame_ctr >= n_frames):
-          print('Live!')
-          init = 0
-
-      else:
-        net_input = np.array(net_input.reshape([1]+input_shape), dtype='float32')
-        host_pred = model.predict(net_input)[0]
-        net_input = np.append(data_mfcc, net_input.ravel()[:-num_mfcc])
-        # progress = int(100*host_pred)*'+' + (100-int(100*host_pred))*'-'
-        # print('\rprediction: %.3f %s' %(host_pred, progress) , end=" ")
-        # print('')
-        if (host_pred.max() > threshold):
-          spotted_kwd = keywords[np.argmax(host_pred)]
-          print('Spotted', spotted_kwd, 'with %.2f%% confidence' % (100.0*host_pred.max()))
-        np.set_printoptions(suppress=True)
-        print(host_pred)
-        last_pred = host_pred
-        host_mfcc = net_input.reshape(n_frames,num_mfcc)
-        plotAudioMfcc(frame, host_mfcc, None)
-        plt.show()
-        return
+      streaming_mfcc.push(frame)
+
+      if not streaming_mfcc.ready:
+        continue
+      if frame_ctr == n_frames:
+        print('Live!')
+
+      net_input = streaming_mfcc.window.reshape([1]+input_shape)
+      host_pred = model.predict(net_input)[0]
+      # progress = int(100*host_pred)*'+' + (100-int(100*host_pred))*'-'
+      # print('\rprediction: %.3f %s' %(host_pred, progress) , end=" ")
+      # print('')
+      if (host_pred.max() > threshold):
+        spotted_kwd = keywords[np.argmax(host_pred)]
+        print('Spotted', spotted_kwd, 'with %.2f%% confidence' % (100.0*host_pred.max()))
+      np.set_printoptions(suppress=True)
+      print(host_pred)
+      last_pred = host_pred
+      host_mfcc = streaming_mfcc.window
+      plotAudioMfcc(frame, host_mfcc, None)
+      plt.show()
+      return
 
 def mcuMicCont():
   import edison.mcu.mcu_util as mcu
@@ -654,6 +773,8 @@ def main(argv):
     print('  kws_on_mcu.py <mode>')
     print('    Modes:')
     print('    single                   Single inference on random data')
+    print('    evalset [n]              Run cached test set on host and MCU and compare')
+    print('    evalfarm [n]             evalset on all boards of the device farm')
     print('    fileinf <file>           Get file, run MFCC on host and inference on MCU')
     print('    file <file>              Get file, run MFCC and inference on host and on MCU')
     print('    mic                      Record sample from onboard mic and do stuffs')
@@ -671,6 +792,10 @@ def main(argv):
       singleInference(int(args[0]))
     else:
       singleInference(1)
+  if mode == 'evalset':
+    evalSet(args)
+  if mode == 'evalfarm':
+    evalSet(args, farm=True)
   if mode == 'fileinf':
     fileInference(args)
   if mode == 'file':
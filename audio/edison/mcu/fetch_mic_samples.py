@@ -15,7 +15,7 @@ preprocessed = 1
 preproc_bits = 16
 
 try:
-  ser = Serial(mcu_serial_port, 115200)  # open serial port
+  ser = Serial(mcu_serial_port, mcu_baudrate)  # open serial port
 except SerialException:
   print("coult not open serial port")
   exit()
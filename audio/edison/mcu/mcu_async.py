@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from serial import SerialException
+
+import edison.mcu.mcu_util as mcu
+
+from config import *
+
+class AsyncMcuLink:
+  """
+    asyncio front end for McuLink. The blocking serial calls run on one worker thread per
+    link, so they hit the wire in the order they were issued while the event loop is free
+    for host side work or for other links.
+
+    Every method queues its transfer when called and returns an awaitable. A whole exchange
+    can be queued up front and awaited later, the worker then runs it back to back:
+
+      async with AsyncMcuLink(port='/dev/ttyACM0') as link:
+        link.send_command('mel_one_batch')
+        link.send_data(frame, 0)
+        futs = [link.receive_data() for i in range(4)]
+        host_result = calculateOnHost(frame)      # runs while the MCU is busy
+        mcu_result = await asyncio.gather(*futs)
+
+    The transfers of one link do not overlap each other. The protocol is lockstep and the
+    firmware has no RX buffering, so the next upload only starts after the MCU answered the
+    previous one. What overlaps is host side work, and other links, with the serial I/O.
+
+    If a transfer fails, the transfers queued behind it are skipped and return their error
+    value, so a failed command does not run into the timeouts of all following transfers.
+    Call reset() before the next exchange.
+
+      link      existing McuLink to use, else a new one is created from kwargs
+      kwargs    passed to McuLink
+  """
+  def __init__(self, link=None, **kwargs):
+    self.own_link = link is None # only a link created here is closed in close()
+    self.link = mcu.McuLink(**kwargs) if link is None else link
+    self.failed = False
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mcu_link')
+
+  async def __aenter__(self):
+    if await self.open() < 0:
+      raise SerialException('could not open serial port %s' % self.link.port)
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await self.close()
+
+  def _submit(self, fun, fail_ret, is_fail, *args, **kwargs):
+    # queue fun on the worker thread, skipped if a transfer before it failed
+    def run():
+      if self.failed:
+        return fail_ret
+      ret = fun(*args, **kwargs)
+      if is_fail(ret):
+        self.failed = True
+      return ret
+    return asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+  def reset(self):
+    """
+      Clear the failed state after a failed exchange
+    """
+    self.failed = False
+
+  def open(self):
+    if self.link.is_open:
+      return self._submit(lambda: 0, -1, lambda ret: False)
+    return self._submit(self.link.open, -1, lambda ret: False)
+
+  async def close(self):
+    if self.own_link:
+      await self._submit(self.link.close, None, lambda ret: False)
+    self._executor.shutdown(wait=True)
+
+  def send_command(self, cmd_name, args=None):
+    """
+      Awaitable sendCommand, returns 0 on success and -1 if the command was not accepted
+    """
+    return self._submit(self.link.sendCommand, -1, lambda ret: ret < 0, cmd_name, args)
+
+  def send_data(self, data, tag, progress=False, windowed=None):
+    """
+      Awaitable sendData, returns 0 on success and -1 on error
+    """
+    return self._submit(self.link.sendData, -1, lambda ret: ret < 0, data, tag, progress, windowed)
+
+  def receive_data(self, timeout=5000):
+    """
+      Awaitable receiveData, returns data, tag or None, None on error
+    """
+    return self._submit(self.link.receiveData, (None, None), lambda ret: ret[0] is None, timeout)
+
+  def wait_for_mcu_ready(self, timeout=1000):
+    """
+      Awaitable waitForMcuReady, returns 0 or -1 on timeout. A timeout fails the link, the
+      transfers queued behind it are skipped
+    """
+    return self._submit(self.link.waitForMcuReady, -1, lambda ret: ret < 0, timeout)
+
+  def get_stats(self):
+    """
+      Awaitable getStats
+    """
+    return self._submit(self.link.getStats, {}, lambda ret: False)
+
+def defaultAsyncLink():
+  """
+    AsyncMcuLink on the default link of mcu_util, opened on first use
+  """
+  return AsyncMcuLink(link=mcu.defaultLink())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+  Device farm: a pool of McuLinks to several identical boards with one queue and worker
+  thread per board. Jobs are plain functions that get the link of the board they run on,
+  map() fans a list of jobs out over the boards and returns the results in job order.
+
+    def job(link, net_input):
+      return link.batchInference(net_input, progress=False)
+
+    with McuFarm() as farm:
+      preds = farm.map(job, [(x,) for x in batches])
+
+  A job fails by returning None, as the McuLink methods do, or by raising a serial error.
+  The board is then taken out of the pool and its jobs go to the remaining boards.
+"""
+
+import sys
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+from serial import SerialException
+from tqdm import tqdm
+
+import edison.mcu.mcu_util as mcu
+
+from config import *
+
+def discoverPorts(usb_vid=mcu_farm_usb_vid):
+  """
+    Ports of all attached boards with usb_vid, sorted by name
+  """
+  from serial.tools import list_ports
+  return sorted(p.device for p in list_ports.comports() if p.vid == usb_vid)
+
+def probe(link, timeout=1.0):
+  """
+    Checks that a board runs the host interface, returns its version string or None
+  """
+  link.ser.reset_input_buffer()
+  link.write(mcu.hif_commands[0]['cmd_byte']) # version
+  if link.read(1, timeout) != b'\0':
+    return None
+  link.ser.timeout = timeout
+  line = link.ser.readline()
+  return line.decode('utf-8', errors='replace').strip() if line else None
+
+class FarmBoard:
+  """
+    One board of the farm with its link, job queue and statistics
+  """
+  def __init__(self, port, link):
+    self.port = port
+    self.link = link
+    self.version = None
+    self.queue = queue.Queue()
+    self.thread = None
+    self.failed = False
+    self.jobs = 0
+    self.busy = 0.0
+
+class McuFarm:
+  """
+    Pool of open links to the boards on ports, one worker thread per board.
+
+      ports     list of serial ports, default mcu_farm_ports or all discovered boards
+      retries   how often a failed job is passed on to another board
+      kwargs    passed to McuLink, cmd_timeout defaults to 2s so a hung board fails its job
+  """
+  def __init__(self, ports=None, retries=1, **kwargs):
+    kwargs.setdefault('cmd_timeout', 2000)
+    if ports is None:
+      ports = mcu_farm_ports if mcu_farm_ports is not None else discoverPorts()
+    self.ports = list(ports)
+    self.retries = retries
+    self.link_kwargs = kwargs
+    self.boards = []
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.boards)
+
+  def __enter__(self):
+    if self.open() < 1:
+      raise SerialException('no board of %s responding' % (self.ports))
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def open(self):
+    """
+      Open and probe all ports, boards that do not respond are left out.
+      Returns the number of boards in the pool
+    """
+    for port in self.ports:
+      link = mcu.McuLink(port, **self.link_kwargs)
+      if link.open() < 0:
+        continue
+      version = probe(link)
+      if version is None:
+        print('No host interface on %s, skipping' % (port))
+        link.close()
+        continue
+      board = FarmBoard(port, link)
+      board.version = version
+      board.thread = threading.Thread(target=self._worker, args=(board,), name='farm %s' % (port), daemon=True)
+      self.boards.append(board)
+      print('Board %d on %s: %s' % (len(self.boards)-1, port, version))
+    for board in self.boards:
+      board.thread.start()
+    return len(self.boards)
+
+  def close(self):
+    for board in self.boards:
+      board.queue.put(None)
+    for board in self.boards:
+      board.thread.join()
+      board.link.close()
+    self.boards = []
+
+  def _pick(self, exclude=None):
+    # board with the shortest queue
+    boards = [b for b in self.boards if not b.failed and b is not exclude]
+    if len(boards) == 0:
+      return None
+    return min(boards, key=lambda b: b.queue.qsize())
+
+  def _put(self, item, exclude=None):
+    with self._lock:
+      board = self._pick(exclude)
+      if board is None:
+        item[0].set_result(None)
+        return
+      board.queue.put(item)
+
+  def submit(self, fun, *args):
+    """
+      Queue fun(link, *args) on the least busy board, returns a Future with its result
+    """
+    fut = Future()
+    self._put((fut, fun, args, self.retries))
+    return fut
+
+  def map(self, fun, jobs, progress=True):
+    """
+      Runs fun(link, *job) for each job in jobs on the farm.
+      Returns the results in the order of jobs, None for jobs that failed on all boards
+    """
+    futs = [self.submit(fun, *job) for job in jobs]
+    for fut in tqdm(futs, disable=not progress):
+      fut.result()
+    return [fut.result() for fut in futs]
+
+  def _steal(self, board):
+    # idle board takes a job from the end of the longest other queue
+    with self._lock:
+      others = [b for b in self.boards if b is not board and b.queue.qsize() > 1]
+      if len(others) == 0:
+        return None
+      victim = max(others, key=lambda b: b.queue.qsize())
+      with victim.queue.mutex:
+        if len(victim.queue.queue) < 2 or victim.queue.queue[-1] is None:
+          return None
+        return victim.queue.queue.pop()
+
+  def _retire(self, board):
+    # take a failed board out of the pool and pass its jobs on
+    with self._lock:
+      board.failed = True
+      with board.queue.mutex:
+        pending = list(board.queue.queue)
+        board.queue.queue.clear()
+    print('Board on %s failed, %d boards left' % (board.port, len([b for b in self.boards if not b.failed])))
+    for item in pending:
+      if item is None:
+        board.queue.put(None)
+      else:
+        self._put(item, exclude=board)
+
+  def _worker(self, board):
+    while True:
+      item = self._steal(board) if board.queue.empty() and not board.failed else None
+      if item is None:
+        item = board.queue.get()
+      if item is None:
+        return
+      fut, fun, args, retries = item
+      if board.failed:
+        self._put(item, exclude=board)
+        continue
+      if not fut.running() and not fut.set_running_or_notify_cancel():
+        continue
+
+      t = monotonic()
+      try:
+        ret = fun(board.link, *args)
+      except (SerialException, OSError) as e:
+        print('Board on %s: %s' % (board.port, e))
+        ret = None
+      board.busy += monotonic() - t
+      board.jobs += 1
+
+      if ret is None:
+        self._retire(board)
+        if retries > 0:
+          self._put((fut, fun, args, retries-1), exclude=board)
+        else:
+          fut.set_result(None)
+        continue
+      fut.set_result(ret)
+
+  def report(self):
+    """
+      Print jobs and busy time per board
+    """
+    print('%-3s %-30s %6s %9s %9s' % ('', 'port', 'jobs', 'busy', 'per job'))
+    for i, b in enumerate(self.boards):
+      print('%-3d %-30s %6d %8.2fs %7.2fms%s' % (i, b.port, b.jobs, b.busy, 1000.0*b.busy/max(b.jobs, 1),
+        ' failed' if b.failed else ''))
+
+def main(argv):
+  """
+    List the boards of the farm
+  """
+  ports = argv if len(argv) else None
+  farm = McuFarm(ports)
+  print('%d boards responding' % (farm.open()))
+  farm.close()
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
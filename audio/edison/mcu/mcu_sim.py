@@ -0,0 +1,644 @@
+# -*- coding: utf-8 -*-
+"""
+  Software MCU that speaks the host interface protocol of firmware/src/io/hostinterface.c
+  on a pseudo terminal. The host tools connect to it like to a board, so the host pipeline
+  can be load tested, the transport benchmarked and everything run in CI without hardware.
+
+  Commands are dispatched on the mcu_util.hif_commands table, transfers use the same
+  delimiters, tagged frames and CRC as the firmware. The MFCCs are the bit exact fixed point
+  emulation of mfcc_q15, the net is the trained keras model (cube float or nnom int8 I/O) or
+  a null net with uniform output that needs no model at all.
+
+    python edison/mcu/mcu_sim.py --net null --link /tmp/edison-mcu
+    # in config.py: mcu_serial_port = '/tmp/edison-mcu'
+
+  or in process:
+
+    with McuSim(net=SimNet('null')) as sim:
+      with mcu.McuLink(sim.port) as link:
+        link.sendCommand('version')
+"""
+
+import os
+import sys
+import pty
+import tty
+import select
+import struct
+import threading
+import argparse
+from time import sleep, monotonic
+
+import numpy as np
+
+import edison.mcu.mcu_util as mcu
+import edison.mfcc.mfcc_utils as mfu
+import edison.mfcc.mfcc_q15 as mfq
+
+from config import *
+
+# settings of the firmware, see app.c, ai.c and hostinterface.c
+HIF_RX_WINDOW = 1024
+HIF_BAUD_MIN = 9600
+HIF_BAUD_MAX = 4000000
+AI_BATCH_CHUNK_MAX = 32
+AI_BATCH_BUF_BYTES = 16*1024
+TRUE_THRESHOLD = 0.5
+AMPLITUDE_MOVING_AVG_ALPHA = 0.9
+NET_OUT_MOVING_AVG_ALPHA = {'cube': 0.5, 'nnom': 0.9}
+NET_OUT_TO_PROB = {'cube': 1.0, 'nnom': 1.0/128.0}
+IN_FRAME_BUF_N_FRAMES = 16
+CYC_STAGE_MAX_RECORDS = 128
+
+# core clock reported in telemetry, stage times measured on the host are converted to it
+sim_clock = 80000000
+
+firmware_dir = cache_dir+'../../firmware/src/'
+model_files = {
+  'cube': firmware_dir+'ai/cube/kws/kws_model.h5',
+  'nnom': cache_dir+'kws_nnom/kws_conv.h5',
+}
+keyword_files = {
+  'cube': firmware_dir+'ai/cube/kws/keywords.txt',
+  'nnom': firmware_dir+'ai/nnom/keywords.txt',
+}
+
+def loadKeywords(fname):
+  """
+    Keywords from a keywords.txt as included by ai.c
+  """
+  with open(fname) as f:
+    return [x.strip().strip('"') for x in f.read().replace('\n', '').split(',') if x.strip()]
+
+class SimNet:
+  """
+    Net of the simulated MCU, works on the net input and output types of the firmware:
+    float32 for cube and int8 (Q7 output) for nnom.
+
+      net_type    'cube', 'nnom' or 'null'. The null net outputs a uniform prediction without
+                  loading a model, for transport tests
+      model_file  keras model, defaults to model_files[net_type]. Loaded on first inference
+      io_type     net I/O of the null net, 'cube' or 'nnom'
+  """
+  def __init__(self, net_type='cube', model_file=None, io_type='cube'):
+    self.net_type = net_type
+    self.io_type = io_type if net_type == 'null' else net_type
+    self.model_file = model_files.get(net_type) if model_file is None else model_file
+    kw_file = keyword_files[self.io_type]
+    self.keywords = loadKeywords(kw_file) if os.path.isfile(kw_file) else ['kw%d' % i for i in range(10)]
+    self.in_x, self.in_y = num_mfcc, n_frames
+    self.model = None
+
+  @property
+  def n_out(self):
+    return len(self.keywords)
+
+  @property
+  def in_size(self):
+    return self.in_x*self.in_y
+
+  @property
+  def in_fmt(self):
+    return mcu.fmt_byte_to_dtype.index('int8' if self.io_type == 'nnom' else 'float32')
+
+  def _load(self):
+    import keras
+    self.model = keras.models.load_model(self.model_file)
+
+  def __call__(self, net_input):
+    """
+      Runs inference on a flat net input, returns net output and the return value
+    """
+    if self.net_type == 'null':
+      out = np.full(self.n_out, 1.0/self.n_out)
+    else:
+      if self.model is None:
+        self._load()
+      x = np.asarray(net_input, dtype='float32')
+      out = self.model.predict(x.reshape((1,)+tuple(self.model.input.shape[1:])))[0]
+    if self.io_type == 'nnom':
+      return np.clip(np.round(out*128), -128, 127).astype('int8'), 0
+    return np.asarray(out, dtype='float32'), 0
+
+class MicSource:
+  """
+    Microphone of the simulated MCU, loops a wav file or returns silence
+  """
+  def __init__(self, wav=None):
+    self.data = np.zeros(nSamples, dtype='int16')
+    if wav is not None:
+      from scipy.io import wavfile
+      _, data = wavfile.read(wav)
+      if data.ndim > 1:
+        data = data[:,0]
+      if data.dtype != np.int16:
+        data = (data / np.abs(data).max() * 32767).astype('int16')
+      self.data = data
+    self.pos = 0
+
+  def read(self, n):
+    """
+      Next n samples as int16
+    """
+    idx = (self.pos + np.arange(n)) % len(self.data)
+    self.pos = (self.pos + n) % len(self.data)
+    return self.data[idx]
+
+class McuSim:
+  """
+    Simulated MCU on a pty. Host tools open port like the serial port of a board.
+
+      net       SimNet, defaults to the cube net
+      mic       MicSource, defaults to silence
+      realtime  deliver mic frames at the sample rate as the microphone would
+      pace      delay MCU to host bytes by their time on the wire at the current baud rate
+      link      path of a symlink to the pty, gives a fixed name for mcu_serial_port
+      timeout   s to wait for the host in a transfer before giving up
+  """
+  def __init__(self, net=None, mic=None, realtime=True, pace=False, link=None, timeout=10.0):
+    self.net = SimNet() if net is None else net
+    self.mic = MicSource() if mic is None else mic
+    self.realtime = realtime
+    self.pace = pace
+    self.link = link
+    self.timeout = timeout
+    self.baudrate = mcu_baudrate
+    self.binary_reports = False
+    self.prediction_seq = 0
+    self.last_processing_time = 0.0
+    self.last_inference_time = 0.0
+    self.fd = None
+    self.slave_fd = None
+    self.port = None
+    self._stop = threading.Event()
+    self._thread = None
+
+    # command byte -> number of argument bytes and handler, as hifRun
+    handlers = {
+      'version': self.verPrint,
+      'mic_sample_processed_manual': self.micHostSampleRequestPreprocessedManual,
+      'ai_info': self.aiPrintInfo,
+      'audio_info': self.audioHifInfo,
+      'kws_mic_continuous': self.appMicMfccInfereContinuous,
+      'mic_sample': self.micHostSampleRequest,
+      'mic_sample_preprocessed': self.micHostSampleRequestPreprocessed,
+      'mel_one_batch': self.audioMELSingleBatch,
+      'kws_single_inference': self.aiRunInferenceHif,
+      'mfcc_kws_frame': self.appHifMfccAndInference,
+      'kws_mic': self.appHifMicMfccInfere,
+      'link_config': self.linkConfig,
+      'kws_batch_inference': self.aiRunBatchInferenceHif,
+      'telemetry': self.telemetry,
+    }
+    self.cmds = {cmd['cmd_byte']: (cmd['argc'], handlers[cmd['name']]) for cmd in mcu.hif_commands}
+
+    self.mel = mfu.mel_constants()
+    self.t0 = monotonic()
+    self.stage_records = []
+    self.stage_dropped = 0
+
+  ######################################################################
+  # pty
+
+  def open(self):
+    """
+      Create the pty, the host side is in self.port
+    """
+    self.fd, self.slave_fd = pty.openpty()
+    # raw before the host opens it, else echo and line editing mangle the first bytes.
+    # The slave stays open here, so the host can close and reopen the port
+    tty.setraw(self.slave_fd)
+    self.port = os.ttyname(self.slave_fd)
+    if self.link is not None:
+      if os.path.islink(self.link):
+        os.remove(self.link)
+      os.symlink(self.port, self.link)
+      self.port = self.link
+    return self.port
+
+  def close(self):
+    self.stop()
+    if self.link is not None and os.path.islink(self.link):
+      os.remove(self.link)
+    for fd in (self.fd, self.slave_fd):
+      if fd is not None:
+        os.close(fd)
+    self.fd, self.slave_fd = None, None
+
+  def __enter__(self):
+    self.open()
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def start(self):
+    """
+      Serve commands on a background thread
+    """
+    self._stop.clear()
+    self._thread = threading.Thread(target=self.run, name='mcu_sim', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def run(self):
+    """
+      Command loop, runs until stop()
+    """
+    while not self._stop.is_set():
+      self.hifRun()
+
+  ######################################################################
+  # byte I/O
+
+  def _read(self, n, timeout=None):
+    # exactly n bytes or None on timeout, timeout in s
+    deadline = None if timeout is None else monotonic() + timeout
+    buf = bytearray()
+    while len(buf) < n:
+      remaining = None if deadline is None else max(0.0, deadline - monotonic())
+      r, _, _ = select.select([self.fd], [], [], remaining)
+      if not r:
+        return None
+      buf += os.read(self.fd, n - len(buf))
+    return bytes(buf)
+
+  def _write(self, buf):
+    if self.pace:
+      sleep(10.0*len(buf)/self.baudrate)
+    view = memoryview(buf)
+    while len(view):
+      view = view[os.write(self.fd, view):]
+
+  def _waitForByte(self, b, timeout=None):
+    # skips everything else, as waitForByte in hostinterface.c
+    deadline = None if timeout is None else monotonic() + timeout
+    while True:
+      c = self._read(1, None if deadline is None else max(0.0, deadline - monotonic()))
+      if c is None:
+        return -1
+      if c == b:
+        return 0
+
+  def _rxPending(self):
+    r, _, _ = select.select([self.fd], [], [], 0)
+    return len(r) > 0
+
+  def printf(self, s):
+    self._write(s.encode('utf-8'))
+
+  ######################################################################
+  # host interface
+
+  def hifRun(self):
+    """
+      Receive and run one command, returns without a command after 100ms
+    """
+    c = self._read(1, 0.1)
+    if c is None:
+      return
+    if c not in self.cmds:
+      self._write(b'\1')
+      return
+    argc, fun = self.cmds[c]
+    args = b''
+    if argc > 0:
+      args = self._read(argc, 1.0)
+      if args is None:
+        self._write(b'\2')
+        return
+    self._write(b'\0')
+    fun(args)
+
+  def hiSend(self, data, tag):
+    """
+      Transfer data to host, the format is infered from the dtype. Returns 0 or -1 on error
+    """
+    data = np.asarray(data).reshape(-1)
+    fmt = mcu.fmt_byte_to_dtype.index(data.dtype.name)
+    payload = mcu.packPayload(data)
+    self._write(struct.pack('<cBBI', mcu.DELIM_MCU_TO_HOST, 0x30+fmt, tag, len(data)))
+    if self._waitForByte(mcu.DELIM_ACK, self.timeout) < 0:
+      return -1
+    self._write(payload + struct.pack('<H', mcu.crc16(payload)))
+    return self._waitForByte(mcu.DELIM_CRC_OK, self.timeout)
+
+  def hiReceive(self, fmt=None, maxlen=None):
+    """
+      Receive a transfer from the host, fmt filters the format as index into
+      mcu_util.fmt_byte_to_dtype. Returns data, tag or None, None on error
+    """
+    if self._waitForByte(mcu.DELIM_HOST_TO_MCU, self.timeout) < 0:
+      return None, None
+    hdr = self._read(6, self.timeout)
+    if hdr is None:
+      return None, None
+    in_fmt, tag, length = struct.unpack('<BBI', hdr)
+    windowed = (in_fmt & mcu.FMT_FLAG_WINDOWED) != 0
+    in_fmt = (in_fmt & ~mcu.FMT_FLAG_WINDOWED) - 0x30
+    if in_fmt not in mcu.valid_fmt_bytes or (fmt is not None and fmt != in_fmt):
+      self._write(mcu.DELIM_WRONG_DAT_FMT)
+      return None, None
+
+    # ack, in windowed mode followed by the window size
+    self._write(mcu.DELIM_ACK + (struct.pack('<H', HIF_RX_WINDOW) if windowed else b''))
+    n_bytes = mcu.fmt_byte_to_nbytes[in_fmt]*length
+    if maxlen is not None:
+      n_bytes = min(n_bytes, maxlen)
+    if windowed:
+      buf = bytearray()
+      while len(buf) < n_bytes:
+        chunk = self._read(min(HIF_RX_WINDOW, n_bytes - len(buf)), self.timeout)
+        if chunk is None:
+          return None, None
+        buf += chunk
+        self._write(mcu.DELIM_ACK)
+      buf = bytes(buf)
+    else:
+      buf = self._read(n_bytes, self.timeout)
+      if buf is None:
+        return None, None
+
+    crc = self._read(2, self.timeout)
+    if crc is None:
+      return None, None
+    if struct.unpack('<H', crc)[0] != mcu.crc16(buf):
+      self._write(mcu.DELIM_CRC_FAIL)
+      return None, None
+    self._write(mcu.DELIM_CRC_OK)
+    return mcu.unpackPayload(buf, in_fmt), tag
+
+  def hiSendMCUReady(self):
+    self._write(mcu.DELIM_MCU_READY)
+
+  def hiSendPrediction(self, pred, ret, ampl, likely, spotted):
+    """
+      Binary prediction frame, pred scaled to [0,1] and spotted 0xff if none
+    """
+    q15 = (np.clip(pred, 0.0, 1.0)*32767.0).astype('<u2')
+    body = struct.pack('<BHbHBB', len(pred), self.prediction_seq & 0xffff, ret,
+      int(np.clip(ampl, 0, 65535)), likely, spotted) + q15.tobytes()
+    self._write(mcu.DELIM_PREDICTION + body + struct.pack('<H', mcu.crc16(body)))
+    self.prediction_seq += 1
+
+  ######################################################################
+  # telemetry, see cyclecounter.c
+
+  def cycStageRecord(self, stage, seconds):
+    record = (mcu.telemetry_stages.index(stage), int(1000*(monotonic()-self.t0)), int(seconds*sim_clock))
+    self.stage_records.append(record)
+    if len(self.stage_records) > CYC_STAGE_MAX_RECORDS:
+      self.stage_records.pop(0)
+      self.stage_dropped += 1
+
+  def telemetry(self, args):
+    records, self.stage_records = self.stage_records, []
+    buf = [sim_clock, len(mcu.telemetry_stages), len(records), self.stage_dropped]
+    self.stage_dropped = 0
+    self.hiSend(np.array(buf + [x for r in records for x in r], dtype='uint32'), mcu.TELEMETRY_TAG)
+
+  ######################################################################
+  # processing, as on the MCU
+
+  def audioCalcMFCCs(self, frame):
+    """
+      MFCCs of one frame, returns the mfcc_q15 results and stores the processing time
+    """
+    t = monotonic()
+    o = mfq.mfcc_q15(np.asarray(frame, dtype='int16')[None], self.mel['mel_mtx_compact'],
+      self.mel['mel_comp_fstarts'], self.mel['mel_comp_fcount'], mel_mtx_scale)
+    self.last_processing_time = monotonic() - t
+    self.cycStageRecord('mfcc', self.last_processing_time)
+    return {k: v[0] for k, v in o.items()}
+
+  def mfccToNetInput(self, mfcc):
+    return mfq.mfcc_to_net_input(mfcc[:self.net.in_x], net_type=self.net.io_type)
+
+  def aiRunInference(self, net_input):
+    t = monotonic()
+    out, ret = self.net(net_input)
+    self.last_inference_time = monotonic() - t
+    self.cycStageRecord('inference', self.last_inference_time)
+    return out, ret
+
+  def micFrames(self):
+    """
+      Generator of mic frames, at the sample rate if realtime
+    """
+    t_next = monotonic()
+    while True:
+      if self.realtime:
+        t_next += frame_length/fs
+        sleep(max(0.0, t_next - monotonic()))
+      yield self.mic.read(frame_length)
+
+  def appAudioEvent(self, frame, state):
+    """
+      Processing of one mic frame: amplitude, MFCC, push to net input and frame buffer
+    """
+    t = monotonic()
+    state['ampl'] = AMPLITUDE_MOVING_AVG_ALPHA*state['ampl'] + \
+      (1.0-AMPLITUDE_MOVING_AVG_ALPHA)*(float(frame.max()) - float(frame.min()))
+    t_pre = monotonic() - t
+    o = self.audioCalcMFCCs(frame)
+    t = monotonic()
+    state['net_input'] = np.concatenate((state['net_input'][self.net.in_x:], self.mfccToNetInput(o['mfcc'])))
+    state['frames'] = np.concatenate((state['frames'][frame_length:], frame))
+    self.cycStageRecord('preproc', t_pre + monotonic() - t)
+
+  def newAudioState(self):
+    return {
+      'ampl': 0.0,
+      'net_input': np.zeros(self.net.in_size, dtype=mcu.fmt_byte_to_dtype[self.net.in_fmt]),
+      'frames': np.zeros(IN_FRAME_BUF_N_FRAMES*frame_length, dtype='int16'),
+    }
+
+  ######################################################################
+  # command handlers
+
+  def verPrint(self, args):
+    self.printf('%s / %s / %s / %s\n' % ('edison-sim', 'sim', '-', '-'))
+
+  def aiPrintInfo(self, args):
+    self.printf('-------------------------------------------------------------\n')
+    self.printf('AI net information\n')
+    self.printf(' name: %s\n' % (self.net.net_type))
+    self.printf(' n inputs: %d\n' % (1))
+    self.printf(' n outputs: %d\n\n' % (1))
+    self.printf(' I[0] shape (%d, %d, %d)\n' % (self.net.in_y, self.net.in_x, 1))
+    self.printf(' O[0] shape (%d, %d, %d)\n\n' % (1, 1, self.net.n_out))
+    self.printf(' last inference time: %.2fms\n' % (1000*self.last_inference_time))
+
+  def audioHifInfo(self, args):
+    self.printf('-------------------------------------------------------------\n')
+    self.printf('Audioprocessing information\n')
+    self.printf('  Audio Sample Size: %d\n' % (frame_length))
+    self.printf('  Audio N Mel Bins: %d\n' % (num_mel_bins))
+    self.printf('  Audio N Spectrogram Bins: %d\n' % (num_spectrogram_bins))
+    self.printf('  Audio Samplerate: %d\n' % (fs))
+    self.printf('  Audio Lower Edge Hz: %f\n' % (lower_edge_hertz))
+    self.printf('  Audio Upper Edge Hz: %f\n' % (upper_edge_hertz))
+    self.printf('  Audio Mel Matrix Scale: %d\n' % (mel_mtx_scale))
+    self.printf('  Audio Last Processing Time: %.2fms\n' % (1000*self.last_processing_time))
+
+  def micHostSampleRequest(self, args):
+    n = struct.unpack('>H', args)[0]
+    # 24 bit samples left aligned in 32 bit, big endian
+    self._write((self.mic.read(n).astype('>i4') << 8).tobytes())
+
+  def micHostSampleRequestPreprocessed(self, args):
+    bits, n = struct.unpack('>BH', args)
+    data = self.mic.read(n)
+    if bits == 8:
+      self._write((data >> 8).astype('i1').tobytes())
+    else:
+      self._write(data.astype('>i2').tobytes())
+
+  def micHostSampleRequestPreprocessedManual(self, args):
+    self.micHostSampleRequestPreprocessed(struct.pack('>BH', 16, 10))
+
+  def audioMELSingleBatch(self, args):
+    frame, tag = self.hiReceive(mcu.fmt_byte_to_dtype.index('int16'), 2*frame_length)
+    if frame is None:
+      return
+    o = self.audioCalcMFCCs(frame)
+    spectrogram = mfq.cmpl_mag_q15(o['fft'][:,0].astype('int32'), o['fft'][:,1].astype('int32'))
+    self.hiSend(o['fft'].reshape(-1), 0)
+    self.hiSend(spectrogram.astype('int16'), 1)
+    self.hiSend(o['mel_spectrogram'], 2)
+    self.hiSend(o['mfcc'], 4)
+
+  def aiRunInferenceHif(self, args):
+    net_input, tag = self.hiReceive(self.net.in_fmt, self.net.in_size*mcu.fmt_byte_to_nbytes[self.net.in_fmt])
+    if net_input is None:
+      return
+    out, ret = self.aiRunInference(net_input)
+    self.hiSend(out, 0x17)
+
+  def aiRunBatchInferenceHif(self, args):
+    count = struct.unpack('>H', args)[0]
+    in_bytes = self.net.in_size*mcu.fmt_byte_to_nbytes[self.net.in_fmt]
+    chunk = min(AI_BATCH_CHUNK_MAX, AI_BATCH_BUF_BYTES//in_bytes)
+    self._write(bytes([chunk]))
+    for start in range(0, count, chunk):
+      n = min(chunk, count-start)
+      net_input, tag = self.hiReceive(self.net.in_fmt, n*in_bytes)
+      if net_input is None or len(net_input) != n*self.net.in_size or tag != n:
+        return
+      outs = [self.aiRunInference(x)[0] for x in net_input.reshape(n, -1)]
+      if self.hiSend(np.concatenate(outs), 0x18) < 0:
+        return
+
+  def appHifMfccAndInference(self, args):
+    net_input = []
+    for frame_ctr in range(self.net.in_y):
+      frame, tag = self.hiReceive(mcu.fmt_byte_to_dtype.index('int16'), 2*frame_length)
+      if frame is None:
+        return
+      net_input.append(self.mfccToNetInput(self.audioCalcMFCCs(frame)['mfcc']))
+      self.hiSendMCUReady()
+    net_input = np.concatenate(net_input)
+    out, ret = self.aiRunInference(net_input)
+    self.hiSendMCUReady()
+    self.hiSend(net_input, 0x20)
+    self.hiSend(out, 0x21)
+
+  def appHifMicMfccInfere(self, args):
+    state = self.newAudioState()
+    frames = self.micFrames()
+    for i in range(self.net.in_y):
+      self.appAudioEvent(next(frames), state)
+    out, ret = self.aiRunInference(state['net_input'])
+    self.hiSendMCUReady()
+    self.hiSend(state['frames'], 0x30)
+    self.hiSend(state['net_input'], 0x31)
+    self.hiSend(out, 0x32)
+
+  def appMicMfccInfereContinuous(self, args):
+    alpha = NET_OUT_MOVING_AVG_ALPHA[self.net.io_type]
+    net_out_filt = np.zeros(self.net.n_out)
+    if not self.binary_reports:
+      self.printf('Input shape x,y: (%d,%d)\n' % (self.net.in_x, self.net.in_y))
+
+    state = self.newAudioState()
+    frames = self.micFrames()
+    for i in range(self.net.in_y):
+      self.appAudioEvent(next(frames), state)
+
+    while True:
+      self.appAudioEvent(next(frames), state)
+      out, ret = self.aiRunInference(state['net_input'])
+
+      t = monotonic()
+      net_out = out.astype('float32')
+      net_out_filt = alpha*net_out_filt + (1.0-alpha)*net_out
+      likely = int(net_out_filt.argmax())
+      spotted = net_out_filt[likely] > TRUE_THRESHOLD
+      self.cycStageRecord('fsm', monotonic() - t)
+
+      if self.binary_reports:
+        self.hiSendPrediction(NET_OUT_TO_PROB[self.net.io_type]*net_out, ret, state['ampl'], likely,
+          likely if spotted else 0xff)
+      else:
+        line = 'pred: [ ' + ''.join('%2.2f ' % x for x in net_out) + '] ret: %d ampl: %.0f' % (ret, state['ampl'])
+        line += ' likely: %s' % (self.net.keywords[likely])
+        if spotted:
+          line += ' spotted %s' % (self.net.keywords[likely])
+        self.printf(line + '\n')
+
+      # any byte from the host aborts, it is discarded
+      if self._rxPending() or self._stop.is_set():
+        self._read(1, 0)
+        return
+
+  def linkConfig(self, args):
+    baud, flags = struct.unpack('>IB', args)
+    old_baud = self.baudrate
+    if baud == 0:
+      baud = old_baud
+    if baud < HIF_BAUD_MIN or baud > HIF_BAUD_MAX:
+      self._write(mcu.DELIM_WRONG_DAT_FMT)
+      return
+    self._write(mcu.DELIM_ACK)
+
+    # a pty has no baud rate, only the pacing follows it
+    self.baudrate = baud
+    c = self._read(1, 1.0)
+    if c != mcu.DELIM_ACK:
+      self.baudrate = old_baud
+      return
+    # report format only changes once the host is known to follow
+    self.binary_reports = (flags & mcu.LINK_FLAG_BINARY_REPORTS) != 0
+    self.prediction_seq = 0
+    self._write(mcu.DELIM_CRC_OK)
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Simulated MCU on a pty',
+    usage='mcu_sim.py [--net cube|nnom|null] [--model file] [--wav file] [--link path] [--pace] [--fast]')
+  parser.add_argument('--net', default='cube', choices=['cube', 'nnom', 'null'], help='Net to run')
+  parser.add_argument('--model', default=None, help='Keras model, default depends on --net')
+  parser.add_argument('--io', default='cube', choices=['cube', 'nnom'], help='Net I/O types of the null net')
+  parser.add_argument('--wav', default=None, help='Wav file looped as microphone input, else silence')
+  parser.add_argument('--link', default=None, help='Symlink to the pty, use it as mcu_serial_port')
+  parser.add_argument('--pace', action='store_true', help='Delay output by the time on the wire')
+  parser.add_argument('--fast', action='store_true', help='Deliver mic frames as fast as possible')
+  args = parser.parse_args(argv)
+
+  sim = McuSim(net=SimNet(args.net, model_file=args.model, io_type=args.io), mic=MicSource(args.wav),
+    realtime=not args.fast, pace=args.pace, link=args.link)
+  sim.open()
+  print('Simulated MCU on', sim.port)
+  try:
+    sim.run()
+  except KeyboardInterrupt:
+    pass
+  sim.close()
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -1,6 +1,6 @@
 import serial
 from serial import Serial, SerialException
-from time import sleep
+from time import sleep, monotonic
 import struct
 import numpy as np
 from tqdm import tqdm
@@ -8,24 +8,15 @@ from enum import Enum
 
 from config import *
 
-try:
-  ser = Serial(mcu_serial_port, 115200, bytesize=serial.EIGHTBITS,
-    parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, write_timeout=None, inter_byte_timeout=None,
-    xonxoff=False, rtscts=False, dsrdtr=False)  # open serial port
-  if(ser.is_open):
-    ser.close()
-  ser.open()
-except SerialException:
-  print("coult not open serial port")
-  exit()
-
 CRC_SEED = 0x1234
 SEND_CHUNK_SIZE = 8
+FMT_FLAG_WINDOWED = 0x40 # request windowed transfer to MCU, see hostinterface.c
 
 valid_fmt_bytes = [0,1,2,3,4,5,6]
 fmt_byte_to_nbytes = [1,1,2,2,4,4,4]
 fmt_byte_to_upack_string = ['<B', '<b', '<H', '<h', '<I', '<i', '<f']
 fmt_byte_to_dtype = ['uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32', 'float32']
+fmt_byte_to_wire_dtype = ['<u1', '<i1', '<u2', '<i2', '<u4', '<i4', '<f4'] # little endian on the wire
 
 DELIM_MCU_TO_HOST   = b'>'
 DELIM_HOST_TO_MCU   = b'<'
@@ -34,6 +25,13 @@ DELIM_CRC_FAIL      = b'C'
 DELIM_CRC_OK        = b'^'
 DELIM_MCU_READY     = b'R'
 DELIM_WRONG_DAT_FMT = b'F'
+DELIM_PREDICTION    = b'P'
+
+LINK_FLAG_BINARY_REPORTS = 0x01 # link_config flag, see hostinterface.c
+
+# processing stages in telemetry records, see cyclecounter.h
+telemetry_stages = ['preproc', 'mfcc', 'inference', 'fsm']
+TELEMETRY_TAG = 0x30
 
 # Used for sendCommand
 hif_commands = [
@@ -92,6 +90,21 @@ hif_commands = [
       'cmd_byte': b'4',
       'argc': 0
     },
+    {
+      'name': 'link_config',
+      'cmd_byte': b'\6',
+      'argc': 5
+    },
+    {
+      'name': 'kws_batch_inference',
+      'cmd_byte': b'\7',
+      'argc': 2
+    },
+    {
+      'name': 'telemetry',
+      'cmd_byte': b'\x08',
+      'argc': 0
+    },
   ]
 
 hef_cmd_ret = {
@@ -100,266 +113,600 @@ hef_cmd_ret = {
   b'\2' : 'too few arguments',
 }
 
-def waitForByte(b, timeout=1000):
+def crc16(buf, seed=CRC_SEED):
   """
-    wait for byte b to be received. timeout in ms
+    Additive checksum as calculated on the MCU: seed plus sum of all bytes, modulo 2^16
   """
-  while(timeout):
-    if ser.in_waiting:
-      c = ser.read(1)
-      if c == b:
-        return 0
-    sleep(0.001)
-    timeout = timeout - 1
-  return -1
+  return int((seed + np.frombuffer(buf, dtype='uint8').sum(dtype='uint64')) & 0xFFFF)
 
-def waitForBytes(bts, timeout=1000):
+def packPayload(data):
   """
-    wait for any byte in bts to be received. timeout in ms
+    Payload bytes of data as sent on the wire, data must be of a type in fmt_byte_to_dtype
   """
-  while(timeout):
-    if ser.in_waiting:
-      c = ser.read(1)
-      if c in bts:
-        return c
-    sleep(0.001)
-    timeout = timeout - 1
-  return -1
+  fmt = fmt_byte_to_dtype.index(data.dtype)
+  return np.ascontiguousarray(data, dtype=fmt_byte_to_wire_dtype[fmt]).tobytes()
 
-def serWriteWrap(b, progress=True):
+def unpackPayload(buf, fmt):
   """
-    wraps the serial write function
+    Array of type fmt_byte_to_dtype[fmt] from payload bytes received on the wire
   """
-  bytes_written = 0
-  if progress:
-    pbar = tqdm(total=len(b))
-  while bytes_written != len(b):
-    sleep(0.001)
-    remaining = len(b) - bytes_written
-    nBytes = SEND_CHUNK_SIZE if remaining > SEND_CHUNK_SIZE else remaining
-    chunk = b[bytes_written:bytes_written+nBytes]
-    bytes_now = ser.write(chunk)
-    bytes_written += bytes_now
-    ser.flush()
-    if progress:
-      pbar.update(bytes_now)
-    # input("Sent %d, press Enter to send next byte..." % (struct.unpack('<B',chunk)[0]))
-  if progress:
-    pbar.close()
+  return np.frombuffer(buf, dtype=fmt_byte_to_wire_dtype[fmt]).astype(fmt_byte_to_dtype[fmt])
 
-def receiveData(timeout=5000):
+class McuLink:
   """
-    Listens for incomming data streams
+    Serial link to one MCU. The port is opened in open() or when used as context manager,
+    several instances can drive several boards from one process.
+
+      with McuLink('/dev/ttyACM0', baudrate=115200) as link:
+        link.sendCommand('version')
   """
-  # should not reset buffers if MCU has already started sending...
-  # ser.reset_input_buffer()
-  # ser.reset_output_buffer()
-  ret_data = None
-  ret_tag = None
-
-  # wait for start of frame
-  if waitForByte(DELIM_MCU_TO_HOST, timeout=timeout) < 0:
-    print('No transfer started by MCU, aborting')
-    return -1
-  
-  # print("> received") # DBG
+  def __init__(self, port=mcu_serial_port, baudrate=mcu_baudrate, windowed=True, cmd_timeout=-1):
+    self.port = port
+    self.baudrate = baudrate
+    self.windowed = windowed # flow controlled bulk transfers to MCU, else 8 byte chunks
+    self.cmd_timeout = cmd_timeout # ms to wait for the command status, negative waits forever
+    self.binary_reports = False # live inference reported as binary frames, see configureLink
+    self.ser = None
+
+  def open(self):
+    """
+      Open the port, returns 0 on success and -1 if it could not be opened
+    """
+    try:
+      self.ser = Serial(self.port, self.baudrate, bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, write_timeout=None, inter_byte_timeout=None,
+        xonxoff=False, rtscts=False, dsrdtr=False)  # open serial port
+      if(self.ser.is_open):
+        self.ser.close()
+      self.ser.open()
+    except SerialException:
+      print("could not open serial port", self.port)
+      self.ser = None
+      return -1
+    return 0
+
+  def close(self):
+    if self.ser is not None:
+      self.ser.close()
+      self.ser = None
+
+  @property
+  def is_open(self):
+    return self.ser is not None and self.ser.is_open
+
+  def __enter__(self):
+    if self.open() < 0:
+      raise SerialException('could not open serial port %s' % self.port)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def read(self, n, timeout=None):
+    """
+      Blocking read of exactly n bytes. timeout in s for all n bytes, None waits forever.
+      Returns the bytes or None on timeout
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    buf = bytearray()
+    while len(buf) < n:
+      if deadline is None:
+        self.ser.timeout = None
+      else:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+          return None
+        self.ser.timeout = remaining
+      buf += self.ser.read(n - len(buf))
+    return bytes(buf)
+
+  def transferTimeout(self, nbytes):
+    """
+      Generous time in s for nbytes to arrive once the MCU has started sending
+    """
+    return 1.0 + 2*10*nbytes/self.baudrate
+
+  def waitForByte(self, b, timeout=1000):
+    """
+      wait for byte b to be received. timeout in ms, negative waits forever
+    """
+    return 0 if self.waitForBytes([b], timeout=timeout) == b else -1
+
+  def waitForBytes(self, bts, timeout=1000):
+    """
+      wait for any byte in bts to be received. timeout in ms, negative waits forever
+    """
+    deadline = None if timeout < 0 else monotonic() + timeout/1000.0
+    while True:
+      c = self.read(1, None if deadline is None else deadline - monotonic())
+      if c is None:
+        return -1
+      if c in bts:
+        return c
 
-  # Wait for header arrived
-  while(1):
-    sleep(0.01)
-    if ser.in_waiting >= 6:
-      buf = ser.read(6)
-      break
-  fmt, tag, length = struct.unpack('<BBI', buf)
+  def serWriteWrap(self, b, progress=True):
+    """
+      wraps the serial write function
+    """
+    bytes_written = 0
+    if progress:
+      pbar = tqdm(total=len(b))
+    while bytes_written != len(b):
+      sleep(0.001)
+      remaining = len(b) - bytes_written
+      nBytes = SEND_CHUNK_SIZE if remaining > SEND_CHUNK_SIZE else remaining
+      chunk = b[bytes_written:bytes_written+nBytes]
+      bytes_now = self.ser.write(chunk)
+      bytes_written += bytes_now
+      self.ser.flush()
+      if progress:
+        pbar.update(bytes_now)
+      # input("Sent %d, press Enter to send next byte..." % (struct.unpack('<B',chunk)[0]))
+    if progress:
+      pbar.close()
 
-  # print("fmt = %d tag = 0x%02x length = %d" % (fmt, tag, length)) # DBG
+  def serWriteWindowed(self, b, window, progress=True):
+    """
+      Write b in windows of the size the MCU announced, waiting for its ack after each
+      window. Returns 0 on success, -1 if an ack is missing.
+    """
+    if progress:
+      pbar = tqdm(total=len(b))
+    for start in range(0, len(b), window):
+      chunk = b[start:start+window]
+      self.ser.write(chunk)
+      self.ser.flush()
+      if self.waitForByte(DELIM_ACK, timeout=1000*self.transferTimeout(len(chunk))) < 0:
+        print('No ack for window at byte %d, aborting' % (start))
+        if progress:
+          pbar.close()
+        return -1
+      if progress:
+        pbar.update(len(chunk))
+    if progress:
+      pbar.close()
+    return 0
+
+  def receiveData(self, timeout=5000):
+    """
+      Listens for incomming data streams
+    """
+    # should not reset buffers if MCU has already started sending...
+    # self.ser.reset_input_buffer()
+    # self.ser.reset_output_buffer()
+    ret_data = None
+    ret_tag = None
+
+    # frame parser: start of frame, header, payload, crc. Each state blocks until
+    # its bytes have arrived, so the frame is handled as soon as the bytes are there
+    state = 'sof'
+    while state != 'done':
+      if state == 'sof':
+        # wait for start of frame
+        if self.waitForByte(DELIM_MCU_TO_HOST, timeout=timeout) < 0:
+          print('No transfer started by MCU, aborting')
+          return ret_data, ret_tag
+        state = 'header'
+
+      elif state == 'header':
+        buf = self.read(6, self.transferTimeout(6))
+        if buf is None:
+          print('Timeout waiting for header. Aborting')
+          return ret_data, ret_tag
+        fmt, tag, length = struct.unpack('<BBI', buf)
+        # print("fmt = %d tag = 0x%02x length = %d" % (fmt, tag, length)) # DBG
+
+        # convert fmt byte to usable index
+        fmt = fmt & (~0x30)
+
+        # check correct format byte
+        if fmt not in valid_fmt_bytes:
+          print('Invalid format byte received. Aborting')
+          return ret_data, ret_tag
+
+        # signal ready for data
+        self.ser.write(DELIM_ACK)
+        self.ser.flush()
+        state = 'payload'
+
+      elif state == 'payload':
+        toRead = fmt_byte_to_nbytes[fmt]*length
+        buf = self.read(toRead, self.transferTimeout(toRead))
+        if buf is None:
+          print('Timeout receiving %d bytes. Aborting' % (toRead))
+          return ret_data, ret_tag
+        state = 'crc'
+
+      elif state == 'crc':
+        crcbuf = self.read(2, self.transferTimeout(2))
+        if crcbuf is None:
+          print('Timeout waiting for CRC. Aborting')
+          return ret_data, ret_tag
+        crc_in = struct.unpack('<H', crcbuf)[0]
+        state = 'done'
+
+    # unpack
+    data = unpackPayload(buf, fmt)
+
+    # calculate crc
+    crc_out = crc16(buf)
+
+    if crc_out != crc_in:
+      print('CRC mismatch!')
+      # return ret_data, ret_tag
+
+    # print('Unpacked data:') # DBG
+    # print(data) # DBG
+    ret_data = data
+    ret_tag = tag
+
+    # print('crc_in = %d crc_out = %d' % (crc_in, crc_out)) # DBG
+
+    # Ack the transfer
+    self.ser.write(DELIM_CRC_OK)
+    self.ser.flush()
+    return ret_data, ret_tag
 
-  # convert fmt byte to usable index
-  fmt = fmt & (~0x30)
+  def sendData(self, data, tag, progress=True, windowed=None):
+    """
+      Send data, length and type is infered from data. windowed overrides the link setting.
+      Returns 0 on success and -1 on error
+    """
+    if windowed is None:
+      windowed = self.windowed
+    self.ser.reset_input_buffer()
+    # no reset_output_buffer: on a pty it drops the ack of a preceding receiveData that
+    # the other side has not read yet, the MCU would then wait for it forever
+    if data.dtype in fmt_byte_to_dtype:
+      fmt_byte = fmt_byte_to_dtype.index(data.dtype) + 0x30
+    else:
+      print('FATAL! Unsupported datatype, aborting')
+      return -1
+
+    length = len(data)
+    self.ser.flush()
+
+    # assemble and send header
+    hdr = struct.pack('<cBBL', DELIM_HOST_TO_MCU, fmt_byte | (FMT_FLAG_WINDOWED if windowed else 0), tag, length)
+    self.ser.write(hdr)
+    self.ser.flush()
+
+    ret = self.waitForBytes([DELIM_ACK, DELIM_WRONG_DAT_FMT])
+    if ret != DELIM_ACK:
+      errorstr = 'mcu not ready for data'
+      if ret == DELIM_WRONG_DAT_FMT:
+        errorstr += ' (Data format error)'
+      print(errorstr+', aborting!')
+      return -1
+
+    # send data
+    send_payload = packPayload(data)
+    crc = crc16(send_payload)
+
+    # actual send
+    if windowed:
+      # MCU announces its window size after the ack
+      buf = self.read(2, self.transferTimeout(2))
+      if buf is None:
+        print('mcu did not send window size, aborting!')
+        return -1
+      window = struct.unpack('<H', buf)[0]
+      if self.serWriteWindowed(send_payload, window, progress=progress) < 0:
+        return -1
+    else:
+      self.serWriteWrap(send_payload, progress=progress)
+    while(self.ser.out_waiting):
+      self.ser.flush()
+
+    # send crc
+    self.ser.write(struct.pack('<H', crc))
+
+    # Read ack
+    timeout = 500
+    ret = self.waitForBytes([DELIM_CRC_OK, DELIM_CRC_FAIL, DELIM_WRONG_DAT_FMT])
+    if ret != DELIM_CRC_OK:
+      errorstr = 'Error: Transfer not acknowledged'
+      if ret == DELIM_CRC_FAIL:
+        errorstr += ' (CRC error)'
+      if ret == DELIM_WRONG_DAT_FMT:
+        errorstr += ' (Data format error)'
+      print(errorstr)
+      return -1
+    # print('Transfer acknowledged')
+    return 0
+
+  def sendCommand(self, cmd_name, args=None):
+    """
+      Send a command to the MCU. cmd_name should be in hif_commands
+    """
+
+    for cmd in hif_commands:
+      if cmd['name'] == cmd_name:
+        command = cmd
+
+    self.ser.flush()
+
+    if args:
+      self.ser.write(command['cmd_byte']+args)
+    else:
+      self.ser.write(command['cmd_byte'])
+
+    # poll for command status
+    ret = self.waitForBytes([b'\0', b'\1', b'\2'], timeout=self.cmd_timeout)
+    if ret == -1:
+      print('No command status from MCU, exiting')
+      return -1
+    if ret != b'\0':
+      if ret in hef_cmd_ret.keys():
+        print('Command not accepted (%s), exiting' % hef_cmd_ret[ret])
+      else:
+        print('Command not accepted (%s), exiting' % 'unknown')
+      return -1
+
+    # print('Command accepted')
+    return 0
+
+  def waitForMcuReady(self, timeout=1000):
+    """
+      Waits for the MCU to send the ready delimiter
+    """
+    return self.waitForByte(DELIM_MCU_READY, timeout=timeout)
+
+  def configureLink(self, baudrate=None, binary_reports=False):
+    """
+      Negotiate baud rate and live inference report format with the MCU. baudrate None keeps
+      the current rate. The MCU keeps the settings until it is reset.
+      Returns 0 on success and -1 if the MCU rejected or did not confirm the settings
+    """
+    baud = 0 if baudrate is None else baudrate
+    flags = LINK_FLAG_BINARY_REPORTS if binary_reports else 0
+    self.ser.reset_input_buffer()
+    if self.sendCommand('link_config', struct.pack('>IB', baud, flags)) < 0:
+      return -1
+    ret = self.waitForBytes([DELIM_ACK, DELIM_WRONG_DAT_FMT])
+    if ret != DELIM_ACK:
+      print('MCU rejected baud rate %d' % (baud))
+      return -1
+
+    # MCU switched after its ack, confirm on the new rate
+    if baudrate is not None:
+      self.ser.baudrate = baudrate
+    self.ser.reset_input_buffer()
+    self.ser.write(DELIM_ACK)
+    self.ser.flush()
+    if self.waitForByte(DELIM_CRC_OK, timeout=1000) < 0:
+      print('MCU did not confirm baud rate %d, back to %d' % (baud, self.baudrate))
+      self.ser.baudrate = self.baudrate
+      return -1
+    self.baudrate = self.ser.baudrate
+    self.binary_reports = binary_reports
+    return 0
+
+  def readPrediction(self, timeout=-1):
+    """
+      Reads one binary prediction frame, frames with wrong crc are skipped. timeout in ms
+      return: net_out, ampl, likely, spotted, seq or None on timeout
+        net_out   net output scaled to [0,1]
+        likely    index of most likely keyword
+        spotted   index of spotted keyword or None
+        seq       frame counter of the MCU, gaps are dropped frames
+    """
+    while True:
+      if self.waitForByte(DELIM_PREDICTION, timeout=timeout) < 0:
+        return None
+      hdr = self.read(8, self.transferTimeout(8))
+      if hdr is None:
+        return None
+      n, seq, ret, ampl, likely, spotted = struct.unpack('<BHbHBB', hdr)
+      buf = self.read(2*n+2, self.transferTimeout(2*n+2))
+      if buf is None:
+        return None
+      if crc16(hdr+buf[:-2]) != struct.unpack('<H', buf[-2:])[0]:
+        continue
+      net_out = np.frombuffer(buf[:-2], dtype='<u2') / 32767.0
+      return net_out, ampl, likely, None if spotted == 0xff else spotted, seq
+
+  def batchInference(self, net_inputs, progress=True):
+    """
+      Inference of many net inputs in one kws_batch_inference transaction. The net inputs
+      are sent in chunks of the size the MCU announces, each as one transfer, and the MCU
+      answers each with one transfer of the net outputs, see aiRunBatchInferenceHif.
+
+        net_inputs  array [n, ...] of net inputs, float32 for cube and int8 for nnom nets
+
+      returns array [n, net outputs] or None on error
+    """
+    n = len(net_inputs)
+    if n == 0 or n > 0xffff:
+      print('Batch size must be 1..65535')
+      return None
+    if self.sendCommand('kws_batch_inference', struct.pack('>H', n)) < 0:
+      return None
+    buf = self.read(1, self.transferTimeout(1))
+    if buf is None:
+      print('MCU did not send chunk size, aborting!')
+      return None
+    chunk = buf[0]
+    if chunk == 0:
+      print('MCU could not allocate the batch buffers')
+      return None
+
+    # tag of each transfer is its number of net inputs
+    outs = []
+    for start in tqdm(range(0, n, chunk), disable=not progress):
+      batch = np.asarray(net_inputs[start:start+chunk])
+      if self.sendData(batch.reshape(-1), len(batch), progress=False) < 0:
+        return None
+      dat, tag = self.receiveData()
+      if dat is None:
+        return None
+      outs.append(dat)
+    return np.concatenate(outs).reshape(n, -1)
+
+  def getTelemetry(self):
+    """
+      Fetches the stage records the MCU collected since the last call
+      return: dict or None on error
+        clock     core clock in Hz
+        dropped   records lost because they were not fetched in time
+        stage     stage of each record, index into telemetry_stages
+        tick      MCU time of each record in ms
+        cycles    cycles each stage took
+    """
+    if self.sendCommand('telemetry') < 0:
+      return None
+    dat, tag = self.receiveData()
+    if dat is None or tag != TELEMETRY_TAG or len(dat) < 4:
+      print('Invalid telemetry transfer')
+      return None
+    clock, n_stages, n, dropped = [int(x) for x in dat[:4]]
+    records = dat[4:4+3*n].reshape(n, 3)
+    return {
+      'clock': clock,
+      'dropped': dropped,
+      'stage': records[:,0].astype('int32'),
+      'tick': records[:,1],
+      'cycles': records[:,2],
+    }
+
+  def getSingleLiveInference(self):
+    """
+      In live inference mode, waits for a report line and returns
+        pred: [ 0.03 0.00 0.93 0.00 0.03 ] ret: 0 ampl: 160 likely: left spotted left
+      return: net_out, ampl, likely, spotted
+
+      net_out, ampl, likely, spotted = link.getSingleLiveInference()
+
+      With binary reports likely and spotted are keyword indices, see readPrediction, and
+      None is returned if the frame could not be read
+    """
+    if self.binary_reports:
+      pred = self.readPrediction()
+      return None if pred is None else pred[:4]
+    while True:
+      line = self.ser.readline().decode("utf-8")
+      if line.startswith('pred: ['):
+
+        net_out = np.array([float(x) for x in line[line.index('[')+2:line.index(']')-1].split(' ')])
+        ampl = float(line[line.index('ampl'):line.index('likely')].split(' ')[1])
+        likely = line[line.index('likely')+8:]
+        spotted = None
+        if 'spotted' in line:
+          spotted = line[line.index('spotted')+8:]
+        return net_out, ampl, likely, spotted
+
+  def write(self, c):
+    """
+      direct access to serial port write
+    """
+    self.ser.write(c)
+
+  def getStats(self):
+    """
+      Fetches some status from MCU and returns a dict of info
+    """
+    ret = {}
+
+    # request audio info
+    if self.sendCommand('audio_info') < 0:
+      print('FAIL')
+      return -1
+    # read all
+    sleep(0.1)
+    while self.ser.in_waiting:
+      buf = self.ser.readline()
+      buf = buf.decode("utf-8").strip().replace(" ", "")
+      elms = buf.split(':')
+      if len(elms) == 2:
+        ret[elms[0]] = float(elms[1].replace("ms",""))
 
-  # check correct format byte
-  if fmt not in valid_fmt_bytes:
-    print('Invalid format byte received. Aborting')
-    return ret_data, ret_tag
+    # request AI info
+    if self.sendCommand('ai_info') < 0:
+      print('FAIL')
+      return -1
+    # read all
+    sleep(0.1)
+    while self.ser.in_waiting:
+      buf = self.ser.readline()
+      buf = buf.decode("utf-8").strip().replace(" ", "")
+      elms = buf.split(':')
+      if len(elms) == 2:
+        try:
+          ret[elms[0]] = float(elms[1].replace("ms",""))
+        except:
+          ret[elms[0]] = elms[1]
 
-  # signal ready for data
-  ser.write(DELIM_ACK)
-  ser.flush()
-
-  # receive data
-  toRead = fmt_byte_to_nbytes[fmt]*length
-  buf = b''
-  # print('start receiving %d bytes' % (toRead)) # DBG
-  while(toRead):
-    sleep(0.01)
-    inWaiting = ser.in_waiting
-    nRead = min(inWaiting, toRead)
-    buf += ser.read(nRead)
-    toRead = toRead - nRead
-
-  # print('read %d bytes' % len(buf)) # DBG
-  
-  # receive CRC
-  while(1):
-    sleep(0.01)
-    if ser.in_waiting >= 2:
-      crcbuf = ser.read(2)
-      break
-  crc_in = struct.unpack('<H', crcbuf)[0]
-  
-  # unpack
-  data = []
-  for i in range(length):
-    data.append(struct.unpack(fmt_byte_to_upack_string[fmt], 
-      buf[i*fmt_byte_to_nbytes[fmt]:(i+1)*fmt_byte_to_nbytes[fmt]])[0])
-
-  # calculate crc
-  crc_out = np.dtype('uint16').type(CRC_SEED)
-  for i in range(len(buf)):
-    crc_out = np.dtype('uint16').type(crc_out+struct.unpack('<B',buf[i:i+1])[0])
-
-  if crc_out != crc_in:
-    print('CRC mismatch!')
-    # return ret_data, ret_tag
-
-  # print('Unpacked data:') # DBG
-  # print(data) # DBG
-  ret_data = np.asarray(data, dtype=fmt_byte_to_dtype[fmt])
-  ret_tag = tag
-
-  # print('crc_in = %d crc_out = %d' % (crc_in, crc_out)) # DBG
-  
-  # Ack the transfer
-  ser.write(DELIM_CRC_OK)
-  ser.flush()
-  return ret_data, ret_tag
+    return ret
 
 
-def sendData(data, tag, progress=True):
-  """
-    Send data, length and type is infered from data
-  """
-  ser.reset_input_buffer()
-  ser.reset_output_buffer()
-  if data.dtype in fmt_byte_to_dtype:
-    fmt_byte = fmt_byte_to_dtype.index(data.dtype) + 0x30
-  else:
-    print('FATAL! Unsupported datatype, aborting')
-    return
-
-  length = len(data)
-  ser.flush()
-
-  # assemble and send header
-  hdr = struct.pack('<cBBL', DELIM_HOST_TO_MCU, fmt_byte, tag, length)
-  ser.write(hdr)
-  ser.flush()
-
-  ret = waitForBytes([DELIM_ACK, DELIM_WRONG_DAT_FMT])
-  if ret != DELIM_ACK:
-    errorstr = 'mcu not ready for data'
-    if ret == DELIM_WRONG_DAT_FMT:
-      errorstr += ' (Data format error)'
-    print(errorstr+', aborting!')
-    return
-
-  # send data
-  crc = np.dtype('uint16').type(CRC_SEED)
-  element_ctr = 1
-  send_payload = b''
-  for element in data:
-    # online crc calculation
-    for i in range(fmt_byte_to_nbytes[fmt_byte-0x30]):
-      data_byte=struct.pack(fmt_byte_to_upack_string[fmt_byte-0x30], element)[i]
-      crc = np.dtype('uint16').type(crc+data_byte)
-    # aassemble byte array to send
-    send_payload += struct.pack(fmt_byte_to_upack_string[fmt_byte-0x30], element)
-    # print(' total %5d/%d' % (element_ctr, length))
-    element_ctr += 1
-
-  # actual send
-  serWriteWrap(send_payload, progress=progress)
-  while(ser.out_waiting):
-    ser.flush()
-
-  # send crc
-  ser.write(struct.pack('<H', crc))
-
-  # Read ack
-  timeout = 500
-  ret = waitForBytes([DELIM_CRC_OK, DELIM_CRC_FAIL, DELIM_WRONG_DAT_FMT])
-  if ret != DELIM_CRC_OK:
-    errorstr = 'Error: Transfer not acknowledged'
-    if ret == DELIM_CRC_FAIL:
-      errorstr += ' (CRC error)'
-    if ret == DELIM_WRONG_DAT_FMT:
-      errorstr += ' (Data format error)'
-    print(errorstr)
-    return
-  # print('Transfer acknowledged')
-  
-def sendCommand(cmd_name, args=None):
+######################################################################
+# Module level interface on a default link, opened on first use
+######################################################################
+
+_default_link = None
+
+def defaultLink():
   """
-    Send a command to the MCU. cmd_name should be in hif_commands
+    McuLink on mcu_serial_port used by the module level functions, opened on first use
   """
+  global _default_link
+  if _default_link is None:
+    link = McuLink(mcu_serial_port)
+    if link.open() < 0:
+      exit()
+    _default_link = link
+  return _default_link
+
+def __getattr__(name):
+  # mcu.ser is the serial port of the default link
+  if name == 'ser':
+    return defaultLink().ser
+  raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-  for cmd in hif_commands:
-    if cmd['name'] == cmd_name:
-      command = cmd
+def waitForByte(b, timeout=1000):
+  return defaultLink().waitForByte(b, timeout)
 
-  ser.flush()
+def waitForBytes(bts, timeout=1000):
+  return defaultLink().waitForBytes(bts, timeout)
 
-  if args:
-    ser.write(command['cmd_byte']+args)
-  else:
-    ser.write(command['cmd_byte'])
+def serWriteWrap(b, progress=True):
+  return defaultLink().serWriteWrap(b, progress)
 
-  # poll for command status
-  ret = waitForBytes([b'\0', b'\1', b'\2'], timeout=-1)
-  if ret != b'\0':
-    if ret in hef_cmd_ret.keys():
-      print('Command not accepted (%s), exiting' % hef_cmd_ret[ret])
-    else:
-      print('Command not accepted (%s), exiting' % 'unknown')
-    return -1
-  
-  # print('Command accepted')
-  return 0
+def receiveData(timeout=5000):
+  return defaultLink().receiveData(timeout)
+
+def sendData(data, tag, progress=True, windowed=None):
+  return defaultLink().sendData(data, tag, progress, windowed)
+
+def sendCommand(cmd_name, args=None):
+  return defaultLink().sendCommand(cmd_name, args)
 
 def waitForMcuReady(timeout=1000):
-  """
-    Waits for the MCU to send the ready delimiter
-  """
-  return waitForByte(DELIM_MCU_READY, timeout=timeout)
+  return defaultLink().waitForMcuReady(timeout)
 
-def getSingleLiveInference():
-  """
-    In live inference mode, waits for a report line and returns
-      pred: [ 0.03 0.00 0.93 0.00 0.03 ] ret: 0 ampl: 160 likely: left spotted left
-    return: net_out, ampl, likely, spotted
+def configureLink(baudrate=None, binary_reports=False):
+  return defaultLink().configureLink(baudrate, binary_reports)
 
-    net_out, ampl, likely, spotted = getSingleLiveInference()
+def readPrediction(timeout=-1):
+  return defaultLink().readPrediction(timeout)
 
-  """
-  while True:
-    line = ser.readline().decode("utf-8")
-    if line.startswith('pred: ['):
-
-      net_out = np.array([float(x) for x in line[line.index('[')+2:line.index(']')-1].split(' ')])
-      ampl = float(line[line.index('ampl'):line.index('likely')].split(' ')[1])
-      likely = line[line.index('likely')+8:]
-      spotted = None
-      if 'spotted' in line:
-        spotted = line[line.index('spotted')+8:]
-      return net_out, ampl, likely, spotted
+def batchInference(net_inputs, progress=True):
+  return defaultLink().batchInference(net_inputs, progress)
+
+def getSingleLiveInference():
+  return defaultLink().getSingleLiveInference()
 
 def write(c):
-  """
-    direct access to serial port write
-  """
-  ser.write(c)
+  return defaultLink().write(c)
+
+def getStats():
+  return defaultLink().getStats()
+
+def getTelemetry():
+  return defaultLink().getTelemetry()
 
 def pingtest():
+  ser = defaultLink().ser
 
   sleep(1)
   print('--- Transferring uint8 -----------------------')
@@ -435,6 +782,7 @@ def pongtest():
   print('----------------------------------------------')
 
 def pingpongtest():
+  ser = defaultLink().ser
 
   # while(1):
   #   print('------------------------------------')
@@ -507,44 +855,6 @@ def pingpongtest():
   data, tag = receiveData()
   print('Received %s type with tag 0x%x: %s' % (data.dtype, tag, data))
 
-def getStats():
-  """
-    Fetches some status from MCU and returns a dict of info
-  """
-  ret = {}
-
-  # request audio info
-  if sendCommand('audio_info') < 0:
-    print('FAIL')
-    return -1
-  # read all
-  sleep(0.1)
-  while ser.in_waiting:
-    buf = ser.readline()
-    buf = buf.decode("utf-8").strip().replace(" ", "")
-    elms = buf.split(':')
-    if len(elms) == 2:
-      ret[elms[0]] = float(elms[1].replace("ms",""))
-  
-  # request AI info
-  if sendCommand('ai_info') < 0:
-    print('FAIL')
-    return -1
-  # read all
-  sleep(0.1)
-  while ser.in_waiting:
-    buf = ser.readline()
-    buf = buf.decode("utf-8").strip().replace(" ", "")
-    elms = buf.split(':')
-    if len(elms) == 2:
-      try:
-        ret[elms[0]] = float(elms[1].replace("ms",""))
-      except:
-        ret[elms[0]] = elms[1]
-  
-  return ret
-
-
 def vecToC(vec, prepad=3, maxwidth=80):
   """
     vector to c: [1,2,3] -> {1,2,3}
@@ -585,7 +895,7 @@ if __name__ == '__main__':
     getStats()
   except KeyboardInterrupt:
     print('Interrupted')
-    ser.close()
+    defaultLink().close()
     try:
       sys.exit(0)
     except SystemExit:
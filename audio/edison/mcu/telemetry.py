@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import edison.mcu.mcu_util as mcu
+
+from config import *
+
+class TelemetryCollector:
+  """
+    Collects the stage records of getTelemetry as time series. The MCU keeps the last 128
+    records, poll at least that often to not lose any, lost records are counted in dropped.
+
+      tel = TelemetryCollector()
+      ... run something on the MCU ...
+      tel.poll()
+      tel.report()
+  """
+  def __init__(self, link=None):
+    self.link = link
+    self.clock = None
+    self.dropped = 0
+    self.stage = []
+    self.tick = []
+    self.cycles = []
+
+  def __len__(self):
+    return sum(len(x) for x in self.stage)
+
+  def poll(self):
+    """
+      Fetch new records from the MCU, returns number of new records or -1 on error
+    """
+    link = mcu.defaultLink() if self.link is None else self.link
+    tel = link.getTelemetry()
+    if tel is None:
+      return -1
+    self.clock = tel['clock']
+    self.dropped += tel['dropped']
+    self.stage.append(tel['stage'])
+    self.tick.append(tel['tick'])
+    self.cycles.append(tel['cycles'])
+    return len(tel['stage'])
+
+  def series(self, stage):
+    """
+      Time series of a stage, stage is a name from mcu_util.telemetry_stages
+      returns tick [ms], latency [ms]
+    """
+    idx = mcu.telemetry_stages.index(stage)
+    if len(self) == 0:
+      return np.zeros(0), np.zeros(0)
+    sel = np.concatenate(self.stage) == idx
+    tick = np.concatenate(self.tick)[sel]
+    latency = 1000.0 * np.concatenate(self.cycles)[sel] / self.clock
+    return tick, latency
+
+  def histogram(self, stage, bins=20):
+    """
+      Latency histogram of a stage in ms, see np.histogram
+    """
+    return np.histogram(self.series(stage)[1], bins=bins)
+
+  def report(self, percentiles=(50, 90, 99)):
+    """
+      Print latency percentiles of all stages
+    """
+    print('%-10s %6s' % ('stage', 'count') + ''.join(' %8s' % ('p%d' % p) for p in percentiles) + ' %8s' % ('max'))
+    for stage in mcu.telemetry_stages:
+      _, latency = self.series(stage)
+      if len(latency) == 0:
+        continue
+      print('%-10s %6d' % (stage, len(latency)) + ''.join(' %6.2fms' % x for x in np.percentile(latency, percentiles))
+        + ' %6.2fms' % (latency.max()))
+    if self.dropped:
+      print('%d records dropped, poll more often' % (self.dropped))
+
+  def save(self, fname):
+    """
+      Store all records as npz with stage, tick, cycles and clock
+    """
+    if len(self) == 0:
+      stage, tick, cycles = np.zeros(0, dtype='int32'), np.zeros(0), np.zeros(0)
+    else:
+      stage, tick, cycles = np.concatenate(self.stage), np.concatenate(self.tick), np.concatenate(self.cycles)
+    np.savez(fname, stage=stage, tick=tick, cycles=cycles, clock=self.clock, dropped=self.dropped,
+      stages=np.array(mcu.telemetry_stages))
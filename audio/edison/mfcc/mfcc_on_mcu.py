@@ -5,6 +5,7 @@
 # @Last Modified time: 2020-05-27 16:29:46
 
 import sys
+import asyncio
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -14,7 +15,10 @@ from scipy.io import wavfile
 import tensorflow as tf
 
 import edison.mfcc.mfcc_utils as mfu
+import edison.mfcc.mfcc_q15 as mfq
 import edison.mcu.mcu_util as mcu
+import edison.mcu.mcu_async as mca
+import edison.mcu.mcu_farm as mcu_farm
 
 # Settings
 from config import *
@@ -25,45 +29,8 @@ fname = cache_dir+'mel_constants.h'
 # functions
 ######################################################################
 
-def melMtxToUnspares(mel_mtx):
-  """
-    convert mel matrix to unsparse form
-    melMtxCompact, melCompFStarts, melCompFCount = melMtxToUnspares(mel_mtx)
-  """
-
-  melMtxCompact = []
-  melCompFStarts = []
-  melCompFCount = []
-
-  # loop over cols which each represents an output mel as linear combination
-  # of input freqs
-  for ncol in range(mel_mtx.shape[1]):
-    vec = mel_mtx[:,ncol]
-    first_frq = vec.nonzero()[0][0]
-    nonzero_cnt = np.count_nonzero(vec)
-
-    vec_snippet = vec[first_frq:first_frq+nonzero_cnt]
-
-    melMtxCompact += vec_snippet.tolist()
-    melCompFStarts.append(first_frq)
-    melCompFCount.append(nonzero_cnt)
-
-    # if ncol == 0:
-    #   print(vec)
-    #   print(first_frq)
-    #   print(nonzero_cnt)
-    #   print(vec_snippet)
-
-  melMtxCompact = np.array(melMtxCompact, dtype='int16')
-  melCompFStarts = np.array(melCompFStarts, dtype='int16')
-  melCompFCount = np.array(melCompFCount, dtype='int16')
-
-  assert melCompFCount.sum() == melMtxCompact.size
-  
-  print('Reduced Mel matrix from %d elements to %d (-%.1f%%)' % 
-    (mel_mtx.size, melMtxCompact.size, 100-100.0/mel_mtx.size*melMtxCompact.size) )
-
-  return melMtxCompact, melCompFStarts, melCompFCount
+# moved to mfcc_utils, kept here for compatibility
+melMtxToUnspares = mfu.melMtxToUnspares
 
 def calcCConstants():
   """
@@ -71,9 +38,10 @@ def calcCConstants():
   """
 
 
-  # calculate mel matrix
-  mel_mtx = mfu.gen_mel_weight_matrix(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins, sample_rate=sample_rate, \
-      lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz)
+  # get mel matrix and all other constants from the shared cache
+  constants = mfu.mel_constants(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins, sample_rate=sample_rate, \
+      lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz, mel_mtx_scale=mel_mtx_scale, mel_twiddle_scale=mel_twiddle_scale)
+  mel_mtx = constants['mel_mtx']
   print(type(mel_mtx))
   print('mel matrix shape: %s' % (str(mel_mtx.shape)))
   print('mel matrix bounds: min %f max %f' % (np.amin(mel_mtx), np.amax(mel_mtx)))
@@ -81,7 +49,7 @@ def calcCConstants():
   
   # Mel matrix is very sparse, could optimize this..
 
-  mel_mtx_s16 = np.array(mel_mtx_scale*mel_mtx, dtype='int16')
+  mel_mtx_s16 = constants['mel_mtx_s16']
   print('discrete mel matrix shape: %s' % (str(mel_mtx_s16.shape)))
   print('discrete mel matrix bounds: min %f max %f' % (np.amin(mel_mtx_s16), np.amax(mel_mtx_s16)))
   print('discrete mel matrix nonzero elements : %d/%d' % (np.count_nonzero(mel_mtx_s16), np.prod(mel_mtx_s16.shape)) )
@@ -92,26 +60,24 @@ def calcCConstants():
   mel_str += ';\n'
 
   # calculate LUT for ln(x) for x in [0,32766]
-  log_lut = np.array(np.log(np.linspace(1e-6,32766,32767)), dtype='int16')
+  log_lut = constants['log_lut']
   log_lug_str = 'const q15_t logLutq15[%d] = \n' % (32767)
   log_lug_str += mcu.vecToC(log_lut, prepad = 4)
   log_lug_str += ';\n'
 
   # calculate scale vector for fast DCT by Makhoul1980
   N = num_mel_bins
-  k = np.arange(N)
-  factors = 2 * np.exp(-1j*np.pi*k/(2*N))
-  factors_s16_real = np.array(mel_twiddle_scale*factors.real, dtype='int16')
-  factors_s16_imag = np.array(mel_twiddle_scale*factors.imag, dtype='int16')
-  factors_s16 = np.empty((factors_s16_real.size + factors_s16_imag.size,), dtype='int16')
-  factors_s16[0::2] = factors_s16_real
-  factors_s16[1::2] = factors_s16_imag
+  factors_s16 = constants['dct_twiddle_s16']
   twiddle_factors_str = 'const q15_t dctTwiddleFactorsq15[%d] = \n' % (2*N)
   twiddle_factors_str += mcu.vecToC(factors_s16, prepad = 4)
   twiddle_factors_str += ';\n'
 
   # unsparse method
-  melMtxCompact, melCompFStarts, melCompFCount = melMtxToUnspares(mel_mtx_s16)
+  melMtxCompact = constants['mel_mtx_compact']
+  melCompFStarts = constants['mel_comp_fstarts']
+  melCompFCount = constants['mel_comp_fcount']
+  print('Reduced Mel matrix from %d elements to %d (-%.1f%%)' % (constants['mel_mtx_s16'].size,
+    melMtxCompact.size, 100-100.0/constants['mel_mtx_s16'].size*melMtxCompact.size))
   mtxcomp_str = 'const q15_t melMtxCompact[%d] = \n' % (melMtxCompact.size)
   mtxcomp_str += mcu.vecToC(melMtxCompact, prepad = 4)
   mtxcomp_str += ';\n'
@@ -362,9 +328,10 @@ def modeSingle(from_files):
   # compensate same bit shift as on MCU
   host_fft = np.fft.fft(y)
   host_spec = np.abs(host_fft)
-  mel_mtx = mfu.gen_mel_weight_matrix(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins, sample_rate=sample_rate, \
-      lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz)
-  mel_mtx_s16 = np.array(mel_mtx_scale*mel_mtx, dtype='int16')
+  constants = mfu.mel_constants(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins, sample_rate=sample_rate, \
+      lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz, mel_mtx_scale=mel_mtx_scale)
+  mel_mtx = constants['mel_mtx']
+  mel_mtx_s16 = constants['mel_mtx_s16']
   host_melspec = host_spec[:(sample_size//2)+1].dot(mel_mtx_s16)
   host_dct = dct(host_melspec, type=2)
   host_dct_makhoul, host_dct_reorder, host_dct_fft = mfu.dct2Makhoul(host_melspec)
@@ -391,6 +358,11 @@ def modeSingle(from_files):
   scale = host_dct.max()/mcu_dct.max()
   print('host/mcu dct scale %f' % (scale) )
 
+  # MCU mel spectrum from MCU spectrum with the flashed compact tables, must match exactly
+  mcu_melspec_host = mfu.mel_compact_dot(mcu_spec[:num_spectrogram_bins], constants['mel_mtx_compact'],
+    constants['mel_comp_fstarts'], constants['mel_comp_fcount'], mel_mtx_scale)
+  print('compact mel matrix mismatches: %d/%d' % (np.count_nonzero(mcu_melspec_host != mcu_melspec), num_mel_bins))
+
   ######################################################################
   # plot
   print('MCU Audio processing took %.2fms' % (mcu.getStats()['AudioLastProcessingTime']))
@@ -406,6 +378,29 @@ def modeCalc(from_files):
 ######################################################################
 # File
 ######################################################################
+async def melOneBatchAsync(link, frames):
+  """
+    Runs mel_one_batch on each frame over an AsyncMcuLink. The transfers of all frames are
+    queued at once, the link thread still runs them one frame after the other.
+    Returns lists of fft, spectrogram, mel spectrogram and dct or None if a transfer failed
+  """
+  from tqdm import tqdm
+  link.reset()
+  futs = []
+  for frame in frames:
+    link.send_command('mel_one_batch')
+    link.send_data(np.array(frame, dtype='int16'), 0)
+    futs.append([link.receive_data() for i in range(4)])
+
+  out = [[], [], [], []]
+  for fut in tqdm(futs):
+    for i, (dat, tag) in enumerate(await asyncio.gather(*fut)):
+      out[i].append(dat)
+  if link.failed:
+    print('MCU transfer failed')
+    return None
+  return out
+
 def modeFile(from_files, argv):
   global fs, y, host_fft, mcu_fft, mel_mtx, host_spec, mcu_spec, host_melspec, mcu_melspec, host_dct, mcu_dct, host_logmelspec
   global host_dct_reorder, host_dct_fft, host_dct_makhoul, nSamples, fname
@@ -437,55 +432,26 @@ def modeFile(from_files, argv):
   print("Number of input samples = %d" % (nSamples))
 
   # calculate mfcc
-  o_mfcc = mfu.mfcc_mcu(in_data, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
-    num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
-
-  host_fft = np.array([x['fft'][:sample_size//2] for x in o_mfcc])[:sample_size]
-  host_spec = np.array([x['spectrogram'][:sample_size//2] for x in o_mfcc])
-  host_melspec = np.array([x['mel_spectrogram'][:sample_size//2] for x in o_mfcc])
-  host_logmelspec = np.array([x['log_mel_spectrogram'][:sample_size//2] for x in o_mfcc])
-  host_dct = np.array([x['mfcc'] for x in o_mfcc])
+  def hostMfcc():
+    return mfu.mfcc_mcu(in_data, fs, nSamples, frame_len, frame_step, frame_count, fft_len, 
+      num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
 
   # calculate on MCU
   frames = mfu.frames(in_data, frame_length=sample_size, frame_step=frame_step)
-  mcu_fft = []
-  mcu_spec = []
-  mcu_melspec = []
-  mcu_dct = []
-  frame_ctr = 0
-  print('Running on MCU')
-  from tqdm import tqdm
   if not from_files:
-    for frame in tqdm(frames):
-      yf = np.array(frame, dtype='int16')
-      # Exchange some data
-      if mcu.sendCommand('mel_one_batch') < 0:
-        exit()
-      # print('Upload sample')
-      mcu.sendData(yf, 0, progress=False)
-      # print('Download samples')
-      dat, tag = mcu.receiveData()
-      mcu_fft.append(dat)
-      # print('Received %s type with tag 0x%x len %d' % (dat.dtype, tag, dat.shape[0]))
-      # print(dat)
-      dat, tag = mcu.receiveData()
-      mcu_spec.append(dat)
-      # print('Received %s type with tag 0x%x len %d' % (dat.dtype, tag, dat.shape[0]))
-      # print(dat)
-      dat, tag = mcu.receiveData()
-      mcu_melspec.append(dat)
-      # print('Received %s type with tag 0x%x len %d' % (dat.dtype, tag, dat.shape[0]))
-      # print(dat)
-      dat, tag = mcu.receiveData()
-      mcu_dct.append(dat)
-      # print('Received %s type with tag 0x%x len %d' % (dat.dtype, tag, dat.shape[0]))
-      # print(dat)
-      frame_ctr += 1
-
-    mcu_fft = np.array(mcu_fft)
-    mcu_spec = np.array(mcu_spec)
-    mcu_melspec = np.array(mcu_melspec)
-    mcu_dct = np.array(mcu_dct)
+    print('Running on MCU')
+    # all frames are queued on the link, the host calculates its mfcc during the transfers
+    async def hostAndMcu():
+      link = mca.defaultAsyncLink()
+      host_fut = asyncio.get_running_loop().run_in_executor(None, hostMfcc)
+      mcu_out = await melOneBatchAsync(link, frames)
+      await link.close()
+      return await host_fut, mcu_out
+
+    o_mfcc, mcu_out = asyncio.run(hostAndMcu())
+    if mcu_out is None:
+      exit()
+    mcu_fft, mcu_spec, mcu_melspec, mcu_dct = [np.array(x) for x in mcu_out]
     import pathlib
     pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
     np.save(cache_dir+'/mcu_fft_file.npy', mcu_fft)
@@ -498,6 +464,13 @@ def modeFile(from_files, argv):
     mcu_spec = np.load(cache_dir+'/mcu_spec_file.npy')
     mcu_melspec = np.load(cache_dir+'/mcu_melspec_file.npy')
     mcu_dct = np.load(cache_dir+'/mcu_dct_file.npy')
+    o_mfcc = hostMfcc()
+
+  host_fft = np.array([x['fft'][:sample_size//2] for x in o_mfcc])[:sample_size]
+  host_spec = np.array([x['spectrogram'][:sample_size//2] for x in o_mfcc])
+  host_melspec = np.array([x['mel_spectrogram'][:sample_size//2] for x in o_mfcc])
+  host_logmelspec = np.array([x['log_mel_spectrogram'][:sample_size//2] for x in o_mfcc])
+  host_dct = np.array([x['mfcc'] for x in o_mfcc])
 
   ######################################################################
   # plot
@@ -520,6 +493,65 @@ def modeFile(from_files, argv):
   plt.show()
 
 
+######################################################################
+# Verify
+######################################################################
+def melOneBatch(link, frame):
+  """
+    Runs mel_one_batch on one frame, as job for the device farm.
+    Returns port, [fft, spectrogram, mel spectrogram, dct] or None if a transfer failed
+  """
+  if link.sendCommand('mel_one_batch') < 0:
+    return None
+  if link.sendData(np.array(frame, dtype='int16'), 0, progress=False) < 0:
+    return None
+  out = [link.receiveData()[0] for i in range(4)]
+  if any(x is None for x in out):
+    return None
+  return link.port, out
+
+def modeVerify(argv):
+  """
+    Bit exact check of the MCU MFCC against mfcc_q15 on all frames of the wav files in
+    argv, spread over all boards of the device farm
+  """
+  if len(argv) < 3:
+    print('Specify input files')
+    exit()
+
+  frames = []
+  for fname in argv[2:]:
+    in_fs, in_data = wavfile.read(fname)
+    in_data = np.array(in_data)
+    if in_data.dtype == 'float32':
+      in_data = np.array( (2**15-1)*in_data,dtype='int16')
+    frames.append(mfu.frames(in_data, frame_length=sample_size, frame_step=sample_size))
+  frames = np.concatenate(frames).astype('int16')
+  print('Verifying %d frames of %d files' % (len(frames), len(argv)-2))
+
+  with mcu_farm.McuFarm() as farm:
+    res = farm.map(melOneBatch, [(frame,) for frame in frames])
+    farm.report()
+  if any(x is None for x in res):
+    print('MCU transfer failed')
+    exit()
+
+  constants = mfu.mel_constants()
+  o = mfq.mfcc_q15(frames, constants['mel_mtx_compact'], constants['mel_comp_fstarts'],
+    constants['mel_comp_fcount'], mel_mtx_scale)
+  host = [o['fft'].reshape(len(frames), -1), o['mel_spectrogram'], o['mfcc']]
+  mcu_out = [np.array([x[1][i] for x in res]) for i in [0, 2, 3]]
+  ports = np.array([x[0] for x in res])
+
+  # mismatching frames per board and stage
+  print('%-30s %6s %6s %6s %6s' % ('port', 'frames', 'fft', 'mel', 'dct'))
+  for port in np.unique(ports):
+    sel = ports == port
+    print('%-30s %6d' % (port, np.sum(sel)) + ''.join(' %6d' % np.sum(np.any(h[sel] != m[sel], axis=1))
+      for h, m in zip(host, mcu_out)))
+  n_bad = np.sum(np.any(host[2] != mcu_out[2], axis=1))
+  print('%d/%d frames with MFCC mismatch' % (n_bad, len(frames)))
+
 ######################################################################
 # main
 ######################################################################
@@ -532,6 +564,7 @@ def main(argv):
     print('    calc                     Calculate C constants header file')
     print('    single                   Run MFCC on single frame')
     print('    file data/test.wav       Run MFCC on wav file of any length')
+    print('    verify <files>           Bit exact check of MFCC on all frames, on all boards')
     exit()
 
   from_files = 0
@@ -546,6 +579,8 @@ def main(argv):
     modeCalc(from_files)
   if mode == 'file':
     modeFile(from_files, argv)
+  if mode == 'verify':
+    modeVerify(argv)
 
 if __name__ == '__main__':
   main(sys.argv)
@@ -0,0 +1,384 @@
+"""
+  Fixed point emulation of the MFCC calculation on the MCU (firmware/src/audioprocessing.c).
+
+  All steps are ported from the CMSIS-DSP q15/q31 functions as they run on a Cortex-M4
+  (ARM_MATH_DSP code path) and produce the same integers as the MCU:
+
+    arm_cfft_q15        1024 point complex FFT, radix-4 with 2 bit downscale per stage
+    cmpl_mag_q15        magnitude with arm_sqrt_q31
+    compact mel matrix  int32 accumulation, see mfcc_utils.mel_compact_dot
+    dct2_q15            reorder, arm_rfft_q15 and real part (twiddle step is off in firmware)
+
+  Everything is vectorized over leading dimensions, so whole data sets can be processed.
+"""
+
+import functools
+
+import numpy as np
+
+import edison.mfcc.mfcc_utils as mfu
+
+from config import *
+
+######################################################################
+# integer helpers
+######################################################################
+
+def _wrap16(x):
+  """
+    cast to q15_t, upper bits are dropped as on the MCU
+  """
+  return ((x + 2**15) & 0xffff) - 2**15
+
+def _wrap32(x):
+  """
+    cast to q31_t, upper bits are dropped as on the MCU
+  """
+  return ((x + 2**31) & 0xffffffff) - 2**31
+
+def _sat16(x):
+  """
+    __SSAT(x, 16)
+  """
+  return np.clip(x, -2**15, 2**15-1)
+
+def _cmul(cr, ci, r, i):
+  """
+    (__SMUAD(C, R) >> 16, __SMUSDX(C, R) >> 16), as used in the radix-4 butterfly. Takes int32
+    arrays, the sum of products wraps as on the MCU
+  """
+  return (cr*r + ci*i) >> 16, (cr*i - ci*r) >> 16
+
+######################################################################
+# CMSIS tables
+######################################################################
+
+@functools.lru_cache(maxsize=None)
+def cfft_twiddle_q15(N):
+  """
+    twiddleCoef_N_q15 as complex pairs [3N/4, 2], rounded down as in arm_common_tables.c
+  """
+  a = 2*np.pi*np.arange(3*N//4)/N
+  t = np.stack((np.cos(a), np.sin(a)), axis=-1)
+  t = np.clip(np.floor(t*2**15), -2**15, 2**15-1).astype('int64')
+  t.setflags(write=False)
+  return t
+
+@functools.lru_cache(maxsize=None)
+def rfft_coef_q15():
+  """
+    realCoefAQ15 and realCoefBQ15 as complex pairs [4096, 2]
+  """
+  a = 2*np.pi/(2*4096)*np.arange(4096)
+  A = np.stack((0.5*(1.0 - np.sin(a)), 0.5*(-1.0*np.cos(a))), axis=-1)
+  B = np.stack((0.5*(1.0 + np.sin(a)), 0.5*(1.0*np.cos(a))), axis=-1)
+  A = np.clip(np.round(A*2**15), -2**15, 2**15-1).astype('int64')
+  B = np.clip(np.round(B*2**15), -2**15, 2**15-1).astype('int64')
+  A.setflags(write=False)
+  B.setflags(write=False)
+  return A, B
+
+@functools.lru_cache(maxsize=None)
+def _bitrev_idx(N):
+  bits = int(np.log2(N))
+  idx = np.arange(N)
+  rev = np.zeros(N, dtype='int64')
+  for b in range(bits):
+    rev |= ((idx >> b) & 1) << (bits-1-b)
+  return rev
+
+######################################################################
+# transforms
+######################################################################
+
+def cfft_q15(re, im):
+  """
+    arm_cfft_q15 forward transform with bit reversal for N = 16, 64, 256, 1024, 4096.
+    Output is downscaled by N (2 bits per radix-4 stage).
+
+      re, im        real and imaginary part, int arrays of shape [..., N]
+
+    returns re, im of the FFT as int32 arrays holding q15 values
+  """
+  re = np.asarray(re, dtype='int32')
+  im = np.asarray(im, dtype='int32')
+  shape = re.shape
+  N = shape[-1]
+  assert N in (16, 64, 256, 1024, 4096), 'only radix-4 lengths are supported'
+  coef = cfft_twiddle_q15(N).astype('int32')
+  re = re.reshape(-1, N)
+  im = im.reshape(-1, N)
+  B = re.shape[0]
+
+  # first and middle stages, butterflies of 4 points with distance n2
+  n2 = N
+  mod = 1
+  first = True
+  while n2 > 4:
+    n1 = n2
+    n2 >>= 2
+
+    # [batch, group, 4 inputs, butterfly in group]
+    xr = re.reshape(B, N//n1, 4, n2)
+    xi = im.reshape(B, N//n1, 4, n2)
+    ic = np.arange(n2)*mod
+    c1r, c1i = coef[ic, 0], coef[ic, 1]
+    c2r, c2i = coef[2*ic, 0], coef[2*ic, 1]
+    c3r, c3i = coef[3*ic, 0], coef[3*ic, 1]
+
+    ar, ai = xr[:, :, 0], xi[:, :, 0]
+    br, bi = xr[:, :, 1], xi[:, :, 1]
+    cr, ci = xr[:, :, 2], xi[:, :, 2]
+    dr, di = xr[:, :, 3], xi[:, :, 3]
+
+    if first:
+      # input is downscaled by 2 bits
+      ar, ai, br, bi, cr, ci, dr, di = (v >> 2 for v in (ar, ai, br, bi, cr, ci, dr, di))
+
+    Rr, Ri = _sat16(ar + cr), _sat16(ai + ci)
+    Sr, Si = _sat16(ar - cr), _sat16(ai - ci)
+    Tr, Ti = _sat16(br + dr), _sat16(bi + di)
+    Ur, Ui = _sat16(br - dr), _sat16(bi - di)
+
+    out_r = np.empty_like(xr)
+    out_i = np.empty_like(xi)
+    if first:
+      out_r[:, :, 0], out_i[:, :, 0] = (Rr + Tr) >> 1, (Ri + Ti) >> 1
+      Rr, Ri = _sat16(Rr - Tr), _sat16(Ri - Ti)
+      # __QASX and __QSAX
+      Xr, Xi = _sat16(Sr - Ui), _sat16(Si + Ur)
+      Yr, Yi = _sat16(Sr + Ui), _sat16(Si - Ur)
+    else:
+      out_r[:, :, 0], out_i[:, :, 0] = (Rr + Tr) >> 2, (Ri + Ti) >> 2
+      Rr, Ri = (Rr - Tr) >> 1, (Ri - Ti) >> 1
+      # __SHASX and __SHSAX
+      Xr, Xi = (Sr - Ui) >> 1, (Si + Ur) >> 1
+      Yr, Yi = (Sr + Ui) >> 1, (Si - Ur) >> 1
+
+    out_r[:, :, 1], out_i[:, :, 1] = _cmul(c2r, c2i, Rr, Ri)
+    out_r[:, :, 2], out_i[:, :, 2] = _cmul(c1r, c1i, Yr, Yi)
+    out_r[:, :, 3], out_i[:, :, 3] = _cmul(c3r, c3i, Xr, Xi)
+
+    re = out_r.reshape(B, N)
+    im = out_i.reshape(B, N)
+    mod <<= 2
+    first = False
+
+  # last stage without twiddles
+  xr = re.reshape(B, N//4, 4)
+  xi = im.reshape(B, N//4, 4)
+  Rr, Ri = _sat16(xr[..., 0] + xr[..., 2]), _sat16(xi[..., 0] + xi[..., 2])
+  Tr, Ti = _sat16(xr[..., 1] + xr[..., 3]), _sat16(xi[..., 1] + xi[..., 3])
+  Sr, Si = _sat16(xr[..., 0] - xr[..., 2]), _sat16(xi[..., 0] - xi[..., 2])
+  Ur, Ui = _sat16(xr[..., 1] - xr[..., 3]), _sat16(xi[..., 1] - xi[..., 3])
+  out_r = np.empty_like(xr)
+  out_i = np.empty_like(xi)
+  out_r[..., 0], out_i[..., 0] = (Rr + Tr) >> 1, (Ri + Ti) >> 1
+  out_r[..., 1], out_i[..., 1] = (Rr - Tr) >> 1, (Ri - Ti) >> 1
+  out_r[..., 2], out_i[..., 2] = (Sr + Ui) >> 1, (Si - Ur) >> 1
+  out_r[..., 3], out_i[..., 3] = (Sr - Ui) >> 1, (Si + Ur) >> 1
+
+  # bit reversal
+  rev = _bitrev_idx(N)
+  return out_r.reshape(B, N)[:, rev].reshape(shape), out_i.reshape(B, N)[:, rev].reshape(shape)
+
+def rfft_q15(x):
+  """
+    arm_rfft_q15 forward transform of real input of length N = 32, 128, 512, 2048, 8192
+
+      x             real input, int array of shape [..., N]
+
+    returns re, im of all N outputs as int64 arrays holding q15 values
+  """
+  x = np.asarray(x, dtype='int64')
+  N = x.shape[-1]
+  L = N//2
+  A, B = rfft_coef_q15()
+  mod = 8192//N
+
+  # complex FFT of N/2 points on the interleaved real input
+  Xr, Xi = cfft_q15(x[..., 0::2], x[..., 1::2])
+
+  # split
+  i = np.arange(1, L)
+  s1r, s1i = Xr[..., i], Xi[..., i]
+  s2r, s2i = Xr[..., L-i], Xi[..., L-i]
+  Ar, Ai = A[i*mod, 0], A[i*mod, 1]
+  Br, Bi = B[i*mod, 0], B[i*mod, 1]
+
+  outR = _wrap16(_wrap32(_wrap32(s1r*Ar - s1i*Ai) + s2r*Br + s2i*Bi) >> 16)
+  outI = _wrap32(_wrap32(s2r*Bi - s2i*Br) + s1r*Ai + s1i*Ar) >> 16
+
+  re = np.zeros(x.shape, dtype='int64')
+  im = np.zeros(x.shape, dtype='int64')
+  re[..., 0] = (Xr[..., 0] + Xi[..., 0]) >> 1
+  re[..., L] = (Xr[..., 0] - Xi[..., 0]) >> 1
+  re[..., i] = outR
+  im[..., i] = _wrap16(outI)
+  re[..., N-i] = outR
+  im[..., N-i] = _wrap16(-outI)
+  return re, im
+
+def sqrt_q31(x):
+  """
+    arm_sqrt_q31, including its float32 initial guess and 3 Newton iterations
+  """
+  x = np.asarray(x, dtype='int64')
+  pos = x > 0
+  number = np.where(pos, x, 1)
+
+  # count leading sign bits and normalize to an even shift
+  signBits1 = 32 - np.frexp(number.astype('float64'))[1] - 1
+  shift = np.where(signBits1 % 2 == 0, signBits1, signBits1 - 1)
+  number = _wrap32(number << shift)
+  half = number >> 1
+  temp1 = number
+
+  # initial guess with the inverse square root magic number
+  temp_float1 = number.astype('float32') * np.float32(4.6566128731e-010)
+  bits_val1 = temp_float1.view('int32').astype('int64')
+  bits_val1 = _wrap32(0x5f3759df - (bits_val1 >> 1))
+  temp_float1 = bits_val1.astype('int32').view('float32')
+  var1 = (temp_float1 * np.float32(1073741824)).astype('int64')
+
+  # 3 Newton iterations
+  for n in range(3):
+    tmp = _wrap32((var1 * var1) >> 31)
+    tmp = _wrap32((tmp * half) >> 31)
+    var1 = _wrap32(_wrap32((var1 * _wrap32(0x30000000 - tmp)) >> 31) << 2)
+
+  # multiply with original value and shift down
+  var1 = _wrap32(_wrap32((temp1 * var1) >> 31) << 1)
+  var1 = var1 >> (shift // 2)
+  return np.where(pos, var1, 0)
+
+def cmpl_mag_q15(re, im):
+  """
+    magnitude of complex q15 numbers as in audioprocessing.c
+  """
+  re = np.asarray(re, dtype='int64')
+  im = np.asarray(im, dtype='int64')
+  return _wrap16(sqrt_q31(_wrap32(re*re + im*im)) >> 16)
+
+def cmplx_mult_cmplx_q15(ar, ai, br, bi):
+  """
+    arm_cmplx_mult_cmplx_q15, output in 3.13 format
+  """
+  return (_wrap16(((ar*br) >> 17) - ((ai*bi) >> 17)),
+          _wrap16(((ar*bi) >> 17) + ((ai*br) >> 17)))
+
+def dct2_q15(x, dct_twiddle=None):
+  """
+    dct2_q15 as in audioprocessing.c: Makhoul reorder, arm_rfft_q15 and real part. The
+    firmware does not apply the twiddle factors, pass dctTwiddleFactorsq15 as [N, 2] in
+    dct_twiddle to include that step (arm_cmplx_mult_cmplx_q15 and arm_shift_q15 by 2).
+
+      x             int array of shape [..., N]
+  """
+  x = np.asarray(x, dtype='int64')
+  N = x.shape[-1]
+
+  # reorder even and odd elements
+  v = np.empty_like(x)
+  v[..., :N//2] = x[..., 0::2]
+  v[..., N//2:] = x[..., -1::-2]
+
+  re, im = rfft_q15(v)
+
+  if dct_twiddle is not None:
+    re, im = cmplx_mult_cmplx_q15(re, im, dct_twiddle[:, 0], dct_twiddle[:, 1])
+    re = _sat16(re << 2)
+  return re
+
+######################################################################
+# MFCC
+######################################################################
+
+def mfcc_q15(frames, mel_mtx_compact, mel_comp_fstarts, mel_comp_fcount, mel_mtx_scale,
+    log_lut=None, dct_twiddle=None):
+  """
+    Calculate MFCCs of frames exactly as audioCalcMFCCs on the MCU.
+
+      frames            int16 frames of shape [..., frame_len]
+      mel_mtx_compact   compact mel matrix tables, see mfcc_utils.mel_constants
+      mel_comp_fstarts
+      mel_comp_fcount
+      mel_mtx_scale
+      log_lut           if given, apply logLutq15 to mel spectrum (not done in firmware)
+      dct_twiddle       if given, apply DCT twiddle factors (not done in firmware)
+
+    returns dict with fft (re and im), spectrogram, mel_spectrogram and mfcc, all int16. The
+    spectrogram only holds the frame_len//2+1 bins used for the mel spectrum.
+  """
+  frames = np.asarray(frames, dtype='int32')
+  frame_len = frames.shape[-1]
+
+  fft_re, fft_im = cfft_q15(frames, np.zeros_like(frames))
+  spectrogram = cmpl_mag_q15(fft_re[..., :frame_len//2+1], fft_im[..., :frame_len//2+1])
+  mel_spectrogram = mfu.mel_compact_dot(spectrogram, mel_mtx_compact,
+    mel_comp_fstarts, mel_comp_fcount, mel_mtx_scale)
+  log_mel_spectrogram = mel_spectrogram
+  if log_lut is not None:
+    log_mel_spectrogram = log_lut[np.clip(mel_spectrogram, 0, log_lut.shape[0]-1)]
+  mfcc = dct2_q15(log_mel_spectrogram, dct_twiddle=dct_twiddle)
+
+  return {
+    'fft': np.stack((fft_re, fft_im), axis=-1).astype('int16'),
+    'spectrogram': spectrogram.astype('int16'),
+    'mel_spectrogram': mel_spectrogram.astype('int16'),
+    'log_mel_spectrogram': np.asarray(log_mel_spectrogram).astype('int16'),
+    'mfcc': mfcc.astype('int16'),
+  }
+
+def mfcc_q15_batch(data, \
+  fs, nSamples, frame_len, frame_step, frame_count, \
+  fft_len, \
+  mel_nbins, mel_lower_hz, mel_upper_hz, mel_mtx_scale, use_log=False, \
+  first_mfcc=0, num_mfcc=None, batch_size=16, use_dct_twiddle=False):
+  """
+    Same interface as mfcc_utils.mfcc_mcu_batch but bit exact to the MCU fixed point calculation.
+
+      data          input data of shape [n_clips, samples]
+      use_log       apply the q15 log LUT to the mel spectrum
+      use_dct_twiddle apply the Makhoul twiddle factors in the DCT
+
+    returns int16 array of shape [n_clips, frame_count, num_mfcc]
+  """
+  data = np.asarray(data)
+  if data.ndim == 1:
+    data = data.reshape(1,-1)
+  n_clips = data.shape[0]
+  assert fft_len == frame_len, 'MCU only supports fft_len == frame_len'
+
+  if frame_count == 0:
+    frame_count = 1 + (nSamples - frame_len) // frame_step
+  if num_mfcc is None:
+    num_mfcc = mel_nbins - first_mfcc
+
+  c = mfu.mel_constants(num_mel_bins=mel_nbins, num_spectrogram_bins=frame_len//2+1, sample_rate=fs,
+    lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz, mel_mtx_scale=mel_mtx_scale)
+  log_lut = c['log_lut'] if use_log else None
+  dct_twiddle = c['dct_twiddle_s16'].reshape(-1,2).astype('int64') if use_dct_twiddle else None
+
+  output = np.empty((n_clips, frame_count, num_mfcc), dtype='int16')
+
+  for start in range(0, n_clips, batch_size):
+    chunk = np.ascontiguousarray(data[start:start+batch_size], dtype='int16')
+    framed = mfu.frame_clips(chunk, frame_len, frame_step, frame_count)
+    o = mfcc_q15(framed, c['mel_mtx_compact'], c['mel_comp_fstarts'], c['mel_comp_fcount'],
+      mel_mtx_scale, log_lut=log_lut, dct_twiddle=dct_twiddle)
+    output[start:start+chunk.shape[0]] = o['mfcc'][..., first_mfcc:first_mfcc+num_mfcc]
+
+  return output
+
+def mfcc_to_net_input(mfcc, net_type='cube'):
+  """
+    mfccToNetInput in app.c: cast to float for cube, scale and clip to int8 for nnom
+  """
+  mfcc = np.asarray(mfcc, dtype='int64')
+  if net_type == 'nnom':
+    scale = int(1.0/nnom_net_input_scale)
+    # C division truncates towards zero
+    tmp = np.where(mfcc < 0, -(-mfcc // scale), mfcc // scale)
+    return np.clip(tmp, nnom_net_input_clip_min, nnom_net_input_clip_max).astype('int8')
+  return mfcc.astype('float32')
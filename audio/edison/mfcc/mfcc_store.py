@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pathlib
+
+import numpy as np
+
+import edison.mfcc.mfcc_utils as mfu
+
+from config import *
+
+# increase when the MFCC calculation changes, stored features of older versions are not used
+STORE_VERSION = 2
+
+######################################################################
+# hashing
+######################################################################
+
+def clipHash(x):
+  """
+    Content hash of one audio clip, includes type and length of the samples
+  """
+  x = np.ascontiguousarray(x)
+  h = hashlib.blake2b(digest_size=16)
+  h.update(('%s%s' % (x.dtype.str, x.shape)).encode())
+  h.update(x.tobytes())
+  return h.hexdigest()
+
+def configHash(mfcc_batch_fun, args, kwargs):
+  """
+    Hash of a MFCC configuration: function name, all arguments except the data, which hold
+    the sample rate, framing, FFT, mel and coefficient settings, and STORE_VERSION. Other
+    config values do not change the features and do not start a new store.
+    Returns the hash and a readable description of the configuration.
+  """
+  name = '%s.%s' % (mfcc_batch_fun.__module__, mfcc_batch_fun.__qualname__)
+  desc = '%s\nversion %d\nargs   %r\nkwargs %r\n' % (name, STORE_VERSION, tuple(args), sorted(kwargs.items()))
+  h = hashlib.sha1(desc.encode()).hexdigest()[:16]
+  return h, desc
+
+######################################################################
+# store
+######################################################################
+
+class MfccStore:
+  """
+    Per clip MFCC cache. Clips are addressed by the hash of their samples and each MFCC
+    configuration has its own directory, so new clips only cost their own featurization and
+    a changed configuration misses exactly the entries computed with the old one.
+
+      root/<config hash>/config.txt         readable description of the configuration
+      root/<config hash>/index.npz          clip hash -> shard, row
+      root/<config hash>/shard_000000.npy   features of one batch of newly computed clips
+
+    Takes the same arguments as mfcc_utils.mfcc_parallel, without the data.
+  """
+  def __init__(self, *args, mfcc_batch_fun=mfu.mfcc_mcu_batch, root=cache_dir+'/mfcc_store/', **kwargs):
+    self.mfcc_batch_fun = mfcc_batch_fun
+    self.args = args
+    self.kwargs = kwargs
+    self.config_hash, desc = configHash(mfcc_batch_fun, args, kwargs)
+    self.path = pathlib.Path(root) / self.config_hash
+    self.path.mkdir(parents=True, exist_ok=True)
+    with open(self.path / 'config.txt', 'w') as fd:
+      fd.write(desc)
+    self._loadIndex()
+
+  def __len__(self):
+    return len(self.index)
+
+  def __contains__(self, key):
+    return key in self.index
+
+  def _loadIndex(self):
+    self.index = {}
+    self.n_shards = 0
+    try:
+      with np.load(self.path / 'index.npz') as npz:
+        keys, shards, rows = npz['keys'], npz['shards'], npz['rows']
+    except (OSError, KeyError):
+      return
+    self.index = {k: (s, r) for k, s, r in zip(keys.tolist(), shards.tolist(), rows.tolist())}
+    self.n_shards = int(shards.max())+1 if len(shards) else 0
+
+  def _save(self, fname, save_fun, *args, **kwargs):
+    # write to temporary file and rename, a crash never leaves a half written file
+    tmp = self.path / (fname+'.tmp')
+    with open(tmp, 'wb') as fd:
+      save_fun(fd, *args, **kwargs)
+    os.replace(tmp, self.path / fname)
+
+  def _append(self, keys, features):
+    shard = self.n_shards
+    self._save('shard_%06d.npy' % shard, np.save, features)
+    for row, k in enumerate(keys):
+      self.index[k] = (shard, row)
+    self.n_shards += 1
+    items = list(self.index.items())
+    self._save('index.npz', np.savez,
+      keys=np.array([k for k, _ in items], dtype='U32'),
+      shards=np.array([v[0] for _, v in items], dtype='int32'),
+      rows=np.array([v[1] for _, v in items], dtype='int32'))
+
+  def get(self, data, n_workers=None, verbose=True):
+    """
+      MFCC of all clips in data, only clips not yet in the store are calculated.
+
+        data        input data of shape [n_clips, samples]
+        n_workers   processes used for missing clips, see mfcc_utils.mfcc_parallel
+
+      returns array of shape [n_clips, frame_count, num_mfcc] as returned by mfcc_batch_fun
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+      data = data.reshape(1,-1)
+    keys = [clipHash(x) for x in data]
+
+    # calculate missing clips, each distinct clip once
+    missing = {}
+    for i, k in enumerate(keys):
+      if k not in self.index and k not in missing:
+        missing[k] = i
+    if verbose:
+      print('MfccStore %s: %d of %d clips cached, calculating %d' % (self.config_hash,
+        len(keys)-sum(k in missing for k in keys), len(keys), len(missing)))
+    if len(missing) > 0:
+      features = mfu.mfcc_parallel(data[list(missing.values())], *self.args,
+        mfcc_batch_fun=self.mfcc_batch_fun, n_workers=n_workers, verbose=verbose, **self.kwargs)
+      self._append(list(missing.keys()), features)
+
+    # gather from shards, each shard is read once
+    by_shard = {}
+    for i, k in enumerate(keys):
+      shard, row = self.index[k]
+      by_shard.setdefault(shard, ([], []))
+      by_shard[shard][0].append(i)
+      by_shard[shard][1].append(row)
+
+    output = None
+    for shard, (idx, rows) in by_shard.items():
+      features = np.load(self.path / ('shard_%06d.npy' % shard), mmap_mode='r')
+      if output is None:
+        output = np.empty((len(keys),)+features.shape[1:], dtype=features.dtype)
+      output[idx] = features[rows]
+    return output
@@ -4,6 +4,13 @@
 # @Last Modified by:   Noah Huetter
 # @Last Modified time: 2020-05-27 16:31:39
 
+import functools
+import pathlib
+import os
+import threading
+import zipfile
+import concurrent.futures
+
 import numpy as np
 from scipy.fftpack import dct
 from tqdm import tqdm
@@ -72,6 +79,130 @@ def gen_mel_weight_matrix(num_mel_bins=20, num_spectrogram_bins=129, sample_rate
   # Re-add the zeroed lower bins we sliced out above
   return np.pad(mel_weights_matrix, [[n_bands_to_zero, 0], [0, 0]])
 
+def melMtxToUnspares(mel_mtx):
+  """
+    convert mel matrix to unsparse form
+    melMtxCompact, melCompFStarts, melCompFCount = melMtxToUnspares(mel_mtx)
+  """
+
+  melMtxCompact = []
+  melCompFStarts = []
+  melCompFCount = []
+
+  # loop over cols which each represents an output mel as linear combination
+  # of input freqs
+  for ncol in range(mel_mtx.shape[1]):
+    vec = mel_mtx[:,ncol]
+    first_frq = vec.nonzero()[0][0]
+    nonzero_cnt = np.count_nonzero(vec)
+
+    vec_snippet = vec[first_frq:first_frq+nonzero_cnt]
+
+    melMtxCompact += vec_snippet.tolist()
+    melCompFStarts.append(first_frq)
+    melCompFCount.append(nonzero_cnt)
+
+  melMtxCompact = np.array(melMtxCompact, dtype='int16')
+  melCompFStarts = np.array(melCompFStarts, dtype='int16')
+  melCompFCount = np.array(melCompFCount, dtype='int16')
+
+  assert melCompFCount.sum() == melMtxCompact.size
+
+  return melMtxCompact, melCompFStarts, melCompFCount
+
+def mel_compact_dot(spectrogram, mel_mtx_compact, mel_comp_fstarts, mel_comp_fcount, mel_mtx_scale):
+  """
+    Mel spectrogram from the compact mel matrix, same integer arithmetic as the MCU
+    with USE_MEL_MTX_COMPACT: int32 accumulation, division by mel_mtx_scale rounding
+    towards zero and cast to int16. Only the nonzero band of each mel bin is multiplied.
+
+      spectrogram       int16 spectrum of shape [..., num_spectrogram_bins]
+      mel_mtx_compact   compact mel matrix as from melMtxToUnspares
+      mel_comp_fstarts  first frequency of each mel bin
+      mel_comp_fcount   number of frequencies of each mel bin
+      mel_mtx_scale     scale the compact matrix was created with
+
+    returns int16 array of shape [..., num_mel_bins]
+  """
+  fstarts = np.asarray(mel_comp_fstarts, dtype='int32')
+  fcount = np.asarray(mel_comp_fcount, dtype='int32')
+
+  # frequency index of each compact coefficient and where each mel bin starts in it
+  offsets = np.concatenate(([0], np.cumsum(fcount)[:-1]))
+  frq = np.arange(fcount.sum()) - np.repeat(offsets - fstarts, fcount)
+
+  # segment sum in int32, overflows wrap as on the MCU
+  prod = np.asarray(spectrogram, dtype='int32')[..., frq] * np.asarray(mel_mtx_compact, dtype='int32')
+  acc = np.add.reduceat(prod, offsets, axis=-1).astype('int64')
+
+  # C integer division truncates towards zero, then cast to q15
+  mel = np.where(acc < 0, -(-acc // mel_mtx_scale), acc // mel_mtx_scale)
+  return mel.astype('int16')
+
+def mel_constants(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins, sample_rate=fs, \
+    lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz, \
+    mel_mtx_scale=mel_mtx_scale, mel_twiddle_scale=mel_twiddle_scale):
+  """
+    Get all constants used for MFCC calculation on host and MCU. Computed once per
+    setting and kept in memory and in cache_dir/mfcc_constants/ as .npz
+
+      mel_mtx           float mel weight matrix [num_spectrogram_bins, num_mel_bins]
+      mel_mtx_s16       mel_mtx scaled by mel_mtx_scale as int16
+      mel_mtx_compact   nonzero band of each mel_mtx_s16 column, see melMtxToUnspares
+      mel_comp_fstarts  first frequency bin of each column in mel_mtx_compact
+      mel_comp_fcount   number of frequency bins of each column in mel_mtx_compact
+      dct_twiddle_s16   twiddle factors for Makhoul DCT, interleaved real/imag as int16
+      log_lut           LUT for ln(x) for x in [0,32766]
+
+    Returned arrays are read-only, copy before modifying.
+  """
+  return _mel_constants(int(num_mel_bins), int(num_spectrogram_bins), float(sample_rate),
+    float(lower_edge_hertz), float(upper_edge_hertz), int(mel_mtx_scale), int(mel_twiddle_scale))
+
+@functools.lru_cache(maxsize=16)
+def _mel_constants(num_mel_bins, num_spectrogram_bins, sample_rate, lower_edge_hertz, upper_edge_hertz,
+    mel_mtx_scale, mel_twiddle_scale):
+  fname = cache_dir+'/mfcc_constants/mel_%d_%d_%d_%.1f_%.1f_%d_%d.npz' % (num_mel_bins, num_spectrogram_bins,
+    sample_rate, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, mel_twiddle_scale)
+
+  keys = ['mel_mtx', 'mel_mtx_s16', 'mel_mtx_compact', 'mel_comp_fstarts', 'mel_comp_fcount',
+    'dct_twiddle_s16', 'log_lut']
+
+  # if in cache, use it, missing or broken files are recalculated
+  try:
+    with np.load(fname) as npz:
+      c = {k: npz[k] for k in keys}
+  except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+    c = {}
+
+    # mel matrix
+    c['mel_mtx'] = gen_mel_weight_matrix(num_mel_bins=num_mel_bins, num_spectrogram_bins=num_spectrogram_bins,
+      sample_rate=sample_rate, lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz)
+    c['mel_mtx_s16'] = np.array(mel_mtx_scale*c['mel_mtx'], dtype='int16')
+
+    # unsparse form
+    c['mel_mtx_compact'], c['mel_comp_fstarts'], c['mel_comp_fcount'] = melMtxToUnspares(c['mel_mtx_s16'])
+
+    # scale vector for fast DCT by Makhoul1980
+    k = np.arange(num_mel_bins)
+    factors = 2 * np.exp(-1j*np.pi*k/(2*num_mel_bins))
+    c['dct_twiddle_s16'] = np.empty((2*num_mel_bins,), dtype='int16')
+    c['dct_twiddle_s16'][0::2] = np.array(mel_twiddle_scale*factors.real, dtype='int16')
+    c['dct_twiddle_s16'][1::2] = np.array(mel_twiddle_scale*factors.imag, dtype='int16')
+
+    # LUT for ln(x) for x in [0,32766]
+    c['log_lut'] = np.array(np.log(np.linspace(1e-6,32766,32767)), dtype='int16')
+
+    # write to a temporary file and rename, parallel workers never see a partial file
+    pathlib.Path(fname).parent.mkdir(parents=True, exist_ok=True)
+    tmp_name = '%s.%d.%d.tmp.npz' % (fname[:-4], os.getpid(), threading.get_ident())
+    np.savez(tmp_name, **c)
+    os.replace(tmp_name, fname)
+
+  for v in c.values():
+    v.setflags(write=False)
+  return c
+
 def batch_mfcc(data, \
   fs, nSamples, frame_len, frame_step, frame_count, \
   fft_len, \
@@ -111,9 +242,9 @@ def batch_mfcc(data, \
       num_spectrogram_bins = len(spectrogram)
 
       # calculate mel weights
-      mel_weight_matrix = gen_mel_weight_matrix(num_mel_bins=mel_nbins, 
+      mel_weight_matrix = mel_constants(num_mel_bins=mel_nbins, 
         num_spectrogram_bins=num_spectrogram_bins, sample_rate=fs,
-        lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz)
+        lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz)['mel_mtx']
 
       # dot product of spectrum and mel matrix to get mel spectrogram
       mel_spectrogram = np.dot(spectrogram, mel_weight_matrix)
@@ -176,9 +307,9 @@ def mfcc(data, \
     num_spectrogram_bins = len(frame['spectrogram'])
 
     # calculate mel weights
-    mel_weight_matrix = gen_mel_weight_matrix(num_mel_bins=mel_nbins, 
+    mel_weight_matrix = mel_constants(num_mel_bins=mel_nbins, 
       num_spectrogram_bins=num_spectrogram_bins, sample_rate=fs,
-      lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz)
+      lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz)['mel_mtx']
     frame['mel_weight_matrix'] = mel_weight_matrix
 
     # dot product of spectrum and mel matrix to get mel spectrogram
@@ -252,6 +383,20 @@ def mfcc_tf(data, \
     output.append(frame)
   return output
 
+def frame_clips(data, frame_len, frame_step, frame_count):
+  """
+    Strided view [n_clips, frame_count, frame_len] of the clips data [n_clips, samples], no copy.
+    Clips shorter than the frames need are zero padded at the end
+  """
+  data = np.ascontiguousarray(data)
+  n_needed = (frame_count-1)*frame_step+frame_len
+  if data.shape[1] < n_needed:
+    data = np.pad(data, ((0, 0), (0, n_needed-data.shape[1])), mode='constant')
+  return np.lib.stride_tricks.as_strided(data,
+    shape=(data.shape[0], frame_count, frame_len),
+    strides=(data.strides[0], frame_step*data.strides[1], data.strides[1]),
+    writeable=False)
+
 def mfcc_mcu(data, \
   fs, nSamples, frame_len, frame_step, frame_count, \
   fft_len, \
@@ -277,11 +422,14 @@ def mfcc_mcu(data, \
   if frame_count == 0:
     frame_count = 1 + (nSamples - frame_len) // frame_step
   output = []
+
+  # zero pad short input, as mfcc_mcu_batch
+  data = frame_clips(np.asarray(data).reshape(1,-1), frame_len, frame_step, frame_count)[0]
   
   # calculate mel matrix
-  mel_weight_matrix = mel_mtx_scale*gen_mel_weight_matrix(num_mel_bins=mel_nbins, 
+  mel_weight_matrix = mel_mtx_scale*mel_constants(num_mel_bins=mel_nbins, 
     num_spectrogram_bins=frame_len//2+1, sample_rate=fs,
-    lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz)
+    lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz, mel_mtx_scale=mel_mtx_scale)['mel_mtx']
 
   # Iterate over each frame of data
   for frame_ctr in range(frame_count):
@@ -290,7 +438,7 @@ def mfcc_mcu(data, \
     frame['t_end'] = (frame_ctr*frame_step+frame_len)/fs
 
     # get chunk of data
-    chunk = np.array(data[frame_ctr*frame_step : frame_ctr*frame_step+frame_len])
+    chunk = np.array(data[frame_ctr])
     sample_size = chunk.shape[0]
 
     # calculate FFT
@@ -304,8 +452,15 @@ def mfcc_mcu(data, \
     # calculate mel weights
     frame['mel_weight_matrix'] = mel_weight_matrix
 
-    # dot product of spectrum and mel matrix to get mel spectrogram
-    mel_spectrogram = np.dot(spectrogram[:(sample_size//2)+1], mel_weight_matrix)
+    # Add frame to output list
+    output.append(frame)
+
+  # dot product of spectrum and mel matrix to get mel spectrogram, one matmul over all
+  # frames with the same operand layout as mfcc_mcu_batch so both agree exactly
+  spectrograms = np.array([frame['spectrogram'][:(frame_len//2)+1] for frame in output])
+  mel_spectrograms = np.dot(spectrograms, mel_weight_matrix)
+
+  for frame, mel_spectrogram in zip(output, mel_spectrograms):
     mel_spectrogram /= mel_mtx_scale
     frame['mel_spectrogram'] = mel_spectrogram
     
@@ -317,10 +472,318 @@ def mfcc_mcu(data, \
     # calculate DCT-II
     mfcc = 1.0/64*dct(mel_spectrogram, type=2)
     frame['mfcc'] = mfcc
+  return output
 
-    # Add frame to output list
-    output.append(frame)
+def mfcc_mcu_batch(data, \
+  fs, nSamples, frame_len, frame_step, frame_count, \
+  fft_len, \
+  mel_nbins, mel_lower_hz, mel_upper_hz, mel_mtx_scale, use_log=False, \
+  first_mfcc=0, num_mfcc=None, batch_size=256):
+  """
+    Same calculation as mfcc_mcu but on a whole batch of clips at once, without python loops
+    over frames. Returns a dense array instead of a list of dicts.
+
+      data          input data of shape [n_clips, samples]
+      fs            input sample rate
+      nSamples      number of samples in input
+      frame_len     length of each frame
+      frame_step    how many samples to advance the frame
+      frame_count   how many frames to compute
+      fft_len       length of FFT, ideally frame_len
+      mel_nbins     number of mel filter banks to create
+      mel_lower_hz  lowest frequency of mel bank
+      mel_upper_hz  highest frequency of mel bank
+      first_mfcc    first mfcc coefficient to return
+      num_mfcc      number of coefficients to return, None for all
+      batch_size    number of clips processed at once, bounds memory usage
+
+    returns array of shape [n_clips, frame_count, num_mfcc]
+  """
+  data = np.asarray(data)
+  if data.ndim == 1:
+    data = data.reshape(1,-1)
+  n_clips = data.shape[0]
+
+  # Calculate number of frames
+  if frame_count == 0:
+    frame_count = 1 + (nSamples - frame_len) // frame_step
+  if num_mfcc is None:
+    num_mfcc = mel_nbins - first_mfcc
+
+  # calculate mel matrix once
+  mel_weight_matrix = mel_mtx_scale*mel_constants(num_mel_bins=mel_nbins,
+    num_spectrogram_bins=frame_len//2+1, sample_rate=fs,
+    lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz, mel_mtx_scale=mel_mtx_scale)['mel_mtx']
+
+  output = np.empty((n_clips, frame_count, num_mfcc))
+
+  for start in range(0, n_clips, batch_size):
+    chunk = data[start:start+batch_size]
+
+    # frame as strided view [clips, frame_count, frame_len], short clips zero padded
+    framed = frame_clips(chunk, frame_len, frame_step, frame_count)
+
+    # one FFT over all frames, full FFT as mfcc_mcu so both agree exactly, only the
+    # non-redundant half is used
+    fft = 1.0/1024*np.fft.fft(framed, axis=-1)[..., :frame_len//2+1]
+    spectrogram = 1.0/np.sqrt(2)*np.abs(fft)
+
+    # mel spectrogram, one matmul of all frames of a clip as in mfcc_mcu so both agree exactly
+    mel_spectrogram = np.empty(spectrogram.shape[:-1] + (mel_weight_matrix.shape[1],))
+    for i in range(len(spectrogram)):
+      mel_spectrogram[i] = np.dot(spectrogram[i], mel_weight_matrix)
+    mel_spectrogram /= mel_mtx_scale
+
+    if use_log:
+      mel_spectrogram = np.log(mel_spectrogram+1e-6)
+
+    # DCT-II along mel axis
+    mfcc = 1.0/64*dct(mel_spectrogram, type=2, axis=-1)
+    output[start:start+chunk.shape[0]] = mfcc[..., first_mfcc:first_mfcc+num_mfcc]
+
+  return output
+
+def mfcc_mcu_graph(data, \
+  fs, nSamples, frame_len, frame_step, frame_count, \
+  fft_len, \
+  mel_nbins, mel_lower_hz, mel_upper_hz, mel_mtx_scale, use_log=False, \
+  first_mfcc=0, num_mfcc=None):
+  """
+    Same calculation as mfcc_mcu_batch with tensorflow ops, so it can run inside a graph,
+    e.g. in a tf.data map. Arguments as mfcc_mcu_batch.
+
+      data          tensor of shape [..., samples], any numeric dtype
+
+    returns float32 tensor of shape [..., frame_count, num_mfcc]
+  """
+  import tensorflow as tf
+
+  if frame_count == 0:
+    frame_count = 1 + (nSamples - frame_len) // frame_step
+  if num_mfcc is None:
+    num_mfcc = mel_nbins - first_mfcc
+
+  mel_weight_matrix = tf.constant(mel_constants(num_mel_bins=mel_nbins,
+    num_spectrogram_bins=frame_len//2+1, sample_rate=fs,
+    lower_edge_hertz=mel_lower_hz, upper_edge_hertz=mel_upper_hz, mel_mtx_scale=mel_mtx_scale)['mel_mtx'],
+    dtype=tf.float32)
+
+  data = tf.cast(data, tf.float32)[..., :(frame_count-1)*frame_step+frame_len]
+  framed = tf.signal.frame(data, frame_len, frame_step, axis=-1)
+
+  fft = tf.signal.rfft(framed, fft_length=[fft_len]) / 1024.0
+  spectrogram = tf.abs(fft) / float(np.sqrt(2))
+
+  # mel_mtx_scale of the matrix cancels as in mfcc_mcu_batch
+  mel_spectrogram = tf.tensordot(spectrogram, mel_weight_matrix, 1)
+
+  if use_log:
+    mel_spectrogram = tf.math.log(mel_spectrogram+1e-6)
+
+  # unnormalized DCT-II, same as scipy dct type 2
+  mfcc = tf.signal.dct(mel_spectrogram, type=2) / 64.0
+  return mfcc[..., first_mfcc:first_mfcc+num_mfcc]
+
+######################################################################
+# parallel featurization
+######################################################################
+
+# per worker process, attached shared memory of input and output
+_shard_ctx = {}
+
+def _shard_init(in_name, in_shape, in_dtype, out_name, out_shape, out_dtype):
+  from multiprocessing import shared_memory
+  in_shm = shared_memory.SharedMemory(name=in_name)
+  out_shm = shared_memory.SharedMemory(name=out_name)
+  _shard_ctx['shm'] = (in_shm, out_shm)
+  _shard_ctx['data'] = np.ndarray(in_shape, dtype=in_dtype, buffer=in_shm.buf)
+  _shard_ctx['output'] = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf)
+
+def _shard_run(start, stop, mfcc_batch_fun, args, kwargs):
+  _shard_ctx['output'][start:stop] = mfcc_batch_fun(_shard_ctx['data'][start:stop], *args, **kwargs)
+  return stop - start
+
+def _chunk_run(chunk, mfcc_batch_fun, args, kwargs):
+  return mfcc_batch_fun(chunk, *args, **kwargs)
+
+def mfcc_parallel(data, *args, mfcc_batch_fun=mfcc_mcu_batch, n_workers=None, shard_size=512,
+  verbose=True, **kwargs):
+  """
+    Run mfcc_batch_fun on data sharded over a process pool. Audio is passed to the workers
+    through shared memory and each worker writes its shard into one preallocated shared output,
+    so only the shard bounds are pickled. Takes the same arguments as mfcc_batch_fun.
+    Without multiprocessing.shared_memory (python < 3.8) the shards are pickled to the workers.
+
+      data            input data of shape [n_clips, samples]
+      mfcc_batch_fun  mfcc_mcu_batch or mfcc_q15.mfcc_q15_batch, must be importable by the workers
+      n_workers       number of processes, None for all cores
+      shard_size      number of clips per task
+      verbose         show progress bar over all shards
+
+    returns array of shape [n_clips, frame_count, num_mfcc] as returned by mfcc_batch_fun
+  """
+  data = np.ascontiguousarray(data)
+  if data.ndim == 1:
+    data = data.reshape(1,-1)
+  n_clips = data.shape[0]
+  if n_workers is None:
+    n_workers = os.cpu_count()
+
+  if n_workers <= 1 or n_clips <= shard_size:
+    return mfcc_batch_fun(data, *args, **kwargs)
+
+  # run first clip here to get output shape and type, also fills the constants cache
+  # before workers race for it
+  first = mfcc_batch_fun(data[:1], *args, **kwargs)
+
+  out_shape = (n_clips,) + first.shape[1:]
+  try:
+    from multiprocessing import shared_memory
+  except ImportError:
+    output = np.empty(out_shape, dtype=first.dtype)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as ex:
+      starts = range(0, n_clips, shard_size)
+      run = functools.partial(_chunk_run, mfcc_batch_fun=mfcc_batch_fun, args=args, kwargs=kwargs)
+      results = ex.map(run, (data[start:start+shard_size] for start in starts))
+      for start, res in zip(tqdm(starts, disable=not verbose), results):
+        output[start:start+len(res)] = res
+    return output
+
+  in_shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+  out_shm = shared_memory.SharedMemory(create=True, size=first.itemsize*int(np.prod(out_shape)))
+  try:
+    np.ndarray(data.shape, dtype=data.dtype, buffer=in_shm.buf)[:] = data
+    output = np.ndarray(out_shape, dtype=first.dtype, buffer=out_shm.buf)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=_shard_init,
+      initargs=(in_shm.name, data.shape, data.dtype.str, out_shm.name, out_shape, first.dtype.str)) as ex:
+      futures = [ex.submit(_shard_run, start, min(start+shard_size, n_clips), mfcc_batch_fun, args, kwargs)
+        for start in range(0, n_clips, shard_size)]
+      with tqdm(total=n_clips, disable=not verbose) as pbar:
+        for f in concurrent.futures.as_completed(futures):
+          pbar.update(f.result())
+
+    output = output.copy()
+  finally:
+    in_shm.close()
+    in_shm.unlink()
+    out_shm.close()
+    out_shm.unlink()
   return output
+
+class StreamingMfcc:
+  """
+    Incremental MFCC for live audio. Keeps preallocated ring buffers of the last frame_len
+    audio samples and of the last n_frames MFCC rows. push() takes any number of new samples
+    and returns the rows of frames completed by them, window is the current net input.
+
+      mfcc_fun      batch MFCC function with the interface of mfcc_mcu_batch, e.g.
+                    mfcc_q15.mfcc_q15_batch for the fixed point MCU calculation
+      frame_step    hop size, frame_step < frame_len gives overlapping frames
+      n_frames      number of MFCC rows in the window
+  """
+  def __init__(self, mfcc_fun=mfcc_mcu_batch, fs=fs, frame_len=frame_length, frame_step=frame_step,
+      n_frames=n_frames, num_mfcc=num_mfcc, first_mfcc=first_mfcc, mel_nbins=num_mel_bins,
+      mel_lower_hz=lower_edge_hertz, mel_upper_hz=upper_edge_hertz, mel_mtx_scale=mel_mtx_scale,
+      use_log=False, dtype='float32'):
+    self.mfcc_fun = mfcc_fun
+    self.fs = fs
+    self.frame_len = frame_len
+    self.frame_step = frame_step
+    self.n_frames = n_frames
+    self.num_mfcc = num_mfcc
+    self.first_mfcc = first_mfcc
+    self.mel_nbins = mel_nbins
+    self.mel_lower_hz = mel_lower_hz
+    self.mel_upper_hz = mel_upper_hz
+    self.mel_mtx_scale = mel_mtx_scale
+    self.use_log = use_log
+
+    # every element is stored twice, so the last frame_len samples and the last n_frames
+    # rows are always a contiguous slice
+    self._audio = np.zeros(2*frame_len, dtype='int16')
+    self._rows = np.zeros((2*n_frames, num_mfcc), dtype=dtype)
+    self.reset()
+
+  def reset(self):
+    """
+      Forget all audio and MFCCs
+    """
+    self._audio_pos = 0
+    self._rows_pos = 0
+    self.n_samples = 0
+    self.n_rows = 0
+    self._since_frame = 0
+    self._audio[:] = 0
+    self._rows[:] = 0
+
+  @property
+  def ready(self):
+    """
+      True when the window is filled with n_frames rows
+    """
+    return self.n_rows >= self.n_frames
+
+  @property
+  def window(self):
+    """
+      View of the last n_frames MFCC rows [n_frames, num_mfcc], oldest first. Not a copy,
+      changes with the next push()
+    """
+    return self._rows[self._rows_pos:self._rows_pos+self.n_frames]
+
+  @property
+  def frame(self):
+    """
+      View of the last frame_len audio samples
+    """
+    return self._audio[self._audio_pos:self._audio_pos+self.frame_len]
+
+  def _write_audio(self, data):
+    n = data.shape[0]
+    p = self._audio_pos
+    first = min(n, self.frame_len - p)
+    self._audio[p:p+first] = data[:first]
+    self._audio[p+self.frame_len:p+self.frame_len+first] = data[:first]
+    self._audio[:n-first] = data[first:]
+    self._audio[self.frame_len:self.frame_len+n-first] = data[first:]
+    self._audio_pos = (p + n) % self.frame_len
+
+  def _write_row(self, row):
+    p = self._rows_pos
+    self._rows[p] = row
+    self._rows[p+self.n_frames] = row
+    self._rows_pos = (p + 1) % self.n_frames
+    self.n_rows += 1
+
+  def push(self, data):
+    """
+      Add new audio samples, returns the MFCC rows of all completed frames [n, num_mfcc]
+    """
+    data = np.asarray(data).ravel()
+    rows = []
+    while data.shape[0] > 0:
+      # samples needed until the next frame is complete
+      if self.n_samples < self.frame_len:
+        need = self.frame_len - self.n_samples
+      else:
+        need = self.frame_step - self._since_frame
+      n = min(need, data.shape[0], self.frame_len)
+      self._write_audio(data[:n])
+      data = data[n:]
+      self.n_samples += n
+      self._since_frame += n
+
+      if self.n_samples >= self.frame_len and (self.n_samples == self.frame_len or self._since_frame >= self.frame_step):
+        self._since_frame = 0
+        row = self.mfcc_fun(self.frame.reshape(1,-1), self.fs, self.frame_len, self.frame_len,
+          self.frame_step, 1, self.frame_len, self.mel_nbins, self.mel_lower_hz, self.mel_upper_hz,
+          self.mel_mtx_scale, use_log=self.use_log, first_mfcc=self.first_mfcc,
+          num_mfcc=self.num_mfcc)[0,0]
+        self._write_row(row)
+        rows.append(row)
+    return np.array(rows).reshape(-1, self.num_mfcc)
+
 def dct2Makhoul(x):
   """
     Calculate DCT-II using N-point FFT as in "A Fast Cosine Transform in O'ne and Two Dimensions" - Makhoul1980
@@ -5,8 +5,13 @@
 # @Last Modified time: 2020-05-27 14:32:57
 
 import edison.audio.audioutils as au
+import edison.audio.augment as aug
 import edison.mfcc.mfcc_utils as mfu
+import edison.mfcc.mfcc_store as mfs
+import edison.train.mmap_data as mmd
+import edison.train.tf_data as tfd
 
+import hashlib
 import numpy as np
 import matplotlib.pyplot as plt
 import os
@@ -45,7 +50,15 @@ model_arch = 'kws_conv'
 
 # Mfcc settings
 mfcc_fun = mfu.mfcc_mcu # use MCU like MFCC calculation
+mfcc_batch_fun = mfu.mfcc_mcu_batch # same as mfcc_fun but on whole data set at once
+# import edison.mfcc.mfcc_q15 as mfq
+# mfcc_batch_fun = mfq.mfcc_q15_batch # bit exact fixed point MCU calculation
 use_mfcc_log = False
+mfcc_workers = None # processes for MFCC calculation, None for all cores
+mmap_mode = 'r' # train from memory mapped data set files, None to keep in RAM
+use_tf_data = False # train on raw clips with MFCC in the tf.data pipeline, no featurization pass
+augment = False # random shift, speed, gain and background noise per batch, needs use_tf_data
+augment_noise_dir = au.scDataPath+'/_background_noise_' # noise to mix in, white noise if not found
 
 # training hyperparameters
 epochs = 100
@@ -410,101 +423,172 @@ def train(model, x, y, vx, vy, batchSize = 10, epochs = 30):
   early_stopping = keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
   reduce_lr = keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=1, min_lr=1e-9)
 
-  train_history = model.fit(x, y, batch_size = batchSize, epochs = epochs, 
-    validation_data = (vx, vy), 
-    callbacks = [early_stopping, reduce_lr], shuffle=True)
+  # batches are read from the (memory mapped) arrays, shuffled every epoch
+  train_data, train_steps = dataset(x, y, batchSize)
+  val_data, val_steps = dataset(vx, vy, batchSize, shuffle=False)
+  train_history = model.fit(train_data, steps_per_epoch = train_steps, epochs = epochs, 
+    validation_data = val_data, validation_steps = val_steps, 
+    callbacks = [early_stopping, reduce_lr])
 
   return train_history
 
 ##################################################
 # load data
 
-def load_data(keywords, coldwords, noise, playsome=False):
+def mfccConfig():
+  """
+    Arguments of mfcc_batch_fun for the data set, without the data
+  """
+  args = (fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
+    num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale)
+  kwargs = {'use_log': use_mfcc_log, 'first_mfcc': first_mfcc, 'num_mfcc': num_mfcc}
+  return args, kwargs
+
+def dataStamp(keywords, coldwords, noise):
+  """
+    Description of all the stored data set depends on: the audio files by name, size and
+    modification time, the selected words and the MFCC and net input configuration
+  """
+  h = hashlib.sha1()
+  for f in sorted(pathlib.Path(speech_data_dir).rglob('*')):
+    if f.is_file() and f.suffix in ['.wav', '.npy', '.npz', '.txt']:
+      st = f.stat()
+      h.update(('%s %d %d\n' % (f.relative_to(speech_data_dir), st.st_size, st.st_mtime_ns)).encode())
+  args, kwargs = mfccConfig()
+  mfcc_hash, _ = mfs.configHash(mfcc_batch_fun, args, kwargs)
+  return 'audio %s %s\nkeywords %r\ncoldwords %r\nnoise %r\nmfcc %s\nnet input %r %r %r\n' % (
+    speech_data_dir, h.hexdigest(), list(keywords), list(coldwords) if coldwords is not None else None,
+    noise, mfcc_hash, net_input_scale, net_input_clip_min, net_input_clip_max)
+
+def load_data(keywords, coldwords, noise, playsome=False, mmap_mode=None):
   """
     Load data and compute MFCC with scaled and custom implementation as it is done on the MCU
+
+    With mmap_mode='r' the returned x arrays are memory maps of the stored files. If the
+    stored files were made from the same audio and configuration, they are opened directly,
+    or read into memory with mmap_mode=None, and nothing is calculated
   """
-  # if in cache, use it
+  stamp = dataStamp(keywords, coldwords, noise)
   try:
-    x_train   = np.load(cache_dir+'/x_train.npy')
-    x_test    = np.load(cache_dir+'/x_test.npy')
-    x_val     = np.load(cache_dir+'/x_val.npy')
-    y_train   = np.load(cache_dir+'/y_train.npy')
-    y_test    = np.load(cache_dir+'/y_test.npy')
-    y_val     = np.load(cache_dir+'/y_val.npy')
-    keywords  = np.load(cache_dir+'/keywords.npy')
-    print('Load data from cache success!')
-
-  except:
-    # failed, load from source wave files
-    # failed, load from source wave files
-    x_train, y_train, x_test, y_test, x_validation, y_val, keywords = au.load_own_speech_commands(
-      speech_data_dir, keywords=keywords, coldwords=coldwords, fs=fs, frame_length=frame_length,
-      sample_len=nSamples, playsome=playsome, test_val_size=0.2, noise=noise)
-    
-    # calculate MFCCs of training and test x data
-    o_mfcc_train = []
-    o_mfcc_test = []
-    o_mfcc_val = []
-    print('starting mfcc calculation')
-    for data in tqdm(x_train):
-      o_mfcc = mfcc_fun(data, fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, use_log=use_mfcc_log)
-      o_mfcc_train.append([x['mfcc'][first_mfcc:first_mfcc+num_mfcc] for x in o_mfcc])
-    for data in tqdm(x_test):
-      o_mfcc = mfcc_fun(data, fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, use_log=use_mfcc_log)
-      o_mfcc_test.append([x['mfcc'][first_mfcc:first_mfcc+num_mfcc] for x in o_mfcc])
-    for data in tqdm(x_validation):
-      o_mfcc = mfcc_fun(data, fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
-        num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, use_log=use_mfcc_log)
-      o_mfcc_val.append([x['mfcc'][first_mfcc:first_mfcc+num_mfcc] for x in o_mfcc])
-
-    # MCU compresses 16bit to 8bit for net input, do this also during training
-    o_mfcc_train = np.clip(np.array(o_mfcc_train) * net_input_scale, net_input_clip_min, net_input_clip_max)
-    o_mfcc_test = np.clip(np.array(o_mfcc_test) * net_input_scale, net_input_clip_min, net_input_clip_max)
-    o_mfcc_val = np.clip(np.array(o_mfcc_val) * net_input_scale, net_input_clip_min, net_input_clip_max)
-
-    # add dimension to get (x, y, 1) from to make conv2D input layer happy
-    x_train = np.expand_dims(np.array(o_mfcc_train), axis = -1)
-    x_test = np.expand_dims(np.array(o_mfcc_test), axis = -1)
-    x_val = np.expand_dims(np.array(o_mfcc_val), axis = -1)
-
-    # convert labels to categorial one-hot coded
-    y_train = to_categorical(y_train, num_classes=None)
-    y_test = to_categorical(y_test, num_classes=None)
-    y_val = to_categorical(y_val, num_classes=None)
-  
-    # shuffle test data
-    per = np.random.permutation(x_test.shape[0])
-    x_test = x_test[per, :]
-    y_test = y_test[per]
-    per = np.random.permutation(x_train.shape[0])
-    x_train = x_train[per, :]
-    y_train = y_train[per]
-    per = np.random.permutation(x_val.shape[0])
-    x_val = x_val[per, :]
-    y_val = y_val[per]
-
-    # store data
-    print('Store mfcc data')
-    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
-    np.save(cache_dir+'/x_train.npy', x_train)
-    np.save(cache_dir+'/x_test.npy', x_test)
-    np.save(cache_dir+'/x_val.npy', x_val)
-    np.save(cache_dir+'/y_train.npy', y_train)
-    np.save(cache_dir+'/y_test.npy', y_test)
-    np.save(cache_dir+'/y_val.npy', y_val)
-    np.save(cache_dir+'/keywords.npy', keywords)
-
+    with open(cache_dir+'/data_stamp.txt') as fd:
+      if fd.read() == stamp:
+        print('Using stored data set', cache_dir)
+        return mmd.load_cached(cache_dir, mmap_mode=mmap_mode)
+  except OSError:
+    pass
+
+  # audio is loaded, MFCCs of clips seen before come from the feature store
+  x_train, y_train, x_test, y_test, x_validation, y_val, keywords = au.load_own_speech_commands(
+    speech_data_dir, keywords=keywords, coldwords=coldwords, fs=fs, frame_length=frame_length,
+    sample_len=nSamples, playsome=playsome, test_val_size=0.2, noise=noise)
+
+  # MFCCs of training, test and validation x data, clips not in the store are calculated on all cores
+  print('starting mfcc calculation')
+  args, kwargs = mfccConfig()
+  store = mfs.MfccStore(*args, mfcc_batch_fun=mfcc_batch_fun, root=cache_dir+'/mfcc_store/', **kwargs)
+  o_mfcc = store.get(np.concatenate((x_train, x_test, x_validation)), n_workers=mfcc_workers)
+
+  # MCU compresses 16bit to 8bit for net input, do this also during training, in place
+  np.multiply(o_mfcc, net_input_scale, out=o_mfcc)
+  np.clip(o_mfcc, net_input_clip_min, net_input_clip_max, out=o_mfcc)
+
+  # add dimension to get (x, y, 1) from to make conv2D input layer happy, views into o_mfcc
+  x_train, x_test, x_val = np.split(np.expand_dims(o_mfcc, axis = -1), np.cumsum([len(x_train), len(x_test)]))
+
+  # convert labels to categorial one-hot coded
+  y_train = to_categorical(y_train, num_classes=None)
+  y_test = to_categorical(y_test, num_classes=None)
+  y_val = to_categorical(y_val, num_classes=None)
+
+  # shuffle test data
+  per = np.random.permutation(x_test.shape[0])
+  x_test = x_test[per, :]
+  y_test = y_test[per]
+  per = np.random.permutation(x_train.shape[0])
+  x_train = x_train[per, :]
+  y_train = y_train[per]
+  per = np.random.permutation(x_val.shape[0])
+  x_val = x_val[per, :]
+  y_val = y_val[per]
+
+  # store data, kws_nemo and kws_nnom train on these files. The stamp is written last, so
+  # files of an interrupted run are never reused
+  print('Store mfcc data')
+  pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+  if os.path.exists(cache_dir+'/data_stamp.txt'):
+    os.remove(cache_dir+'/data_stamp.txt')
+  np.save(cache_dir+'/x_train.npy', x_train)
+  np.save(cache_dir+'/x_test.npy', x_test)
+  np.save(cache_dir+'/x_val.npy', x_val)
+  np.save(cache_dir+'/y_train.npy', y_train)
+  np.save(cache_dir+'/y_test.npy', y_test)
+  np.save(cache_dir+'/y_val.npy', y_val)
+  np.save(cache_dir+'/keywords.npy', keywords)
+  with open(cache_dir+'/data_stamp.txt', 'w') as fd:
+    fd.write(stamp)
+
+  if mmap_mode is not None:
+    x_train, x_test, x_val, _, _, _, _ = mmd.load_cached(cache_dir, mmap_mode=mmap_mode)
 
   # return
   return x_train, x_test, x_val, y_train, y_test, y_val, keywords
 
+def featurize(x):
+  """
+    MCU like MFCC and net input scaling of a tensor of raw clips inside the tf.data pipeline
+  """
+  o_mfcc = mfu.mfcc_mcu_graph(x, fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
+    num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, use_log=use_mfcc_log,
+    first_mfcc=first_mfcc, num_mfcc=num_mfcc)
+  o_mfcc = tf.clip_by_value(o_mfcc * net_input_scale, net_input_clip_min, net_input_clip_max)
+  return tf.expand_dims(o_mfcc, axis=-1)
+
+def dataset(x, y, batch_size, shuffle=True):
+  """
+    Batches for model.fit and model.predict, from raw clips if use_tf_data else from MFCCs.
+    Training batches, the shuffled ones, are augmented if augment is set
+
+    returns data, steps  the batch generator or sequence and the number of batches per epoch
+  """
+  steps = (len(x) + batch_size - 1) // batch_size
+  if use_tf_data:
+    augmenter = aug.Augmenter(noise=aug.load_noise(augment_noise_dir, fs=fs)) if augment and shuffle else None
+    build = lambda: tfd.clipDataset(x, y, featurize, batch_size=batch_size, shuffle=shuffle, augment=augmenter)
+    return tfd.batchGenerator(build), steps
+  return mmd.kerasSequence(x, y, batch_size=batch_size, shuffle=shuffle), steps
+
+def load_clips(keywords, coldwords, noise, playsome=False, mmap_mode=None):
+  """
+    Load the raw int16 clips for the tf.data pipeline, same split as load_data but
+    without MFCC calculation
+
+    With mmap_mode='r' the returned x arrays are memory maps of the stored files
+  """
+  # short clips are zero padded at every frame_length position, the augmenter shifts within the padding
+  x_train, y_train, x_test, y_test, x_val, y_val, keywords = au.load_own_speech_commands(
+    speech_data_dir, keywords=keywords, coldwords=coldwords, fs=fs, frame_length=frame_length,
+    sample_len=nSamples, playsome=playsome, test_val_size=0.2, noise=noise)
+
+  # convert labels to categorial one-hot coded
+  y_train = to_categorical(y_train, num_classes=None)
+  y_test = to_categorical(y_test, num_classes=None)
+  y_val = to_categorical(y_val, num_classes=None)
+
+  # clips are shuffled by the pipeline, store them in split order
+  pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+  tfd.save_clips(cache_dir, x_train, x_test, x_val, y_train, y_test, y_val, keywords)
+
+  if mmap_mode is not None:
+    x_train, x_test, x_val, _, _, _, _ = tfd.load_clips(cache_dir, mmap_mode=mmap_mode)
+
+  return x_train, x_test, x_val, y_train, y_test, y_val, keywords
+
 def predictWithConfMatrix(model, x,y):
   """
     Predict with model and print confusion matrix
   """
-  y_pred = model.predict(x)
+  data, steps = dataset(x, y, batchSize, shuffle=False)
+  y_pred = model.predict(data, steps=steps)
   y_pred = 1.0*(y_pred > 0.5) 
 
   print('Confusion matrix:')
@@ -639,13 +723,19 @@ def main(argv):
     print('    Modes:')
     print('    train                     Train model')
     print('    test                      Load model from file and test on it')
+    print('    Set use_tf_data to train on raw clips with MFCC in a tf.data pipeline')
     exit()
     
   # load data
   keywords, coldwords, noise = ['edison', 'cinema','bedroom', 'office', 'livingroom','kitchen','on', 'off'], ['_cold_word'], 0.1
  
-  x_train, x_test, x_val, y_train, y_test, y_val, keywords = load_data(
-    keywords, coldwords, noise, playsome=playsome)
+  if augment and not use_tf_data:
+    print('augment needs use_tf_data, training without augmentation')
+
+  # raw clips with MFCC in the tf.data pipeline, or precomputed MFCCs
+  load = load_clips if use_tf_data else load_data
+  x_train, x_test, x_val, y_train, y_test, y_val, keywords = load(
+    keywords, coldwords, noise, playsome=playsome, mmap_mode=mmap_mode)
 
   print('x train shape: ', x_train.shape)
   print('x test shape: ', x_test.shape)
@@ -659,7 +749,8 @@ def main(argv):
 
   if argv[1] == 'train':
     # build model
-    model = get_model(inp_shape=x_train.shape[1:], num_classes = len(keywords))
+    inp_shape = (frame_count or n_frames, num_mfcc, 1) if use_tf_data else x_train.shape[1:]
+    model = get_model(inp_shape=inp_shape, num_classes = len(keywords))
 
     # train model
     model.summary()
@@ -1,4 +1,10 @@
 import argparse
+import copy
+import inspect
+import itertools
+import os
+import concurrent.futures
+import multiprocessing
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -9,6 +15,10 @@ import numpy as np
 
 import pathlib
 
+import edison.audio.audioutils as au
+import edison.audio.augment as aug
+import edison.mfcc.mfcc_utils as mfu
+
 from config import *
 
 in_data_dir = cache_dir+'/kws_keras'
@@ -31,6 +41,17 @@ do_implementation = True
 # input_channel_max_value = 1/(2**16-1)
 input_channel_max_value = 1 # we don't normalize input data
 
+# Train on the raw clips stored by kws_keras with use_tf_data, MFCC is calculated per batch in
+# the loader workers and training batches get random shift, speed, gain and background noise
+augment = False
+augment_noise_dir = au.scDataPath+'/_background_noise_' # noise to mix in, white noise if not found
+use_mfcc_log = False # same as in kws_keras
+
+# Data loading, batches are read in loader_workers processes while the net runs
+loader_workers = 4
+train_batch_size = 128
+eval_batch_size = 1024 # test runs after every quantization step, larger batches are faster
+
 ##################################################
 # Model definition
 #
@@ -172,6 +193,54 @@ class ConvNet(nn.Module):
 
 
 
+class MmapDataset(torch.utils.data.Dataset):
+  """
+    Dataset reading samples from (memory mapped) arrays, the data is never copied as a whole.
+    Indexed with a list of indices it returns a whole batch with one sorted read, see makeLoader
+  """
+  def __init__(self, x, y):
+    self.x = x
+    self.y = y
+  def __len__(self):
+    return len(self.x)
+  def __getitem__(self, i):
+    if np.isscalar(i):
+      return torch.from_numpy(np.ascontiguousarray(self.x[i], dtype='float32')), int(self.y[i])
+    idx = np.sort(i)
+    return torch.from_numpy(np.ascontiguousarray(self.x[idx], dtype='float32')), torch.from_numpy(self.y[idx])
+
+def makeLoader(dataset, batch_size, shuffle=False, collate_fn=None, workers=None):
+  """
+    DataLoader fetching whole batches from an MmapDataset in worker processes, into pinned
+    memory if there is a GPU. Workers are kept alive over epochs and test runs if the torch
+    version supports it (1.7 and later)
+  """
+  workers = loader_workers if workers is None else workers
+  sampler = torch.utils.data.RandomSampler(dataset) if shuffle else torch.utils.data.SequentialSampler(dataset)
+  kwargs = {}
+  if 'persistent_workers' in inspect.signature(torch.utils.data.DataLoader.__init__).parameters:
+    kwargs['persistent_workers'] = workers > 0
+  return torch.utils.data.DataLoader(dataset, batch_size=None,
+    sampler=torch.utils.data.BatchSampler(sampler, batch_size, drop_last=False),
+    collate_fn=collate_fn, num_workers=workers, pin_memory=torch.cuda.is_available(), **kwargs)
+
+class ClipCollate:
+  """
+    collate_fn for makeLoader over an MmapDataset of raw clips, augments the batch and
+    calculates the MCU like MFCC as net input [n, 1, frames, mfcc]. Runs in the loader workers
+  """
+  def __init__(self, augmenter=None):
+    self.augmenter = augmenter
+  def __call__(self, batch):
+    x, y = batch[0].numpy(), batch[1]
+    if self.augmenter is not None:
+      x = self.augmenter(x)
+    o_mfcc = mfu.mfcc_mcu_batch(x, fs, nSamples, frame_length, frame_step, frame_count, fft_len, 
+      num_mel_bins, lower_edge_hertz, upper_edge_hertz, mel_mtx_scale, use_log=use_mfcc_log,
+      first_mfcc=first_mfcc, num_mfcc=num_mfcc)
+    o_mfcc = np.clip(o_mfcc * net_input_scale, net_input_clip_min, net_input_clip_max)
+    return torch.from_numpy(o_mfcc[:, np.newaxis].astype('float32')), y
+
 # convenience class to keep track of averages
 class Metric(object):
   def __init__(self, name):
@@ -195,7 +264,7 @@ def train(model, device, train_loader, optimizer, criterion, max_epochs, verbose
         desc='Train Epoch  #%d/%d' % (epoch+1, max_epochs),
         disable=not verbose) as t:
       for batch_idx, (data, target) in enumerate(train_loader):
-        data, target = data.to(device), target.to(device)
+        data, target = data.to(device, non_blocking=True), target.to(device, non_blocking=True)
         optimizer.zero_grad()
         output = model(data)
         # print('output', output)
@@ -233,7 +302,7 @@ def test(model, device, test_loader, integer=False, verbose=True):
       for data, target in test_loader:
         if integer:      # <== this will be useful when we get to the 
           data *= input_channel_max_value  #     IntegerDeployable stage
-        data, target = data.to(device), target.to(device)
+        data, target = data.to(device, non_blocking=True), target.to(device, non_blocking=True)
         output = model(data)
         test_loss += F.nll_loss(output, target, reduction='sum').item() # sum up batch loss
         pred = output.argmax(dim=1, keepdim=True) # get the index of the max log-probability
@@ -776,6 +845,250 @@ def implement(model, dummy_input):
   #   print(name, param.size())
   #   model.
 
+def loadData(workers=None, verbose=True):
+  """
+    Loaders of the data stored by kws_keras, MFCCs or raw clips if augment is set
+
+    returns train_loader, test_loader, val_loader, in_shape (CHW), num_classes
+  """
+  if augment:
+    # raw clips [n, samples], all sets from the same split
+    x_train   = np.load(in_data_dir+'/x_train_raw.npy', mmap_mode='r')
+    x_test    = np.load(in_data_dir+'/x_test_raw.npy', mmap_mode='r')
+    x_val     = np.load(in_data_dir+'/x_val_raw.npy', mmap_mode='r')
+    y_train   = np.load(in_data_dir+'/y_train_raw.npy').argmax(axis=1).astype(int)
+    y_test    = np.load(in_data_dir+'/y_test_raw.npy').argmax(axis=1).astype(int)
+    y_val     = np.load(in_data_dir+'/y_val_raw.npy').argmax(axis=1).astype(int)
+  else:
+    # Convert data from NHWC to NCHW, x is memory mapped and transposed as view
+    x_train   = np.transpose(np.load(in_data_dir+'/x_train.npy', mmap_mode='r'), [0, 3, 1, 2])
+    x_test    = np.transpose(np.load(in_data_dir+'/x_test.npy', mmap_mode='r'), [0, 3, 1, 2])
+    x_val     = np.transpose(np.load(in_data_dir+'/x_val.npy', mmap_mode='r'), [0, 3, 1, 2])
+    # y is one-hot in files, we need it flat
+    y_train   = np.load(in_data_dir+'/y_train.npy').argmax(axis=1).astype(int)
+    y_test    = np.load(in_data_dir+'/y_test.npy').argmax(axis=1).astype(int)
+    y_val     = np.load(in_data_dir+'/y_val.npy').argmax(axis=1).astype(int)
+
+  if verbose:
+    print('x_train.shape    ', x_train.shape)
+    # print('x_test.shape     ', x_test.shape)
+    # print('x_val.shape      ', x_val.shape)
+    print('y_train.shape    ', y_train.shape)
+    # print('y_test.shape     ', y_test.shape)
+    # print('y_val.shape      ', y_val.shape)
+
+  # create data loaders, samples are read from the memory map when a batch is assembled
+  trainset = MmapDataset(x_train,y_train)
+  testset = MmapDataset(x_test,y_test)
+  valset = MmapDataset(x_val,y_val)
+
+  if dummy_tests:
+    testset = torch.utils.data.Subset(testset, [0])
+
+  if augment:
+    # new augmentation every batch, MFCC of all sets calculated in the workers
+    augmenter = aug.Augmenter(noise=aug.load_noise(augment_noise_dir, fs=fs))
+    train_loader = makeLoader(trainset, train_batch_size, shuffle=True, collate_fn=ClipCollate(augmenter), workers=workers)
+    test_loader = makeLoader(testset, eval_batch_size, collate_fn=ClipCollate(), workers=workers)
+    val_loader = makeLoader(valset, eval_batch_size, collate_fn=ClipCollate(), workers=workers)
+  else:
+    train_loader = makeLoader(trainset, train_batch_size, shuffle=True, workers=workers)
+    test_loader = makeLoader(testset, eval_batch_size, workers=workers)
+    val_loader = makeLoader(valset, eval_batch_size, workers=workers)
+
+  # net input shape, CHW
+  in_shape = tuple(next(iter(test_loader))[0].shape[1:]) if augment else x_train.shape[1:]
+
+  num_classes = y_train.max()+1
+  return train_loader, test_loader, val_loader, in_shape, num_classes
+
+######################################################################
+# quantization sweep
+######################################################################
+
+# Quantized layers as (weights, activation) in network order, fc1 has no activation
+quant_layers = [('conv1', 'relu1'), ('conv2', 'relu2'), ('conv3', 'relu3'), ('conv4', 'relu4'), ('fc1', None)]
+
+# Grid of the sweep: activation bits per layer, the weights get one bit less as in main.
+# Calibration 'none', 'calibrate' or 'equalize' (calibrate, fold, equalize and calibrate again)
+# with the number of validation batches for the activation statistics, None for all.
+# The deployable model is built from the unfolded state as in main, so 'equalize' only has
+# a FakeQuantized accuracy and is not part of the Pareto fronts
+sweep_bits = [8, 16]
+sweep_calibration = ['none', 'calibrate', 'equalize']
+sweep_calib_batches = [1, None]
+sweep_workers = None # processes, None for all cores
+
+# Rough CMSIS-NN cost per MAC of the q7 kernels (up to 8 bit) and the q15 kernels on a
+# Cortex-M4, fit to the inference stage of mcu.telemetry for better estimates
+cycles_per_mac = {8: 1.0, 16: 1.5}
+
+def precisionDict(bits):
+  """
+    min_prec_dict for change_precision from the activation bits of each quant_layers entry
+  """
+  precision = {}
+  for (w, x), b in zip(quant_layers, bits):
+    precision[w] = {'W_bits' : b-1}
+    if x is not None:
+      precision[x] = {'x_bits' : b}
+  return precision
+
+def layerCost(model, in_shape):
+  """
+    Weights, biases and MACs of one inference of each weight layer of quant_layers
+    returns dict layer name -> (weights, biases, macs)
+  """
+  cost = {}
+  def hook(name):
+    def fun(module, inp, out):
+      n_w = module.weight.numel()
+      n_b = module.bias.numel() if module.bias is not None else 0
+      # each output value of a conv takes weights/out_channels MACs
+      macs = out[0].numel()*n_w//module.out_channels if isinstance(module, nn.Conv2d) else n_w
+      cost[name] = (n_w, n_b, macs)
+    return fun
+  hooks = [getattr(model, w).register_forward_hook(hook(w)) for w, _ in quant_layers]
+  model.eval()
+  with torch.no_grad():
+    model(torch.zeros((1,)+tuple(in_shape), device=next(model.parameters()).device))
+  for h in hooks:
+    h.remove()
+  return cost
+
+def modelCost(cost, bits):
+  """
+    Flash size in bytes, weights and biases in 8 or 16 bit, and estimated cycles of one inference
+  """
+  size, cycles = 0, 0
+  for (w, _), b in zip(quant_layers, bits):
+    n_w, n_b, macs = cost[w]
+    kernel = 8 if b <= 8 else 16
+    size += (n_w+n_b)*kernel//8
+    cycles += macs*cycles_per_mac[kernel]
+  return size, int(cycles)
+
+def calibrate(model, device, loader, n_batches=None):
+  """
+    Activation statistics on the first n_batches of loader, None for all, then reset alphas
+  """
+  model.set_statistics_act()
+  model.eval()
+  with torch.no_grad():
+    for i, (data, _) in enumerate(loader):
+      if n_batches is not None and i >= n_batches:
+        break
+      model(data.to(device))
+  model.unset_statistics_act()
+  model.reset_alpha_act()
+
+def paretoFront(cost, acc):
+  """
+    Mask of the configurations that no other one beats with lower cost and higher accuracy
+  """
+  cost = np.asarray(cost)
+  acc = np.nan_to_num(np.asarray(acc, dtype=float), nan=-np.inf)
+  front = np.zeros(len(cost), dtype=bool)
+  for i in range(len(cost)):
+    better = (cost <= cost[i]) & (acc >= acc[i]) & ((cost < cost[i]) | (acc > acc[i]))
+    front[i] = np.isfinite(acc[i]) and not better.any()
+  return front
+
+# per worker process, data loaders and the full precision weights
+_sweep_ctx = {}
+
+def _sweep_init(state_dict, n_threads):
+  torch.set_num_threads(n_threads)
+  _, test_loader, val_loader, in_shape, num_classes = loadData(workers=0, verbose=False)
+  _sweep_ctx['device'] = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+  _sweep_ctx['loaders'] = (test_loader, val_loader)
+  _sweep_ctx['in_shape'] = in_shape
+  _sweep_ctx['num_classes'] = num_classes
+  _sweep_ctx['state_dict'] = state_dict
+
+def _sweep_run(bits, calibration, calib_batches):
+  # same steps as main, returns FakeQuantized (folded) and IntegerDeployable accuracy,
+  # the latter is nan for 'equalize' whose deployable would be the one of 'calibrate'
+  device = _sweep_ctx['device']
+  test_loader, val_loader = _sweep_ctx['loaders']
+  model = ConvNet(_sweep_ctx['num_classes']).to(device)
+  model.load_state_dict(_sweep_ctx['state_dict'])
+
+  model = nemo.transform.quantize_pact(model, dummy_input=torch.randn((1,)+_sweep_ctx['in_shape']).to(device))
+  model.change_precision(bits=8, min_prec_dict=precisionDict(bits))
+  if calibration != 'none':
+    calibrate(model, device, val_loader, calib_batches)
+  fq_state = copy.deepcopy(model.state_dict())
+
+  model.fold_bn()
+  model.reset_alpha_weights()
+  if calibration == 'equalize':
+    model.equalize_weights_dfq({'conv1':'conv2'})
+    calibrate(model, device, val_loader, calib_batches)
+  acc_fq = test(model, device, test_loader, verbose=False)
+  if calibration == 'equalize':
+    return acc_fq, np.nan
+
+  # deployable from the unfolded state, as main does with the kws_fq_mixed checkpoint
+  model.load_state_dict(fq_state, strict=True)
+  model = nemo.transform.bn_quantizer(model)
+  model.harden_weights()
+  model.set_deployment(eps_in=1./input_channel_max_value)
+  model = nemo.transform.integerize_pact(model, eps_in=1.0/input_channel_max_value)
+  acc_id = test(model, device, test_loader, integer=True, verbose=False)
+  return acc_fq, acc_id
+
+def sweep(n_workers=None):
+  """
+    Quantize the trained model with every combination of sweep_bits per layer and calibration
+    setting in n_workers processes, None for all cores. Prints the Pareto fronts of deployable
+    accuracy against model size and against estimated MCU cycles, all results go to
+    cache_dir/sweep.csv
+  """
+  state_dict = torch.load(model_path, map_location='cpu')
+  _, _, _, in_shape, num_classes = loadData(workers=0, verbose=False)
+  cost = layerCost(ConvNet(num_classes), in_shape)
+
+  configs = [(bits, cal, nb) for bits in itertools.product(sweep_bits, repeat=len(quant_layers))
+    for cal in sweep_calibration for nb in ([None] if cal == 'none' else sweep_calib_batches)]
+  n_workers = min(os.cpu_count() if n_workers is None else n_workers, len(configs))
+  print('Sweeping %d configurations in %d processes' % (len(configs), n_workers))
+
+  # spawn, forked processes can not use CUDA
+  results = []
+  with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+      initializer=_sweep_init, initargs=(state_dict, max(1, os.cpu_count()//n_workers))) as ex:
+    futs = {ex.submit(_sweep_run, *c): c for c in configs}
+    for fut in tqdm(concurrent.futures.as_completed(futs), total=len(futs)):
+      bits, cal, nb = futs[fut]
+      try:
+        acc_fq, acc_id = fut.result()
+      except Exception as e:
+        print('%s %s failed: %s' % (bits, cal, e))
+        acc_fq, acc_id = np.nan, np.nan
+      results.append((bits, cal, nb, acc_fq, acc_id) + modelCost(cost, bits))
+  results.sort(key=lambda r: configs.index(r[:3]))
+
+  acc = [r[4] for r in results]
+  front_size = paretoFront([r[5] for r in results], acc)
+  front_cycles = paretoFront([r[6] for r in results], acc)
+
+  fmt = '%-20s %-10s %5s %7s %7s %9s %10s'
+  for name, col, front in [('model size', 5, front_size), ('MCU cycles', 6, front_cycles)]:
+    print('\nPareto front of IntegerDeployable accuracy vs %s' % (name))
+    print(fmt % ('bits '+'/'.join(w for w, _ in quant_layers), 'calib', 'batch', 'FQ acc', 'ID acc', 'size', 'cycles'))
+    for r in sorted([r for r, f in zip(results, front) if f], key=lambda r: r[col]):
+      print('%-20s %-10s %5s %6.2f%% %6.2f%% %8.1fk %10d' % ('/'.join(str(b) for b in r[0]), r[1],
+        'all' if r[2] is None else r[2], r[3], r[4], r[5]/1024.0, r[6]))
+
+  pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+  with open(cache_dir+'/sweep.csv','w') as fd:
+    fd.write('bits,calibration,calib_batches,acc_fq,acc_id,size,cycles,pareto_size,pareto_cycles\n')
+    for r, ps, pc in zip(results, front_size, front_cycles):
+      fd.write('%s,%s,%s,%.2f,%.2f,%d,%d,%d,%d\n' % ('/'.join(str(b) for b in r[0]), r[1],
+        'all' if r[2] is None else r[2], r[3], r[4], r[5], r[6], ps, pc))
+  print('Wrote all results to', cache_dir+'/sweep.csv')
+
 ######################################################################
 # main
 ######################################################################
@@ -788,7 +1101,13 @@ def main(argv=None):
       print('    Modes:')
       print('    train                     Train model')
       print('    impl                      Implement')
+      print('    sweep [workers]           Quantize the trained model with a grid of bit widths')
+      print('                              and calibrations, print accuracy vs size/cycles Pareto fronts')
       exit()
+
+    if argv[1] == 'sweep':
+      sweep(int(argv[2]) if len(argv) > 2 else sweep_workers)
+      return
       
     if argv[1] == 'train':
       do_train = True
@@ -799,50 +1118,11 @@ def main(argv=None):
 
   # Data loaders
   device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-  kwargs = {'num_workers': 1, 'pin_memory': True} if torch.cuda.is_available() else {}
-
-  # Convert data from NHWC to NCHW
-  x_train   = np.transpose(np.load(in_data_dir+'/x_train.npy'), [0, 3, 1, 2])
-  x_test    = np.transpose(np.load(in_data_dir+'/x_test.npy'), [0, 3, 1, 2])
-  x_val     = np.transpose(np.load(in_data_dir+'/x_val.npy'), [0, 3, 1, 2])
-  # y is one-hot in files, we need it flat
-  y_train   = np.load(in_data_dir+'/y_train.npy').argmax(axis=1).astype(int)
-  y_test    = np.load(in_data_dir+'/y_test.npy').argmax(axis=1).astype(int)
-  y_val     = np.load(in_data_dir+'/y_val.npy').argmax(axis=1).astype(int)
-  keywords  = np.load(in_data_dir+'/keywords.npy')
-
-  print('x_train.shape    ', x_train.shape)
-  # print('x_test.shape     ', x_test.shape)
-  # print('x_val.shape      ', x_val.shape)
-  print('y_train.shape    ', y_train.shape)
-  # print('y_test.shape     ', y_test.shape)
-  # print('y_val.shape      ', y_val.shape)
-
-  # convert to torch tensors
-  x_train_t   = torch.Tensor(x_train)
-  x_test_t    = torch.Tensor(x_test)
-  x_val_t     = torch.Tensor(x_val)
-  y_train_t   = torch.Tensor(y_train).long()
-  y_test_t    = torch.Tensor(y_test).long()
-  y_val_t     = torch.Tensor(y_val).long()
 
-  if dummy_tests:
-    x_test_t = x_test_t[0:1]
-    y_test_t = y_test_t[0:1]
-  # print(y_train_t)
-
-  # create data loaders
-  trainset = torch.utils.data.TensorDataset(x_train_t,y_train_t)
-  testset = torch.utils.data.TensorDataset(x_test_t,y_test_t)
-  valset = torch.utils.data.TensorDataset(x_val_t,y_val_t)
-
-  train_loader = torch.utils.data.DataLoader(trainset, batch_size=128, shuffle=True)
-  test_loader = torch.utils.data.DataLoader(testset, batch_size=128, shuffle=True)
-  val_loader = torch.utils.data.DataLoader(valset, batch_size=128, shuffle=True)
+  train_loader, test_loader, val_loader, in_shape, num_classes = loadData()
 
   # train at FullPrecision stage
-  num_classes = y_train.max()+1
-  inp_shape = x_train.shape[1:]
+  inp_shape = in_shape
   print('num_classes:',num_classes)
   model = ConvNet(num_classes).to(device)
 
@@ -873,7 +1153,7 @@ def main(argv=None):
   # original net
   #
   batch_size = 1
-  inp_shape = x_train.shape[1:]
+  inp_shape = in_shape
   perm = lambda x : x
   model.eval()
   dummy_input = perm(torch.randn(batch_size, *inp_shape, device='cuda' if torch.cuda.is_available() else 'cpu'))
@@ -884,7 +1164,7 @@ def main(argv=None):
   ##########################################
   # FakeQuantized network
 
-  model = nemo.transform.quantize_pact(model, dummy_input=torch.randn((1,)+x_train.shape[1:]).to(device))
+  model = nemo.transform.quantize_pact(model, dummy_input=torch.randn((1,)+in_shape).to(device))
   precision = {
     'conv1': {
         'W_bits' : 15
@@ -990,7 +1270,7 @@ def main(argv=None):
   print("\nQuantizedDeployable @ mixed-precision accuracy: %.02f%%" % acc)
 
   # export net in ONNX
-  inp_shape = x_train.shape[1:]
+  inp_shape = in_shape
   nemo.utils.export_onnx(cache_dir+'/kws_qd_mixed.onnx', 
     model, model, inp_shape, round_params=False) # round_params is active by default because NEMO mainly exports integerized networks!
   print('Written model file', cache_dir+'/kws_qd_mixed.onnx')
@@ -1008,7 +1288,7 @@ def main(argv=None):
   if do_implementation:
     # run implementation
     perm = lambda x : x
-    input_shape = inp_shape = x_train.shape[1:]
+    input_shape = inp_shape = in_shape
     dummy_input = perm(torch.randn(1, *input_shape, device='cuda' if torch.cuda.is_available() else 'cpu'))
     # Create same input as in c
     print(dummy_input)
@@ -14,6 +14,8 @@ from keras.layers import *
 from keras.callbacks import ModelCheckpoint
 from nnom_utils import *
 
+import edison.train.mmap_data as mmd
+
 try:
   tf.config.experimental.set_memory_growth(tf.config.experimental.list_physical_devices('GPU')[0], True)
 except:
@@ -48,7 +50,7 @@ def label_to_category(label, selected):
       category.append(len(selected)) # all others
   return np.array(category)
 
-def train(x_train, y_train, x_test, y_test, type, batch_size=64, epochs=100):
+def train(x_train, y_train, x_test, y_test, type, batch_size=64, epochs=100, transform=None):
 
   # first_filter_width = 8
   # first_filter_height = 8
@@ -133,12 +135,12 @@ def train(x_train, y_train, x_test, y_test, type, batch_size=64, epochs=100):
       period=1)
   callback_lists = [checkpoint]
 
-  history =  model.fit(x_train, y_train,
-        batch_size=batch_size,
+  # x_train can be a memory map, batches are read and transformed on the fly
+  history =  model.fit(mmd.kerasSequence(x_train, y_train, batch_size=batch_size, transform=transform),
         epochs=epochs,
         verbose=1,
         validation_data=(x_test, y_test),
-        shuffle=True, callbacks=callback_lists)
+        callbacks=callback_lists)
 
   model.save(model_path)
   print('Stored model at', model_path)
@@ -147,12 +149,12 @@ def train(x_train, y_train, x_test, y_test, type, batch_size=64, epochs=100):
 
   return history
 
-def predictWithConfMatrix(model, x,y):
+def predictWithConfMatrix(model, x,y, transform=None):
   """
     Predict with model and print confusion matrix
   """
   from sklearn.metrics import confusion_matrix
-  y_pred = model.predict(x)
+  y_pred = model.predict(mmd.kerasSequence(x, y, batch_size=256, shuffle=False, transform=transform))
   y_pred = 1.0*(y_pred > 0.5) 
 
   print('Confusion matrix:')
@@ -176,13 +178,8 @@ def main(argv):
     exit()
     
   try:
-    x_train = np.load(in_dir+'/x_train.npy')
-    x_test = np.load(in_dir+'/x_test.npy')
-    x_val = np.load(in_dir+'/x_val.npy')
-    y_train = np.load(in_dir+'/y_train.npy')
-    y_test = np.load(in_dir+'/y_test.npy')
-    y_val = np.load(in_dir+'/y_val.npy')
-    keywords = np.load(in_dir+'/keywords.npy')
+    # x is memory mapped, training reads it batch by batch
+    x_train, x_test, x_val, y_train, y_test, y_val, keywords = mmd.load_cached(in_dir, mmap_mode='r')
     print('Load data from cache success!')
 
     # x_train = np.load('train_data.npy')
@@ -232,12 +229,11 @@ def main(argv):
   print('x_train.min()', x_train.min())
   print("scale by", quantise_factor, 'clip to', nnom_net_input_clip_min, nnom_net_input_clip_max)
 
-  x_train = np.clip( (x_train * quantise_factor), nnom_net_input_clip_min, nnom_net_input_clip_max)
-  x_test = np.clip( (x_test * quantise_factor), nnom_net_input_clip_min, nnom_net_input_clip_max)
-  x_val = np.clip( (x_val * quantise_factor), nnom_net_input_clip_min, nnom_net_input_clip_max)
-
-  print('x_train.max()', x_train.max())
-  print('x_train.min()', x_train.min())
+  def quantise(x):
+    return np.clip( (x * quantise_factor), nnom_net_input_clip_min, nnom_net_input_clip_max)
+  # x_train stays on disk and is quantised per batch, test and validation sets are small
+  x_test = quantise(x_test)
+  x_val = quantise(x_val)
 
   # training data enforcement
   # x_train = np.vstack((x_train, x_train*0.8))
@@ -254,14 +250,14 @@ def main(argv):
   # x_test = (x_test * 128).round()/128
   # x_val = (x_val * 128).round()/128
 
-  print('quantised', 'x_train shape:', x_train.shape, 'max', x_train.max(), 'min', x_train.min())
+  print('quantised', 'x_test shape:', x_test.shape, 'max', x_test.max(), 'min', x_test.min())
   # print("dataset abs mean at", abs(x_test).mean()*128)
 
   # test, if you want to see a few random MFCC imagea. 
   if(0):
     which = 232
     while True:
-      mfcc_plot(x_train[which].reshape((31, 13))*128, keywords[y_train[which].argmax()])
+      mfcc_plot(quantise(x_train[which]).reshape((31, 13))*128, keywords[y_train[which].argmax()])
       which += 352
 
   # word label to number label
@@ -285,14 +281,15 @@ def main(argv):
   if argv[1] == 'train':
     # generate test data for MCU
     generate_test_bin(x_test, y_test, cache_dir+'/test_data.bin')
-    generate_test_bin(x_train, y_train, cache_dir+'/train_data.bin')
+    generate_test_bin(quantise(x_train), y_train, cache_dir+'/train_data.bin')
 
     # do the job
     print('num_type', num_type)
     print('len', len(keywords))
     print(keywords)
     print('y_train.shape',y_train.shape)
-    history = train(x_train, y_train, x_val, y_val, type=num_type, batch_size=batch_size, epochs=epochs)
+    history = train(x_train, y_train, x_val, y_val, type=num_type, batch_size=batch_size, epochs=epochs,
+      transform=quantise)
 
     print(history)
     print(history.history)
@@ -326,7 +323,7 @@ def main(argv):
 
   if argv[1] == 'test':
     print('Performance on train data')
-    predictWithConfMatrix(model, x_train,y_train)
+    predictWithConfMatrix(model, x_train,y_train, transform=quantise)
     print('Performance on test data')
     predictWithConfMatrix(model, x_test,y_test)
     print('Performance on val data')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from config import *
+
+def load_cached(data_dir, mmap_mode='r'):
+  """
+    Load data set as stored by kws_keras.load_data. With mmap_mode='r' the x arrays are
+    memory maps and only the slices that are accessed are read from disk.
+
+    returns x_train, x_test, x_val, y_train, y_test, y_val, keywords
+  """
+  x_train   = np.load(data_dir+'/x_train.npy', mmap_mode=mmap_mode)
+  x_test    = np.load(data_dir+'/x_test.npy', mmap_mode=mmap_mode)
+  x_val     = np.load(data_dir+'/x_val.npy', mmap_mode=mmap_mode)
+  y_train   = np.load(data_dir+'/y_train.npy')
+  y_test    = np.load(data_dir+'/y_test.npy')
+  y_val     = np.load(data_dir+'/y_val.npy')
+  keywords  = np.load(data_dir+'/keywords.npy')
+  return x_train, x_test, x_val, y_train, y_test, y_val, keywords
+
+class BatchReader:
+  """
+    Batches of (x, y) read from (memory mapped) arrays, only one batch is in memory at a time.
+    Indices within a batch are sorted so the memory map is read front to back.
+    Same interface as keras.utils.Sequence, see kerasSequence.
+
+      x, y        data and labels, x can be a memory map
+      batch_size  samples per batch
+      shuffle     reshuffle samples after each epoch
+      transform   function applied to each x batch, e.g. scaling and clipping
+  """
+  def __init__(self, x, y, batch_size=32, shuffle=True, transform=None):
+    assert len(x) == len(y), 'x and y must have same length'
+    self.x = x
+    self.y = y
+    self.batch_size = batch_size
+    self.shuffle = shuffle
+    self.transform = transform
+    self.order = np.arange(len(x))
+    self.on_epoch_end()
+
+  def __len__(self):
+    return (len(self.x) + self.batch_size - 1) // self.batch_size
+
+  def __getitem__(self, i):
+    if i < 0 or i >= len(self):
+      raise IndexError('batch index out of range')
+    idx = np.sort(self.order[i*self.batch_size:(i+1)*self.batch_size])
+    x = np.asarray(self.x[idx], dtype='float32')
+    if self.transform is not None:
+      x = self.transform(x)
+    return x, np.asarray(self.y[idx])
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def on_epoch_end(self):
+    if self.shuffle:
+      np.random.shuffle(self.order)
+
+def kerasSequence(x, y, batch_size=32, shuffle=True, transform=None):
+  """
+    BatchReader as keras.utils.Sequence, can be passed to model.fit/evaluate/predict
+  """
+  import keras
+
+  class MmapSequence(BatchReader, keras.utils.Sequence):
+    def __init__(self, *args, **kwargs):
+      keras.utils.Sequence.__init__(self)
+      BatchReader.__init__(self, *args, **kwargs)
+
+  return MmapSequence(x, y, batch_size=batch_size, shuffle=shuffle, transform=transform)
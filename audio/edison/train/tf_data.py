@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+  tf.data input pipeline on raw int16 clips. Features are computed inside the graph in
+  parallel to the training steps instead of in a pass over the whole data set before training.
+
+    x_train, y_train = ... raw clips [n, samples] int16, can be a memory map, and one-hot labels
+    ds = lambda: clipDataset(x_train, y_train, featurize, batch_size=100)
+    model.fit(batchGenerator(ds), steps_per_epoch=(len(x_train)+99)//100, epochs=10)
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+
+def save_clips(data_dir, x_train, x_test, x_val, y_train, y_test, y_val, keywords):
+  """
+    Store raw clips and labels for clipDataset, counterpart of load_clips
+  """
+  np.save(data_dir+'/x_train_raw.npy', x_train)
+  np.save(data_dir+'/x_test_raw.npy', x_test)
+  np.save(data_dir+'/x_val_raw.npy', x_val)
+  np.save(data_dir+'/y_train_raw.npy', y_train)
+  np.save(data_dir+'/y_test_raw.npy', y_test)
+  np.save(data_dir+'/y_val_raw.npy', y_val)
+  np.save(data_dir+'/keywords.npy', keywords)
+
+def load_clips(data_dir, mmap_mode='r'):
+  """
+    Load raw clips as stored by save_clips, the clips are memory maps with mmap_mode='r'
+
+    returns x_train, x_test, x_val, y_train, y_test, y_val, keywords
+  """
+  x_train   = np.load(data_dir+'/x_train_raw.npy', mmap_mode=mmap_mode)
+  x_test    = np.load(data_dir+'/x_test_raw.npy', mmap_mode=mmap_mode)
+  x_val     = np.load(data_dir+'/x_val_raw.npy', mmap_mode=mmap_mode)
+  y_train   = np.load(data_dir+'/y_train_raw.npy')
+  y_test    = np.load(data_dir+'/y_test_raw.npy')
+  y_val     = np.load(data_dir+'/y_val_raw.npy')
+  keywords  = np.load(data_dir+'/keywords.npy')
+  return x_train, x_test, x_val, y_train, y_test, y_val, keywords
+
+def batchGenerator(build):
+  """
+    Endless generator of numpy batches for keras fit and predict, which take generators
+    but no datasets. build is called without arguments and returns the dataset, it is
+    built in its own graph and session and repeated, so the generator can run on the
+    keras data thread. Pass steps_per_epoch, validation_steps or steps to keras.
+  """
+  graph = tf.Graph()
+  with graph.as_default():
+    next_batch = tf.compat.v1.data.make_one_shot_iterator(build().repeat()).get_next()
+  with tf.compat.v1.Session(graph=graph) as sess:
+    while True:
+      yield sess.run(next_batch)
+
+def clipDataset(x, y, featurize, batch_size=32, shuffle=True, cache='', read_size=256, augment=None,
+    shuffle_buffer=4096):
+  """
+    Dataset of (features, label) batches from raw clips.
+
+    Clips are read from x in contiguous chunks of read_size, which is cheap on a memory map,
+    and featurize runs on each chunk with parallel calls. The features are cached after the
+    first epoch, shuffled and batched, and the next batches are prefetched while the model
+    trains on the current one.
+
+    Shuffling is bounded, the chunk order is shuffled and then the samples within a buffer
+    of shuffle_buffer, so memory does not grow with the data set size.
+
+      x, y        raw clips [n, samples] and labels, x can be a memory map
+      featurize   function of a tensor of clips [chunk, samples] int16 returning the net
+                  input [chunk, ...] as float32, e.g. built on mfcc_utils.mfcc_mcu_graph
+      batch_size  samples per batch
+      shuffle     reshuffle samples every epoch
+      cache       file name to cache the features on disk, '' to keep them in memory,
+                  None to compute them every epoch
+      read_size   clips read and featurized at once
+      augment     function of a numpy array of clips returning new int16 clips, e.g. an
+                  augment.Augmenter, runs on each chunk every epoch so the features are not cached
+      shuffle_buffer  samples in the shuffle buffer
+  """
+  assert len(x) == len(y), 'x and y must have same length'
+  n, n_samples = x.shape
+  if augment is not None:
+    cache = None
+  autotune = tf.data.experimental.AUTOTUNE
+
+  def read(start):
+    stop = min(start+read_size, n)
+    xc = np.asarray(x[start:stop], dtype='int16')
+    if augment is not None:
+      xc = augment(xc)
+    return xc, np.asarray(y[start:stop], dtype='float32')
+
+  def tfRead(start):
+    xc, yc = tf.numpy_function(read, [start], (tf.int16, tf.float32))
+    xc.set_shape((None, n_samples))
+    yc.set_shape((None,)+y.shape[1:])
+    return xc, yc
+
+  ds = tf.data.Dataset.range(0, n, read_size)
+  if shuffle and cache is None:
+    # chunk start indices are cheap to shuffle before reading
+    ds = ds.shuffle((n+read_size-1)//read_size, reshuffle_each_iteration=True)
+  ds = ds.map(tfRead, num_parallel_calls=autotune)
+  ds = ds.map(lambda xc, yc: (featurize(xc), yc), num_parallel_calls=autotune)
+  if cache is not None:
+    # cache whole chunks, the cached order is fixed so shuffle the chunks after it
+    ds = ds.cache(cache)
+    if shuffle:
+      ds = ds.shuffle(max(1, shuffle_buffer//read_size), reshuffle_each_iteration=True)
+  ds = ds.apply(tf.data.experimental.unbatch())
+  if shuffle:
+    ds = ds.shuffle(min(n, shuffle_buffer), reshuffle_each_iteration=True)
+  return ds.batch(batch_size).prefetch(autotune)
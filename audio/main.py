@@ -65,6 +65,8 @@ Commands
 
 Commands
     hif_test    Test host interface
+    sim         Simulated MCU on a pty, see mcu_sim.py -h
+    farm        List the responding boards of the device farm
 ''')
     parser.add_argument('command', help='Command to run')
     args = parser.parse_args(sys.argv[2:3])
@@ -105,19 +107,19 @@ Commands
 
 Commands
     acq    Acquire samples for training
+    pack   Pack wav files into one memory mappable corpus
 ''')
     parser.add_argument('command', help='Command to run')
     args = parser.parse_args(sys.argv[2:3])
     
     if args.command == 'acq':
       self.acquire_acq()
+    elif args.command == 'pack':
+      self.acquire_pack()
     else:
       print ('Unrecognized command')
       parser.print_help()
       exit(1)
-    
-    # use dispatch pattern to invoke method with same name
-    getattr(self, args.command)()
 
   def train(self):
     parser = argparse.ArgumentParser(
@@ -196,6 +198,14 @@ Commands
     import edison.mcu.hif_test
     edison.mcu.hif_test.main()
 
+  def sim(self):
+    import edison.mcu.mcu_sim
+    edison.mcu.mcu_sim.main(sys.argv[3:])
+
+  def farm(self):
+    import edison.mcu.mcu_farm
+    edison.mcu.mcu_farm.main(sys.argv[3:])
+
   def mfcc_host(self):
     import edison.mfcc.mfcc
 
@@ -206,6 +216,10 @@ Commands
   def acquire_acq(self):
     import edison.acquire.sample_acq
 
+  def acquire_pack(self):
+    import edison.acquire.pack
+    edison.acquire.pack.main(sys.argv[2:])
+
   def train_keras(self):
     import edison.train.kws_keras
     edison.train.kws_keras.main(sys.argv[2:])
@@ -48,6 +48,15 @@
     0, 0, 0, 0, \
     AI_HANDLE_PTR(ptr_))
 
+/**
+ * @brief Number of net inputs received and net outputs sent in one transfer in
+ * batched inference, bounded by the size of the input buffer
+ */
+#define AI_BATCH_CHUNK_MAX 32
+#define AI_BATCH_BUF_BYTES (16*1024)
+#define AI_BATCH_CHUNK ( ((AI_BATCH_BUF_BYTES/AI_NET_INSIZE_BYTES) < AI_BATCH_CHUNK_MAX) ? \
+  (AI_BATCH_BUF_BYTES/AI_NET_INSIZE_BYTES) : AI_BATCH_CHUNK_MAX )
+
 // memory required for (intermediate) activations
 #define NET_CUBE_KWS_ACTIVATIONS_SIZE AI_KWS_DATA_ACTIVATIONS_SIZE
 
@@ -182,6 +191,57 @@ void aiRunInferenceHif(void)
   prfStop();
 }
 
+/**
+ * @brief Run inference on a batch of net inputs from the host interface
+ * @details After the chunk size is sent as one byte, 0 if the buffers could not be
+ * allocated, the host sends the net inputs in transfers of up to AI_BATCH_CHUNK inputs
+ * [n, net input] tagged with n. The outputs of each transfer are sent back as one
+ * transfer [n, net output] with tag 0x18. A transfer that fails or does not hold the
+ * expected inputs ends the batch.
+ * 
+ * @param count number of net inputs
+ */
+void aiRunBatchInferenceHif(uint16_t count)
+{
+  uint32_t len, n;
+  uint8_t tag, tmp8;
+
+#if NET_TYPE == NET_TYPE_CUBE
+  float *in_data=NULL, *out_data=NULL;
+#elif NET_TYPE == NET_TYPE_NNOM
+  int8_t *in_data=NULL, *out_data=NULL;
+#endif
+  in_data = malloc(AI_BATCH_CHUNK*AI_NET_INSIZE_BYTES);
+  out_data = malloc(AI_BATCH_CHUNK*AI_NET_OUTSIZE_BYTES);
+
+  tmp8 = (in_data && out_data) ? AI_BATCH_CHUNK : 0;
+  HAL_UART_Transmit(&huart1, &tmp8, 1, HAL_MAX_DELAY);
+
+  for(uint32_t i = 0; tmp8 && (i < count); i += n)
+  {
+    n = ((count - i) > AI_BATCH_CHUNK) ? AI_BATCH_CHUNK : (count - i);
+#if NET_TYPE == NET_TYPE_CUBE
+    len = hiReceive(in_data, n*AI_NET_INSIZE_BYTES, DATA_FORMAT_F32, &tag);
+#elif NET_TYPE == NET_TYPE_NNOM
+    len = hiReceive(in_data, n*AI_NET_INSIZE_BYTES, DATA_FORMAT_S8, &tag);
+#endif
+    if( (len != n*AI_NET_INSIZE) || (tag != n) ) break;
+
+    for(uint32_t j = 0; j < n; j++)
+    {
+      aiRunInference((void*)&in_data[j*AI_NET_INSIZE], (void*)&out_data[j*AI_NET_OUTSIZE]);
+    }
+#if NET_TYPE == NET_TYPE_CUBE
+    hiSendF32(out_data, n*AI_NET_OUTSIZE, 0x18);
+#elif NET_TYPE == NET_TYPE_NNOM
+    hiSendS8(out_data, n*AI_NET_OUTSIZE, 0x18);
+#endif
+  }
+
+  free(in_data);
+  free(out_data);
+}
+
 // /**
 //  * @brief Print human readable info about AI module
 //  * @details 
@@ -229,6 +289,7 @@ int aiRunInference(void* in_data, void* out_data)
   int ret;
 
   uint8_t id = utilTic();
+  uint32_t cycStart = cycStageNow();
 
 #if NET_TYPE == NET_TYPE_CUBE
   ret = cubeNetRun((void*)in_data, (void*)out_data);
@@ -236,6 +297,7 @@ int aiRunInference(void* in_data, void* out_data)
   ret = aiNnomRunInference((void*)in_data, (void*)out_data);
 #endif
   
+  cycStageStop(CYC_STAGE_INFERENCE, cycStart);
   lastInferenceTimeUs = utilToc(id);
   return ret;
 }
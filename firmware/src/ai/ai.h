@@ -74,6 +74,7 @@
 int aiInitialize(void);
 void aiPrintInfo(void);
 void aiRunInferenceHif(void);
+void aiRunBatchInferenceHif(uint16_t count);
 void aiGetInputShape(uint16_t *x, uint16_t *y);
 int aiRunInference(void* in_data, void* out_data);
 const char* aiGetKeywordFromIndex(uint32_t idx);
@@ -40,6 +40,15 @@
 
 #define AMPLITUDE_MOVING_AVG_ALPHA 0.9
 
+/**
+ * @brief Scales net output to [0,1] for binary prediction frames, NNoM outputs are Q7
+ */
+#if NET_TYPE == NET_TYPE_CUBE
+  #define NET_OUT_TO_PROB 1.0
+#elif NET_TYPE == NET_TYPE_NNOM
+  #define NET_OUT_TO_PROB (1.0/128.0)
+#endif
+
 /**
  * @brief Edison state machine settings
  */
@@ -288,7 +297,8 @@ int8_t appHifMicMfccInfere(uint8_t *args)
 int8_t appMicMfccInfereContinuous (uint8_t *args)
 {
   static float netOutFloat[AI_NET_OUTSIZE];
-  uint32_t tmp32, predMaxIdx;
+  static float netOutScaled[AI_NET_OUTSIZE];
+  uint32_t tmp32, predMaxIdx, cycStart;
   // uint32_t netInBufOff = 0;
   bool doAbort = false;
   int ret;
@@ -301,7 +311,7 @@ int8_t appMicMfccInfereContinuous (uint8_t *args)
 
   mainSetPrintfUart(&huart1);
   aiGetInputShape(&in_x, &in_y); // x = 13, y = 62 (nframes)
-  printf("Input shape x,y: (%d,%d)\n", in_x, in_y);
+  if(!hiBinaryReports()) printf("Input shape x,y: (%d,%d)\n", in_x, in_y);
 
   // start continuous mic sampling
   processedFrames = 0;
@@ -330,29 +340,38 @@ int8_t appMicMfccInfereContinuous (uint8_t *args)
 
     // report
     mainSetPrintfUart(&huart1);
-    printf("pred: [ ");
     for(tmp32 = 0; tmp32 < AI_NET_OUTSIZE; tmp32++)
     {
       netOutFloat[tmp32] = (float)(netOutput[tmp32]);
-      printf("%2.2f ", netOutFloat[tmp32]);
     }
-    printf("] ret: %d ampl: %.0f", ret, lastAmplitude);
 
     // moving average filter on net output
     for(int i = 0; i < AI_NET_OUTSIZE; i++) netOutFilt[i] = (NET_OUT_MOVING_AVG_ALPHA*netOutFilt[i] + (1.0-NET_OUT_MOVING_AVG_ALPHA)*netOutFloat[i]);
 
     arm_max_f32(netOutFilt, AI_NET_OUTSIZE, &predMax, &predMaxIdx);
-    printf(" likely: %s", aiGetKeywordFromIndex(predMaxIdx));
+    if(hiBinaryReports())
+    {
+      // compact frame, net output scaled to [0,1]
+      for(tmp32 = 0; tmp32 < AI_NET_OUTSIZE; tmp32++) netOutScaled[tmp32] = NET_OUT_TO_PROB*netOutFloat[tmp32];
+      hiSendPrediction(netOutScaled, AI_NET_OUTSIZE, ret, lastAmplitude, predMaxIdx, (predMax > TRUE_THRESHOLD) ? predMaxIdx : 0xff);
+    }
+    else
+    {
+      printf("pred: [ ");
+      for(tmp32 = 0; tmp32 < AI_NET_OUTSIZE; tmp32++) printf("%2.2f ", netOutFloat[tmp32]);
+      printf("] ret: %d ampl: %.0f", ret, lastAmplitude);
+      printf(" likely: %s", aiGetKeywordFromIndex(predMaxIdx));
+      if( (predMax > TRUE_THRESHOLD) ) printf(" spotted %s", aiGetKeywordFromIndex(predMaxIdx));
+      printf("\n");
+    }
     if( (predMax > TRUE_THRESHOLD) )
     {
-      printf(" spotted %s", aiGetKeywordFromIndex(predMaxIdx));
       ledSet(1<<predMaxIdx);
     }
     else
     {
       ledSet(0);
     }
-    printf("\n");
     mainSetPrintfUart(&huart4);
 
     if(netOutFilt[0] > TRUE_THRESHOLD) LED2_ORA();
@@ -368,7 +387,9 @@ int8_t appMicMfccInfereContinuous (uint8_t *args)
 
     // run FSM
     mainSetPrintfUart(&huart4);
+    cycStart = cycStageNow();
     edisonFSM(netOutFilt, &predMax, &predMaxIdx); // preds, max, idx
+    cycStageStop(CYC_STAGE_FSM, cycStart);
     mainSetPrintfUart(&huart1);
   }
 
@@ -635,8 +656,9 @@ void appNnomKwsRun(void)
 void appAudioEvent(uint8_t evt, int16_t *buf)
 {
   int16_t *inFrame, *out_mfccs, max, min;
-  uint32_t index;
+  uint32_t index, cycStart, cycPre;
 
+  cycStart = cycStageNow();
   audioEvent = evt;
 
   inFrame = buf;
@@ -645,8 +667,10 @@ void appAudioEvent(uint8_t evt, int16_t *buf)
   arm_min_q15(inFrame, MIC_FRAME_SIZE, &min, &index);
   lastAmplitude = AMPLITUDE_MOVING_AVG_ALPHA*lastAmplitude + (1.0-AMPLITUDE_MOVING_AVG_ALPHA)*((float)max - (float)min);
 
-  // calc mfccs
+  // calc mfccs, recorded as own stage
+  cycPre = cycStageNow() - cycStart;
   audioCalcMFCCs(inFrame, &out_mfccs); //*inp, **oup
+  cycStart = cycStageNow();
 
   // copy to net in buffer and cast to float
   mfccToNetInputPush(out_mfccs, in_x, in_y);
@@ -657,6 +681,7 @@ void appAudioEvent(uint8_t evt, int16_t *buf)
   for(int i = 0; i < (IN_FRAME_BUF_N_FRAMES-1)*MIC_FRAME_SIZE; i++) *dst++ = *src++;
   for(int i = 0; i < MIC_FRAME_SIZE; i++) *dst++ = inFrame[i];
 
+  cycStageRecord(CYC_STAGE_PREPROC, cycPre + (cycStageNow() - cycStart));
   processedFrames++;
 }
 
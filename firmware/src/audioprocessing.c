@@ -118,6 +118,7 @@ void audioCalcMFCCs(int16_t * inp, int16_t ** oup)
   q31_t tmpq31;
 
   uint8_t tid = utilTic();
+  uint32_t cycStart = cycStageNow();
   LED_ON();
 
   prfStart("audioCalcMFCCs");  
@@ -210,6 +211,7 @@ void audioCalcMFCCs(int16_t * inp, int16_t ** oup)
   *oup = bufDctInline;
 
   LED_OFF();
+  cycStageStop(CYC_STAGE_MFCC, cycStart);
   lastProcessingTime = utilToc(tid);
   prfStop();
 }
@@ -12,6 +12,7 @@
 #include "audioprocessing.h"
 #include "ai.h"
 #include "app.h"
+#include "cyclecounter.h"
 
 /**
  * Simple host-microcontroller interface. Commands are issued from the host with 
@@ -29,6 +30,32 @@
  *    data little-endian data
  *    crc 2 byte crc which is the byte-wise sum of all data elements to a uint16, little-endian
  *  A transfer is acknowledged by the character '^'
+ *
+ * A transfer from the host has the same format with '<' as start byte. If the host
+ * sets DATA_FORMAT_FLAG_WINDOWED in the format byte, the 'a' is followed by the
+ * 2 byte little-endian window size. The host then sends at most one window of data
+ * and waits for an 'a' after each window before sending the next one.
+ *
+ * The link_config command (0x6) takes a 4 byte big-endian baud rate and a flags byte.
+ * The MCU answers 'a' if the baud rate is supported, else 'F', and switches to the
+ * new rate. The host then sends 'a' at the new rate within HIF_BAUD_CONFIRM_TIMEOUT
+ * and the MCU confirms with '^'. Without confirmation the MCU falls back to the old
+ * rate. A baud rate of 0 keeps the current rate and only applies the flags.
+ *
+ * With HIF_FLAG_BINARY_REPORTS, continuous inference reports each prediction as
+ *  'P'+len+seq+ret+ampl+likely+spotted+pred+crc
+ *    len 1 byte number of net outputs
+ *    seq 2 byte little-endian frame counter
+ *    ret 1 byte signed inference return value
+ *    ampl 2 byte little-endian input amplitude
+ *    likely 1 byte index of most likely keyword
+ *    spotted 1 byte index of spotted keyword or 0xff
+ *    pred len x 2 byte little-endian net outputs in Q15
+ *    crc 2 byte crc over everything after 'P', same as for data transfers
+ *
+ * The telemetry command (0x8) answers with a u32 transfer tagged 0x30 that holds
+ *  clock, number of stages, n, dropped, n records of stage, tick [ms], cycles
+ * with the stage records collected since the last telemetry command, see cyclecounter.h
  */
 
 /*------------------------------------------------------------------------------
@@ -60,6 +87,7 @@ typedef struct
 #define DELIM_CRC_OK        '^'
 #define DELIM_MCU_READY     'R'
 #define DELIM_WRONG_DAT_FMT 'F'
+#define DELIM_PREDICTION    'P'
 
 /*------------------------------------------------------------------------------
  * Settings
@@ -71,11 +99,39 @@ typedef struct
 
 #define CRC_SEED 0x1234
 
+/**
+ * Bytes the host may send in windowed mode before waiting for an ack. The UART is
+ * read in polling mode, so no data may arrive while the ack is transmitted.
+ */
+#define HIF_RX_WINDOW 1024
+
+/**
+ * Supported baud rates for link_config and time in ms the host has to confirm the
+ * new rate
+ */
+#define HIF_BAUD_MIN 9600
+#define HIF_BAUD_MAX 4000000
+#define HIF_BAUD_CONFIRM_TIMEOUT 1000
+
+/**
+ * Largest number of net outputs in a prediction frame
+ */
+#define HIF_PRED_MAX_LEN 32
+
+/**
+ * Stage records per telemetry transfer and words in front of them
+ */
+#define HIF_TELEMETRY_MAX_RECORDS 128
+#define HIF_TELEMETRY_HDR_LEN 4
+
 /*------------------------------------------------------------------------------
  * Private data
  * ---------------------------------------------------------------------------*/
 static const uint8_t fmtToNbytes[] = {1,1,2,2,4,4,4};
 
+static bool binaryReports = false;
+static uint16_t predictionSeq = 0;
+
 /*------------------------------------------------------------------------------
  * Prototypes
  * ---------------------------------------------------------------------------*/
@@ -83,6 +139,7 @@ static void sendDataTransferHeader(hiDataFormat_t fmt, uint8_t tag, uint32_t len
 static uint16_t calcCcrSum(void * data, uint32_t len);
 static int8_t checkSendAck(void);
 static int8_t waitForByte (uint8_t b, uint32_t timeout);
+static void setBaudrate(uint32_t baud);
 
 // wrappers
 static int8_t verPrintWrap(uint8_t* args);
@@ -92,6 +149,9 @@ static int8_t micHostSampleRequestPreprocessedManualWrap(uint8_t* args);
 static int8_t audioMELSingleBatchWrap(uint8_t* args);
 static int8_t aiRunInferenceHifWrap(uint8_t* args);
 static int8_t aiPrintInfoWrap(uint8_t* args);
+static int8_t linkConfigWrap(uint8_t* args);
+static int8_t aiRunBatchInferenceHifWrap(uint8_t* args);
+static int8_t telemetryWrap(uint8_t* args);
 
 static const hifCommand_t cmds [] = {
   // cmdByte, Function pointer, arg count bytes
@@ -107,6 +167,9 @@ static const hifCommand_t cmds [] = {
   {0x3, aiRunInferenceHifWrap, 0},
   {0x4, appHifMfccAndInference, 0},
   {0x5, appHifMicMfccInfere, 0},
+  {0x6, linkConfigWrap, 5},
+  {0x7, aiRunBatchInferenceHifWrap, 2},
+  {0x8, telemetryWrap, 0},
   // end
   {0, NULL, 0}
 };
@@ -267,10 +330,11 @@ void hiSendF32(float * data, uint32_t len, uint8_t tag)
  */
 uint32_t hiReceive(void * data, uint32_t maxlen, hiDataFormat_t fmt, uint8_t * tag)
 {
-  uint32_t nBytes, length;
+  uint32_t nBytes, length, received, chunk;
   uint16_t crc_in, crc_out;
   uint8_t tmp[7]; 
   hiDataFormat_t inFmt;
+  bool windowed;
 
   // wait for start byte
   waitForByte(DELIM_HOST_TO_MCU, 0);
@@ -284,7 +348,8 @@ uint32_t hiReceive(void * data, uint32_t maxlen, hiDataFormat_t fmt, uint8_t * t
   HAL_UART_Receive(&huart1, &tmp[0], 6, HAL_MAX_DELAY);
 
   // calculate size
-  inFmt = tmp[0];
+  windowed = (tmp[0] & DATA_FORMAT_FLAG_WINDOWED) != 0;
+  inFmt = tmp[0] & ~DATA_FORMAT_FLAG_WINDOWED;
   *tag = tmp[1];
   length = tmp[2] | (tmp[3]<<8) | (tmp[4]<<16) | (tmp[5]<<24);
   nBytes = fmtToNbytes[inFmt-0x30]*length;
@@ -297,13 +362,29 @@ uint32_t hiReceive(void * data, uint32_t maxlen, hiDataFormat_t fmt, uint8_t * t
     return 0;
   }
 
-  // send byte to ack transfer
+  // send byte to ack transfer, in windowed mode followed by the window size
   tmp[0] = DELIM_ACK;
-  HAL_UART_Transmit(&huart1, (uint8_t*)tmp, 1, HAL_MAX_DELAY);
+  tmp[1] = (HIF_RX_WINDOW >> 0) & 0xff;
+  tmp[2] = (HIF_RX_WINDOW >> 8) & 0xff;
+  HAL_UART_Transmit(&huart1, (uint8_t*)tmp, windowed ? 3 : 1, HAL_MAX_DELAY);
 
   // read data
   nBytes = (nBytes > maxlen) ? maxlen : nBytes;
-  HAL_UART_Receive(&huart1, (uint8_t*)data, nBytes, HAL_MAX_DELAY);
+  if(windowed)
+  {
+    // ack each window, host sends next window only after the ack
+    for(received = 0; received < nBytes; received += chunk)
+    {
+      chunk = ((nBytes - received) > HIF_RX_WINDOW) ? HIF_RX_WINDOW : (nBytes - received);
+      HAL_UART_Receive(&huart1, (uint8_t*)data + received, chunk, HAL_MAX_DELAY);
+      tmp[0] = DELIM_ACK;
+      HAL_UART_Transmit(&huart1, (uint8_t*)tmp, 1, HAL_MAX_DELAY);
+    }
+  }
+  else
+  {
+    HAL_UART_Receive(&huart1, (uint8_t*)data, nBytes, HAL_MAX_DELAY);
+  }
 
   // receive CRC
   HAL_UART_Receive(&huart1, (uint8_t*)&crc_in, 2, HAL_MAX_DELAY);
@@ -337,6 +418,59 @@ void hiSendMCUReady(void)
   HAL_UART_Transmit(&huart1, (uint8_t*)&tmp, 1, HAL_MAX_DELAY);
 }
 
+/**
+ * @brief Send a binary prediction frame, used instead of the text report if the host
+ * requested HIF_FLAG_BINARY_REPORTS
+ * @details 
+ * 
+ * @param pred net output, scaled to [0,1]
+ * @param len number of net outputs
+ * @param ret inference return value
+ * @param ampl input amplitude
+ * @param likely index of most likely keyword
+ * @param spotted index of spotted keyword or 0xff if none
+ */
+void hiSendPrediction(float * pred, uint8_t len, int8_t ret, float ampl, uint8_t likely, uint8_t spotted)
+{
+  uint8_t tmp[10+2*HIF_PRED_MAX_LEN];
+  uint16_t u16, crc;
+  uint32_t i, off;
+
+  if(len > HIF_PRED_MAX_LEN) len = HIF_PRED_MAX_LEN;
+
+  // assemble frame
+  tmp[0] = DELIM_PREDICTION;
+  tmp[1] = len;
+  tmp[2] = (predictionSeq >> 0) & 0xff;
+  tmp[3] = (predictionSeq >> 8) & 0xff;
+  tmp[4] = (uint8_t)ret;
+  u16 = (ampl < 0.0) ? 0 : (ampl > 65535.0) ? 65535 : (uint16_t)ampl;
+  tmp[5] = (u16 >> 0) & 0xff;
+  tmp[6] = (u16 >> 8) & 0xff;
+  tmp[7] = likely;
+  tmp[8] = spotted;
+  off = 9;
+  for(i = 0; i < len; i++)
+  {
+    u16 = (pred[i] < 0.0) ? 0 : (pred[i] > 1.0) ? 32767 : (uint16_t)(pred[i]*32767.0);
+    tmp[off++] = (u16 >> 0) & 0xff;
+    tmp[off++] = (u16 >> 8) & 0xff;
+  }
+  crc = calcCcrSum(&tmp[1], off-1);
+  tmp[off++] = (crc >> 0) & 0xff;
+  tmp[off++] = (crc >> 8) & 0xff;
+  HAL_UART_Transmit(&huart1, tmp, off, HAL_MAX_DELAY);
+  predictionSeq++;
+}
+
+/**
+ * @brief True if live inference results are reported as binary prediction frames
+ */
+bool hiBinaryReports(void)
+{
+  return binaryReports;
+}
+
 /*------------------------------------------------------------------------------
  * Privates
  * ---------------------------------------------------------------------------*/
@@ -413,6 +547,20 @@ static int8_t waitForByte (uint8_t b, uint32_t timeout)
 }
 
 
+/**
+ * @brief Reconfigure UART to a new baud rate
+ * @details waits for the last byte to be sent before switching
+ * 
+ * @param baud new baud rate
+ */
+static void setBaudrate(uint32_t baud)
+{
+  while(!(huart1.Instance->ISR & UART_FLAG_TC));
+  huart1.Init.BaudRate = baud;
+  HAL_UART_Init(&huart1);
+}
+
+
 /*------------------------------------------------------------------------------
  * Wrapppers, could get optimized0
  * ---------------------------------------------------------------------------*/
@@ -461,6 +609,26 @@ static int8_t aiRunInferenceHifWrap(uint8_t* args)
   aiRunInferenceHif();
   return 0;
 }
+static int8_t aiRunBatchInferenceHifWrap(uint8_t* args)
+{
+  uint16_t u16;
+  u16 = args[0]<<8 | args[1];
+  aiRunBatchInferenceHif(u16);
+  return 0;
+}
+static int8_t telemetryWrap(uint8_t* args)
+{
+  static uint32_t buf[HIF_TELEMETRY_HDR_LEN + HIF_TELEMETRY_MAX_RECORDS*CYC_STAGE_RECORD_LEN];
+  uint32_t n, dropped;
+  (void)args;
+  n = cycStageHistory(&buf[HIF_TELEMETRY_HDR_LEN], HIF_TELEMETRY_MAX_RECORDS, &dropped);
+  buf[0] = SystemCoreClock;
+  buf[1] = CYC_STAGE_COUNT;
+  buf[2] = n;
+  buf[3] = dropped;
+  hiSendU32(buf, HIF_TELEMETRY_HDR_LEN + n*CYC_STAGE_RECORD_LEN, 0x30);
+  return 0;
+}
 static int8_t aiPrintInfoWrap(uint8_t* args)
 {
   (void)args;
@@ -470,6 +638,41 @@ static int8_t aiPrintInfoWrap(uint8_t* args)
   aiPrintInfo();
   return 0;
 }
+static int8_t linkConfigWrap(uint8_t* args)
+{
+  uint32_t baud, oldBaud;
+  uint8_t tmp;
+  bool binary;
+
+  baud = args[0]<<24 | args[1]<<16 | args[2]<<8 | args[3];
+  oldBaud = huart1.Init.BaudRate;
+  if(baud == 0) baud = oldBaud;
+
+  // reject unsupported rate, keep everything as is
+  if(baud < HIF_BAUD_MIN || baud > HIF_BAUD_MAX)
+  {
+    tmp = DELIM_WRONG_DAT_FMT;
+    HAL_UART_Transmit(&huart1, &tmp, 1, HAL_MAX_DELAY);
+    return -1;
+  }
+  binary = (args[4] & HIF_FLAG_BINARY_REPORTS) ? true : false;
+  tmp = DELIM_ACK;
+  HAL_UART_Transmit(&huart1, &tmp, 1, HAL_MAX_DELAY);
+
+  // switch and wait for the host to confirm on the new rate
+  setBaudrate(baud);
+  if( (HAL_UART_Receive(&huart1, &tmp, 1, HIF_BAUD_CONFIRM_TIMEOUT) != HAL_OK) || (tmp != DELIM_ACK) )
+  {
+    setBaudrate(oldBaud);
+    return -1;
+  }
+  // report format only changes once the host is known to follow
+  binaryReports = binary;
+  predictionSeq = 0;
+  tmp = DELIM_CRC_OK;
+  HAL_UART_Transmit(&huart1, &tmp, 1, HAL_MAX_DELAY);
+  return 0;
+}
 
 /*------------------------------------------------------------------------------
  * Callbacks
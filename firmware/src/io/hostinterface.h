@@ -20,6 +20,18 @@ typedef enum
   DATA_FORMAT_F32 = '6',
 } hiDataFormat_t;
 
+/**
+ * Flag or'ed to the format byte of a host to MCU transfer to request windowed
+ * transfer, see hiReceive
+ */
+#define DATA_FORMAT_FLAG_WINDOWED 0x40
+
+/**
+ * Flag of the link_config command: report live inference results as binary
+ * prediction frames instead of text, see hiSendPrediction
+ */
+#define HIF_FLAG_BINARY_REPORTS 0x01
+
 void hifRun(void);
 
 void hiSendU8(uint8_t * data, uint32_t len, uint8_t tag);
@@ -32,4 +44,6 @@ void hiSendF32(float * data, uint32_t len, uint8_t tag);
 
 uint32_t hiReceive(void * data, uint32_t maxlen, hiDataFormat_t fmt, uint8_t * tag);
 
-void hiSendMCUReady(void);
\ No newline at end of file
+void hiSendMCUReady(void);
+void hiSendPrediction(float * pred, uint8_t len, int8_t ret, float ampl, uint8_t likely, uint8_t spotted);
+bool hiBinaryReports(void);
@@ -88,6 +88,7 @@ int main(void)
              verBuildDate, verGitSha);
   micInit();
   audioInit();
+  cycStageInit();
 
   for(int i = 0; i < 7; i++)
   {
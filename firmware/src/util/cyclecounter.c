@@ -18,6 +18,15 @@ static uint32_t   time_event[CYC_MAX_EVENT_COUNT]; // events time
 static const char *event_name[CYC_MAX_EVENT_COUNT]; // events name
 static uint8_t    event_count = __PROF_STOPED; // events counter
 
+/**
+ * Stage telemetry, ring buffer of the last CYC_STAGE_HISTORY_LEN stage records
+ */
+#define CYC_STAGE_HISTORY_LEN 128
+static uint32_t stageHistory[CYC_STAGE_HISTORY_LEN][CYC_STAGE_RECORD_LEN];
+static uint32_t stageHead = 0; // next record to write
+static uint32_t stageCount = 0; // records not yet read
+static uint32_t stageDropped = 0; // records overwritten before they were read
+
 
 
 /*------------------------------------------------------------------------------
@@ -102,3 +111,76 @@ void cycProfStop(void)
   event_count = __PROF_STOPED;
 }
 
+/**
+ * @brief Enable the cycle counter for stage telemetry
+ * @details 
+ */
+void cycStageInit(void)
+{
+  CoreDebug->DEMCR |= CoreDebug_DEMCR_TRCENA_Msk;
+  DWT->CTRL |= DWT_CTRL_CYCCNTENA_Msk;
+}
+
+/**
+ * @brief Current cycle count, pass to cycStageStop at the end of the stage
+ */
+uint32_t cycStageNow(void)
+{
+  return DWT->CYCCNT;
+}
+
+/**
+ * @brief Store a record for stage, can be called from interrupt context
+ * @details 
+ * 
+ * @param stage processing stage
+ * @param cycles number of cycles the stage took
+ */
+void cycStageRecord(cycStage_t stage, uint32_t cycles)
+{
+  uint32_t primask = __get_PRIMASK();
+  __disable_irq();
+  stageHistory[stageHead][0] = stage;
+  stageHistory[stageHead][1] = HAL_GetTick();
+  stageHistory[stageHead][2] = cycles;
+  stageHead = (stageHead+1) % CYC_STAGE_HISTORY_LEN;
+  if(stageCount < CYC_STAGE_HISTORY_LEN) stageCount++;
+  else stageDropped++;
+  if(!primask) __enable_irq();
+}
+
+/**
+ * @brief Store a record for stage that started at cycle count start
+ */
+void cycStageStop(cycStage_t stage, uint32_t start)
+{
+  cycStageRecord(stage, DWT->CYCCNT - start);
+}
+
+/**
+ * @brief Copy the unread stage records, oldest first, and mark them read
+ * @details 
+ * 
+ * @param buf destination, maxRecords*CYC_STAGE_RECORD_LEN words
+ * @param maxRecords maximum number of records to copy
+ * @param dropped set to number of records lost since the last call
+ * @return number of records copied
+ */
+uint32_t cycStageHistory(uint32_t *buf, uint32_t maxRecords, uint32_t *dropped)
+{
+  uint32_t n, idx;
+  uint32_t primask = __get_PRIMASK();
+  __disable_irq();
+  n = (stageCount < maxRecords) ? stageCount : maxRecords;
+  idx = (stageHead + CYC_STAGE_HISTORY_LEN - stageCount) % CYC_STAGE_HISTORY_LEN;
+  for(uint32_t i = 0; i < n; i++)
+  {
+    for(uint32_t j = 0; j < CYC_STAGE_RECORD_LEN; j++) *buf++ = stageHistory[idx][j];
+    idx = (idx+1) % CYC_STAGE_HISTORY_LEN;
+  }
+  stageCount -= n;
+  *dropped = stageDropped;
+  stageDropped = 0;
+  if(!primask) __enable_irq();
+  return n;
+}
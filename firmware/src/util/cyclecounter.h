@@ -28,4 +28,27 @@ unsigned int getCycles(void);
 
 void cycProfStart(const char *profile_name);
 void cycProfEvent(const char *event);
-void cycProfStop(void);
\ No newline at end of file
+void cycProfStop(void);
+
+/**
+ * @brief Processing stages recorded for telemetry
+ */
+typedef enum
+{
+  CYC_STAGE_PREPROC = 0,
+  CYC_STAGE_MFCC = 1,
+  CYC_STAGE_INFERENCE = 2,
+  CYC_STAGE_FSM = 3,
+  CYC_STAGE_COUNT = 4,
+} cycStage_t;
+
+/**
+ * @brief Number of u32 words per stage record: stage, tick in ms, cycles
+ */
+#define CYC_STAGE_RECORD_LEN 3
+
+void cycStageInit(void);
+uint32_t cycStageNow(void);
+void cycStageRecord(cycStage_t stage, uint32_t cycles);
+void cycStageStop(cycStage_t stage, uint32_t start);
+uint32_t cycStageHistory(uint32_t *buf, uint32_t maxRecords, uint32_t *dropped);